@@ -4,16 +4,17 @@ import requests
 import requests
 import base64
 import io
-import matplotlib.image as mpimg
-from skimage.transform import resize
 import numpy as np
 
+# matplotlib and skimage are slow to import and only needed for images, so
+# they are imported inside the functions that use them.
+
 server = "http://152.3.65.89:5002"
 
 
 def add_files_to_server(patient_name, id_no, medical_files,
                         medical_files_b64, ecg_files, ecg_files_b64,
-                        bpms, timestamps):
+                        bpms, timestamps, hrv=None):
     """Makes post request to server to add patient information
 
        This function takes patient information as parameter inputs and makes
@@ -39,6 +40,9 @@ def add_files_to_server(patient_name, id_no, medical_files,
             Contains the heart rate for the chosen ecg file
         timestamps : Str
             Contains the date and time that the heart rate was determined
+        hrv : dict
+            Contains the heart rate variability of the chosen ecg file and
+            its packed RR intervals under "rr", or None to leave it out
 
        Returns
        -------
@@ -53,12 +57,63 @@ def add_files_to_server(patient_name, id_no, medical_files,
                 "ECG_images_b64": ecg_files_b64,
                 "heartrates": bpms,
                 "datetimes": timestamps}
+    if hrv is not None:
+        patient1["hrv"] = hrv
     r = requests.post(server + "/api/add_files", json=patient1)
     print(r.status_code)
     print(r.text)
     return r.text
 
 
+def get_patient_summary(id_no):
+    """Makes get request to server for a patient's information
+
+       This function asks the server for everything it stores about a
+       patient except the images, which keeps the response small however
+       many images the patient has. The images can be fetched one at a
+       time with get_image_b64.
+
+       Parameters
+        ----------
+        id_no : int
+            Contains the patient's medical record / ID number
+
+       Returns
+       -------
+        Dict
+            Containing the patient's information, with the number of
+            medical and ecg images
+       """
+    r = requests.get(server + "/api/summary/{}".format(id_no))
+    return r.json()
+
+
+def get_image_b64(id_no, kind, index):
+    """Makes get request to server for one image of a patient
+
+       Parameters
+        ----------
+        id_no : int
+            Contains the patient's medical record / ID number
+        kind : Str
+            Contains "medical" or "ecg"
+        index : int
+            Contains the position of the image in the patient's list of
+            file names, where -1 is the latest image
+
+       Returns
+       -------
+        String or None
+            Containing the b64 string for the image, or None if the
+            server could not return it
+       """
+    r = requests.get(server + "/api/images/{}/{}/{}".format(id_no, kind,
+                                                            index))
+    if r.status_code != 200:
+        return None
+    return convert_bytes_to_b64_string(r.content)
+
+
 def convert_file_to_b64_string(filename):
     """Converts image to b64 string
 
@@ -86,6 +141,25 @@ def convert_file_to_b64_string(filename):
     return b64_string
 
 
+def convert_bytes_to_b64_string(image_bytes):
+    """Converts image bytes held in memory to a b64 string
+
+       This function does the same as convert_file_to_b64_string for an
+       image that was rendered in memory and never saved to a file.
+
+       Parameters
+        ----------
+        image_bytes : bytes
+            Contains the encoded image
+
+       Returns
+       -------
+        String
+            Containing the b64 string for the image
+       """
+    return str(base64.b64encode(image_bytes), encoding='utf-8')
+
+
 def b64_to_ndarray(b64):
     """Converts a b64 string into an ndarray
 
@@ -105,6 +179,7 @@ def b64_to_ndarray(b64):
        array
            Containing the converted image as a ndarray
        """
+    import matplotlib.image as mpimg
     image_bytes = base64.b64decode(b64)
     image_buf = io.BytesIO(image_bytes)
     img_ndarray = mpimg.imread(image_buf, format='JPG')
@@ -153,6 +228,7 @@ def resize_image(nd):
        array
            Containing the ndarray representing the resized image
        """
+    from skimage.transform import resize
     resized_nd = resize(nd, (250, 250)) * 255
     resized_nd = resized_nd.astype(np.uint8)
     return resized_nd
@@ -214,12 +290,12 @@ def main():
     print(r.text)
 
     # Add patient with full data
-    add_files_to_server("Yume Choi", 5, "y1.png", "abc", "y2.png", "abc",
+    add_files_to_server("Yume Choi", 5, "y1.png", "YWJj", "y2.png", "YWJj",
                         86, "2020-03-09 11:00:36")
 
     # Add patient with full data, Strings intead of Ints
-    add_files_to_server("Phoebe Dijour", "1", "p1.png", "abc", "p2.png",
-                        "abc", "90", "2021-04-15 16:12:23")
+    add_files_to_server("Phoebe Dijour", "1", "p1.png", "YWJj", "p2.png",
+                        "YWJj", "90", "2021-04-15 16:12:23")
 
     # Add patient with partial data (just ID)
     add_files_to_server("", "10", "", "", "", "", "", "")
@@ -228,43 +304,43 @@ def main():
     add_files_to_server("Rachel Lopez", "11", "", "", "", "", "", "")
 
     # Add patient with partial data (medical image)
-    add_files_to_server("", 2, "m1.png", "abc", "", "", "",
+    add_files_to_server("", 2, "m1.png", "YWJj", "", "", "",
                         "")
 
     # Add patient with partial data (name, ecg image)
-    add_files_to_server("Michael Tian", 3, "", "", "t2.png", "abc",
+    add_files_to_server("Michael Tian", 3, "", "", "t2.png", "YWJj",
                         90, "2018-10-25 09:25:20")
 
     # Check for no medical record number added
-    add_files_to_server("Sarah Yu", "", "s1.png", "abc", "s2.png",
-                        "abc", 80, "2019-02-22 22:12:22")
+    add_files_to_server("Sarah Yu", "", "s1.png", "YWJj", "s2.png",
+                        "YWJj", 80, "2019-02-22 22:12:22")
 
     # Check for bad data type
-    add_files_to_server("Sarah Yu", "a", "s1.png", "abc", "s2.png",
-                        "abc", 80, "2019-02-22 22:12:22")
+    add_files_to_server("Sarah Yu", "a", "s1.png", "YWJj", "s2.png",
+                        "YWJj", 80, "2019-02-22 22:12:22")
 
     # Check for bad data type
-    add_files_to_server("Sarah Yu", 7, 3, "abc", "s2.png", "abc", 80,
+    add_files_to_server("Sarah Yu", 7, 3, "YWJj", "s2.png", "YWJj", 80,
                         "2019-02-22 22:12:22")
 
     # Add data for existing patient with full data
-    add_files_to_server("Yume Choi", 5, "y3.png", "abc", "y4.png", "abc",
+    add_files_to_server("Yume Choi", 5, "y3.png", "YWJj", "y4.png", "YWJj",
                         98, "2021-10-06 11:11:40")
 
     # Add data for existing patient with partial data (only medical image)
-    add_files_to_server("Meghan Doyle", 2, "m2.png", "abc", "m3.png", "abc",
+    add_files_to_server("Meghan Doyle", 2, "m2.png", "YWJj", "m3.png", "YWJj",
                         60, "2019-10-12 12:12:40")
 
     # Add data for existing patient with partial data (name, ecg image)
-    add_files_to_server("", 3, "t3.png", "abc", "t4.png", "abc", 60,
+    add_files_to_server("", 3, "t3.png", "YWJj", "t4.png", "YWJj", 60,
                         "2021-11-13 08:09:10")
 
     # Add partial data for existing patient with full data
-    add_files_to_server("", 5, "", "", "y6.png", "abc", 98,
+    add_files_to_server("", 5, "", "", "y6.png", "YWJj", 98,
                         "2021-11-08 11:29:59")
 
     # New name entered for existing patient ID
-    add_files_to_server("Youme Choi", 5, "y7.png", "abc", "y8.png", "abc",
+    add_files_to_server("Youme Choi", 5, "y7.png", "YWJj", "y8.png", "YWJj",
                         98, "2021-12-03 04:09:32")
 
     r = requests.get(server + "/api/record_numbers")
@@ -274,6 +350,8 @@ def main():
     print(r.status_code)
     print(r.text)
 
+    print(get_patient_summary(3))
+
 
 if __name__ == '__main__':
     main()
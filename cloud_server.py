@@ -1,13 +1,21 @@
 # cloud_server.py
 
+import argparse
 import pymodm.errors
-from flask import Flask, request, jsonify
+import pymongo.errors
+from flask import Flask, Response, request, jsonify
 import logging
 from pymodm import connect
-from database_definitions import Patient
-from cloud_client import convert_file_to_b64_string
+from bson import ObjectId
+from database_definitions import Patient, Image
+from cloud_client import convert_file_to_b64_string, \
+    convert_bytes_to_b64_string
 import base64
+import binascii
 import io
+import mimetypes
+import threading
+import time as timer
 import matplotlib.image as mpimg
 from skimage.transform import resize
 import numpy as np
@@ -110,6 +118,72 @@ def get_info():
     return jsonify(info)
 
 
+@app.route("/api/images/<image_id>", methods=["GET"])
+def get_image(image_id):
+    """Called to return the bytes of one image
+
+       This is a "GET" route that returns an image exactly as it was
+       uploaded, with its media type, without encoding it as a b64 string.
+       The ids of the images of a patient are returned by get_info.
+
+       Returns
+       -------
+       bytes
+           Containing the image, or an error message with the status code
+           404 if there is no image with the id
+       """
+    image = find_image(image_id)
+    if image is None:
+        return "No image with id {}".format(image_id), 404
+    return Response(bytes(image.data), mimetype=image.content_type)
+
+
+@app.route("/api/summary/<int:record_number>", methods=["GET"])
+def get_summary(record_number):
+    """Called to return the information about a patient without images
+
+       This is a "GET" route that returns what get_info returns except the
+       images themselves, with the number of images of each kind. It is
+       meant for monitoring stations that refresh the patient often and
+       fetch only the images they display from the images route.
+
+       Returns
+       -------
+       JSON String
+           Containing a dictionary of the patient's information, or an
+           error message with the status code 404 if there is no patient
+           with the record number
+       """
+    summary = retrieve_summary(record_number)
+    if summary is None:
+        return "No patient with record number {}".format(record_number), 404
+    return jsonify(summary)
+
+
+@app.route("/api/images/<int:record_number>/<kind>/<int(signed=True):index>",
+           methods=["GET"])
+def get_patient_image(record_number, kind, index):
+    """Called to return one image of a patient by its position
+
+       This is a "GET" route that returns the bytes of one "medical" or
+       "ecg" image of a patient, with its media type, like the images
+       route. The index is the position of the image in the list of file
+       names returned by get_summary, and negative indices count from the
+       end, so -1 is the latest image.
+
+       Returns
+       -------
+       bytes
+           Containing the image, or an error message with the status code
+           404 if the patient or the image does not exist
+       """
+    image = find_patient_image(record_number, kind, index)
+    if image is None:
+        return "No {} image {} for patient {}".format(
+            kind, index, record_number), 404
+    return Response(bytes(image.data), mimetype=image.content_type)
+
+
 expected_input = {"patient_name": str,
                   "record_number": int,
                   "medical_image_files": str,
@@ -119,8 +193,30 @@ expected_input = {"patient_name": str,
                   "heartrates": int,
                   "datetimes": str}
 
+# Keys that may be left out of the input, such as by older clients
+optional_input = {"hrv": dict}
+
+# Keys holding an image as a b64 string, which is decoded once on arrival
+b64_input = ["medical_images_b64", "ECG_images_b64"]
 
-def validate_input(in_data, expected_input):
+# Seconds for which list_record_numbers reuses its last result, which bounds
+# how stale it can be after writes made by other server processes
+RECORD_NUMBER_TTL = 5.0
+record_number_cache = {"numbers": None, "time": 0.0, "generation": 0}
+_record_number_lock = threading.Lock()
+
+# Fields returned by get_summary, which leave out the images themselves
+SUMMARY_FIELDS = ["name", "medical_images", "medical_image_ids",
+                  "ecg_images", "ecg_image_ids", "heart_rates", "datetimes",
+                  "hrv"]
+
+# First bytes of the image formats that are recognized without a file name
+IMAGE_SIGNATURES = [(b"\x89PNG\r\n\x1a\n", "image/png"),
+                    (b"\xff\xd8\xff", "image/jpeg"),
+                    (b"GIF8", "image/gif")]
+
+
+def validate_input(in_data, expected_input, optional_input=None):
     """Determines whether an input is valid to a route
 
        This function first checks if in_data is a dictionary, the required type
@@ -137,7 +233,9 @@ def validate_input(in_data, expected_input):
        interest has the type specified in expected_input. If not, an error
        string specifying they key with the wrong data type is returned along
        with the code 400. If all these checks pass, then the boolean value
-       TRUE will be returned along with the status code 200.
+       TRUE will be returned along with the status code 200. Keys in
+       optional_input may be missing, but must have the right data type
+       when they are given.
 
        Parameters
         ----------
@@ -146,6 +244,9 @@ def validate_input(in_data, expected_input):
        expected_input : Dict
            Contains the expected format of the in_data including
            all keys and corresponding data types for values
+       optional_input : Dict
+           Contains the keys that may be left out of in_data and the data
+           types of their values, or None if every key is required
 
        Returns
        -------
@@ -172,6 +273,9 @@ def validate_input(in_data, expected_input):
         else:
             if type(in_data[key]) is not expected_input[key]:
                 return "The key {} has the wrong data type".format(key), 400
+    for key in optional_input or {}:
+        if key in in_data and type(in_data[key]) is not optional_input[key]:
+            return "The key {} has the wrong data type".format(key), 400
     return True, 200
 
 
@@ -180,13 +284,12 @@ def new_or_old(in_data):
        to add or update patient in database
 
        This function first validates that the input is in the correct format
-       using the validate_input function. It then uses the find_patient
-       function to determine if the patient already exists in the database
-       using the patient's medical record number. If the patient does not exist
-       in the database, this function calls the add_database_entry function and
-       returns a message that the patient was added. If the patient does exist
-       in the database, this function calls the add_patient_file function and
-       returns a message that the patient was updated.
+       using the validate_input function and decodes the images with the
+       check_b64 function. It then calls the upsert_patient function, which
+       adds the upload to the patient with the medical record number, or
+       creates the patient if it does not exist yet, in one atomic database
+       operation. It returns a message that says whether the patient was
+       added or updated.
 
        Parameters
        ----------
@@ -200,31 +303,61 @@ def new_or_old(in_data):
        Dict
            Containing the input data with int value confirmed
        """
-    error_string, status_code = validate_input(in_data, expected_input)
+    error_string, status_code = validate_input(in_data, expected_input,
+                                               optional_input)
     if error_string is not True:
         return error_string, status_code
-    if not find_patient(in_data["record_number"]):
-        add_database_entry(in_data["patient_name"],
+    for key in b64_input:
+        if in_data[key] != "":
+            val = check_b64(in_data, key)
+            if isinstance(val, str):
+                return val, 400
+    added = upsert_patient(in_data["patient_name"],
                            in_data["record_number"],
                            in_data["medical_image_files"],
                            in_data["medical_images_b64"],
                            in_data["ECG_image_files"],
                            in_data["ECG_images_b64"],
                            in_data["heartrates"],
-                           in_data["datetimes"])
+                           in_data["datetimes"],
+                           in_data.get("hrv"))
+    if added:
         return "Added patient {}".format(in_data["record_number"])
     else:
-        add_patient_file(in_data["patient_name"],
-                         in_data["record_number"],
-                         in_data["medical_image_files"],
-                         in_data["medical_images_b64"],
-                         in_data["ECG_image_files"],
-                         in_data["ECG_images_b64"],
-                         in_data["heartrates"],
-                         in_data["datetimes"])
         return "Updated patient {}".format(in_data["record_number"])
 
 
+def check_b64(in_data, key):
+    """Decodes the b64 string of an image in the input
+
+       This function decodes the b64 string associated with the key
+       parameter in the dictionary in_data and replaces it with the image
+       bytes, so the image is decoded only once however it is stored. If
+       the value is not a valid b64 string, the error message is returned.
+
+       Parameters
+       ----------
+       in_data : Dict
+           Contains the input data to a route
+       key : Str
+           Contains the key whose value will be decoded
+
+       Returns
+       -------
+       String
+           Containing relevant error message if not a b64 string
+       Dict
+           Containing the input data with the image bytes
+       """
+    err_msg = "The value corresponding to the key {} " \
+              "is not a valid b64 string.".format(key)
+    try:
+        in_data[key] = decode_image(in_data[key])
+    except (binascii.Error, ValueError):
+        return err_msg
+    return in_data
+
+
 def check_int(in_data, key):
     """Checks whether the key value is an int
 
@@ -261,23 +394,16 @@ def check_int(in_data, key):
 
 
 def add_database_entry(patient_name, id_no, medical_file, medical_b64,
-                       ecg_file, ecg_b64, bpm, timestamp):
+                       ecg_file, ecg_b64, bpm, timestamp, hrv=None):
     """Adds patient to database using GUI inputs
 
        This function uses the GUI inputs (patient name, medical record number,
        medical image file name, medical image b64 string, ecg image file name,
        ecg image b64 string, heart rate, and timestamp of heart rate) to add a
-       patient to the database. If a name was not entered, the name defaults to
-       "N/A". Once the name is specified, a Patient object is created with the
-       name and medical record number of the patient. Then, if the medical
-       image file name is not an empty string, meaning the user has selected an
-       image, the function adds the medical image file name and the b64 string
-       to the database. Similarly, if the ECG image file name is not an empty
-       string, meaning that the user has selected an image, the function adds
-       the ECG image file name, the b64 string, the heart rate, and the
-       timestamp to the database. It then saves the patient and logs that a
-       new patient has been entered into the database. It returns the patient
-       that has been saved.
+       patient to the database with the upsert_patient function. If a name
+       was not entered, the name defaults to "N/A". It then reads the saved
+       patient back and returns it, for callers that need the Patient
+       object; the /api/add_files route uses upsert_patient alone.
 
        Parameters
        ----------
@@ -287,37 +413,267 @@ def add_database_entry(patient_name, id_no, medical_file, medical_b64,
             Contains the patient's medical record / ID number
         medical_file : Str
             Contains the file name of the medical image
-        medical_b64 : Str
-            Contains the b64 string of the medical image
+        medical_b64 : bytes or Str
+            Contains the medical image, as bytes or as its b64 string
         ecg_file : Str
             Contains the file name of the ecg image
-        ecg_b64 : Str
-            Contains the b64 string of the ecg image
+        ecg_b64 : bytes or Str
+            Contains the ecg image, as bytes or as its b64 string
         bpm : int
             Contains the heart rate for the chosen ecg file
         timestamp : Str
             Contains the date and time that the heart rate was determined
+        hrv : Dict
+            Contains the heart rate variability of the chosen ecg file and
+            its RR intervals packed by ecg_analysis.encode_rr under "rr",
+            or None if the client did not send them
 
        Returns
        -------
        Patient object
            Containing the patient that was added to the database
        """
-    if patient_name == "":
-        patient_name = "N/A"
-    patient_to_add = Patient(name=patient_name,
-                             medical_record_number=id_no)
-    if medical_file != "":
-        patient_to_add.medical_images.append(medical_file)
-        patient_to_add.medical_images_b64.append(medical_b64)
-    if ecg_file != "":
-        patient_to_add.ecg_images.append(ecg_file)
-        patient_to_add.ecg_images_b64.append(ecg_b64)
-        patient_to_add.heart_rates.append(bpm)
-        patient_to_add.datetimes.append(timestamp)
-    answer = patient_to_add.save()
-    logging.info("Added new patient into database with id: {}".format(id_no))
-    return answer
+    upsert_patient(patient_name, id_no, medical_file, medical_b64, ecg_file,
+                   ecg_b64, bpm, timestamp, hrv)
+    return find_patient(id_no)
+
+
+def upsert_patient(patient_name, id_no, medical_file, medical_b64,
+                   ecg_file, ecg_b64, bpm, timestamp, hrv=None):
+    """Adds an upload to a patient in one atomic database operation
+
+       This function first saves the images in the image collection. It
+       then sends a single find_one_and_update with upsert to the patient
+       collection. The update appends the file names, image ids, heart
+       rate, timestamp and heart rate variability with $push, sets the
+       name with $set if one was entered, and sets the name to "N/A" with
+       $setOnInsert if the patient is new and no name was entered. Mongo
+       applies the update to the stored document, so the existing images
+       and lists are never read or rewritten, and concurrent uploads for
+       the same patient cannot overwrite each other. Only the previous name
+       is returned by the database, which tells whether the patient was
+       new and whether the name changed, in which case a warning is logged.
+       If two uploads create the same new patient at once, the one that
+       loses the insert is retried as an update. If the upload still fails,
+       the images it saved are deleted again before the error is raised, so
+       no image is left without a patient that refers to it.
+
+       Parameters
+       ----------
+        patient_name : Str
+            Contains the patient's name
+        id_no : int
+            Contains the patient's medical record / ID number
+        medical_file : Str
+            Contains the file name of the medical image
+        medical_b64 : bytes or Str
+            Contains the medical image, as bytes or as its b64 string
+        ecg_file : Str
+            Contains the file name of the ecg image
+        ecg_b64 : bytes or Str
+            Contains the ecg image, as bytes or as its b64 string
+        bpm : int
+            Contains the heart rate for the chosen ecg file
+        timestamp : Str
+            Contains the date and time that the heart rate was determined
+        hrv : Dict
+            Contains the heart rate variability of the chosen ecg file and
+            its RR intervals packed by ecg_analysis.encode_rr under "rr",
+            or None if the client did not send them
+
+       Returns
+       -------
+       Boolean
+           Containing True if the patient was added and False if an
+           existing patient was updated
+       """
+    push = {}
+    stored = []
+    try:
+        if medical_file != "":
+            push["medical_images"] = medical_file
+            push["medical_image_ids"] = store_image(id_no, "medical",
+                                                    medical_file, medical_b64)
+            stored.append(push["medical_image_ids"])
+        if ecg_file != "":
+            push["ecg_images"] = ecg_file
+            push["ecg_image_ids"] = store_image(id_no, "ecg", ecg_file,
+                                                ecg_b64)
+            stored.append(push["ecg_image_ids"])
+            push["heart_rates"] = bpm
+            push["datetimes"] = timestamp
+            push["hrv"] = hrv or {}
+        update = {"$setOnInsert": {"_cls": Patient._mongometa.object_name}}
+        if patient_name != "":
+            update["$set"] = {"name": patient_name}
+        else:
+            update["$setOnInsert"]["name"] = "N/A"
+        if push:
+            update["$push"] = push
+        collection = Patient._mongometa.collection
+        try:
+            previous = collection.find_one_and_update(
+                {"_id": id_no}, update, projection={"name": True},
+                upsert=True)
+        except pymongo.errors.DuplicateKeyError:
+            previous = collection.find_one_and_update(
+                {"_id": id_no}, update, projection={"name": True})
+    except Exception:
+        if stored:
+            Image._mongometa.collection.delete_many({"_id": {"$in": stored}})
+            logging.error("Removed the images of a failed upload for "
+                          "patient {}".format(id_no))
+        raise
+    if previous is None:
+        invalidate_record_numbers()
+        logging.info("Added new patient into database with id: {}"
+                     .format(id_no))
+        return True
+    if patient_name != "" and patient_name != previous.get("name"):
+        logging.warning("Entered patient name does not match "
+                        "records for {}. Patient name will now "
+                        "be set to {}".format(id_no, patient_name))
+    logging.info("Updated patient with id: {}".format(id_no))
+    return False
+
+
+def decode_image(image):
+    """Converts an image received as a b64 string into bytes
+
+       Parameters
+       ----------
+        image : Str or bytes
+            Contains the b64 string of the image, or its bytes if it was
+            already decoded by check_b64
+
+       Returns
+       -------
+       bytes
+           Containing the encoded image
+       """
+    if isinstance(image, bytes):
+        return image
+    return base64.b64decode(image, validate=True)
+
+
+def guess_content_type(data, filename):
+    """Determines the media type of an image
+
+       This function recognizes PNG, JPEG and GIF images by their first
+       bytes and otherwise guesses the type from the file name extension.
+
+       Parameters
+       ----------
+        data : bytes
+            Contains the encoded image
+        filename : Str
+            Contains the file name of the image
+
+       Returns
+       -------
+       String
+           Containing the media type, such as "image/png"
+       """
+    for signature, content_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    guess, _ = mimetypes.guess_type(filename)
+    return guess or "application/octet-stream"
+
+
+def store_image(id_no, kind, filename, image):
+    """Saves one image in the image collection
+
+       This function saves the bytes of an image as its own Image document,
+       together with its media type and size, so that the patient document
+       only needs to hold the id of the image and does not grow with the
+       size of the images. Images are stored as binary data, which takes a
+       quarter less space than their b64 string.
+
+       Parameters
+       ----------
+        id_no : int
+            Contains the patient's medical record / ID number
+        kind : Str
+            Contains "medical" or "ecg"
+        filename : Str
+            Contains the file name of the image
+        image : bytes or Str
+            Contains the encoded image, or its b64 string
+
+       Returns
+       -------
+       ObjectId
+           Containing the id of the saved image
+       """
+    data = decode_image(image)
+    saved = Image(medical_record_number=id_no, kind=kind, filename=filename,
+                  content_type=guess_content_type(data, filename),
+                  size=len(data), data=data).save()
+    return saved.pk
+
+
+def load_images(image_ids):
+    """Looks up the bytes of several images at once
+
+       This function fetches every image in a single query and returns
+       their bytes in the order of the ids. An id without an image, such
+       as one whose image was deleted, gives empty bytes.
+
+       Parameters
+       ----------
+        image_ids : list
+            Contains the ObjectIds of the images
+
+       Returns
+       -------
+       list
+           Containing the bytes of every image
+       """
+    if not image_ids:
+        return []
+    found = {image.pk: bytes(image.data) for image in
+             Image.objects.raw({"_id": {"$in": list(image_ids)}})}
+    return [found.get(image_id, b"") for image_id in image_ids]
+
+
+def find_image(image_id):
+    """Finds one image by its id
+
+       Parameters
+       ----------
+        image_id : Str or ObjectId
+            Contains the id of the image, or its hexadecimal string
+
+       Returns
+       -------
+       Image object
+           Containing the image, or None if there is no image with the id
+       """
+    if not ObjectId.is_valid(image_id):
+        return None
+    try:
+        image = Image.objects.raw({"_id": ObjectId(image_id)}).first()
+    except pymodm.errors.DoesNotExist:
+        image = None
+    return image
+
+
+def load_images_b64(image_ids):
+    """Looks up several images as b64 strings for the JSON routes
+
+       Parameters
+       ----------
+        image_ids : list
+            Contains the ObjectIds of the images
+
+       Returns
+       -------
+       list
+           Containing the b64 string of every image
+       """
+    return [convert_bytes_to_b64_string(data)
+            for data in load_images(image_ids)]
 
 
 def find_patient(id_no):
@@ -348,26 +704,17 @@ def find_patient(id_no):
 
 
 def add_patient_file(patient_name, id_no, medical_file, medical_b64,
-                     ecg_file, ecg_b64, bpm, timestamp):
+                     ecg_file, ecg_b64, bpm, timestamp, hrv=None):
     """Updates patient information in database using GUI inputs
 
        This function uses the GUI inputs (patient name, medical record number,
        medical image file name, medical image b64 string, ecg image file name,
        ecg image b64 string, heart rate, and timestamp of heart rate) to update
-       a patient's information in the database. It first uses the find_patient
-       function to return the Patient object with the correct medical record
-       number. If the new patient name that was entered is not an empty string,
-       it checks if the new patient name matches the patient name that already
-       exists in the database. If it does not match, it changes the patient
-       name to the most recently entered name and logs a warning that the
-       patient's name has changed. Then, if the medical image file name is not
-       an empty string, meaning the user has selected an image, the function
-       adds the medical image file name and the b64 string to the database.
-       Similarly, if the ECG image file name is not an empty string, meaning
-       that the user has selected an image, the function adds the ECG image
-       file name, the b64 string, the heart rate, and the timestamp to the
-       database. It then saves the patient and logs that a patient has been
-       updated in the database. It returns the patient that has been updated.
+       a patient's information in the database with the upsert_patient
+       function, which logs a warning if the entered name differs from the
+       stored one. It then reads the updated patient back and returns it,
+       for callers that need the Patient object; the /api/add_files route
+       uses upsert_patient alone.
 
        Parameters
        ----------
@@ -377,60 +724,75 @@ def add_patient_file(patient_name, id_no, medical_file, medical_b64,
             Contains the patient's medical record / ID number
         medical_file : Str
             Contains the file name of the medical image
-        medical_b64 : Str
-            Contains the b64 string of the medical image
+        medical_b64 : bytes or Str
+            Contains the medical image, as bytes or as its b64 string
         ecg_file : Str
             Contains the file name of the ecg image
-        ecg_b64 : Str
-            Contains the b64 string of the ecg image
+        ecg_b64 : bytes or Str
+            Contains the ecg image, as bytes or as its b64 string
         bpm : int
             Contains the heart rate for the chosen ecg file
         timestamp : Str
             Contains the date and time that the heart rate was determined
+        hrv : Dict
+            Contains the heart rate variability of the chosen ecg file and
+            its RR intervals packed by ecg_analysis.encode_rr under "rr",
+            or None if the client did not send them
 
        Returns
        -------
        Patient object
-           Containing the patient that was added to the database
+           Containing the patient that was updated in the database
        """
-    patient = find_patient(id_no)
-    if patient_name != "":
-        if patient_name != patient.name:
-            patient.name = patient_name
-            logging.warning("Entered patient name does not match "
-                            "records for {}. Patient name will now "
-                            "be set to {}".format(id_no, patient_name))
-    if medical_file != "":
-        patient.medical_images.append(medical_file)
-        patient.medical_images_b64.append(medical_b64)
-    if ecg_file != "":
-        patient.ecg_images.append(ecg_file)
-        patient.ecg_images_b64.append(ecg_b64)
-        patient.heart_rates.append(bpm)
-        patient.datetimes.append(timestamp)
-    patient.save()
-    logging.info("Updated patient with id: {}".format(id_no))
-    return patient
+    upsert_patient(patient_name, id_no, medical_file, medical_b64, ecg_file,
+                   ecg_b64, bpm, timestamp, hrv)
+    return find_patient(id_no)
 
 
 def list_record_numbers():
     """Retrieves medical record numbers for all database entries
 
-       This function queries the Mongo database to receive all
-       database entries as an iterable. Then, it parses through
-       each one and appends the medical record number of each
-       entry into a list. Finally, this list is returned.
+       This function queries the Mongo database for the _id of every
+       database entry, which is its medical record number, with a
+       projection so that no other field is sent by the database. The
+       list is kept in memory and returned again until a patient is added
+       through this server or RECORD_NUMBER_TTL seconds have passed, which
+       bounds how long patients added by another server process stay
+       unlisted. A copy of the list is returned.
 
        Returns
        -------
        List
            Containing record numbers as strings for all database entries
        """
-    results = Patient.objects.raw({})
-    all_record_numbers = []
-    for item in results:
-        all_record_numbers.append(item.medical_record_number)
-    return all_record_numbers
+    with _record_number_lock:
+        cached = record_number_cache["numbers"]
+        if cached is not None and \
+                timer.monotonic() - record_number_cache["time"] < \
+                RECORD_NUMBER_TTL:
+            return list(cached)
+        generation = record_number_cache["generation"]
+    collection = Patient._mongometa.collection
+    all_record_numbers = [item["_id"] for item in
+                          collection.find({}, {"_id": 1})]
+    with _record_number_lock:
+        if record_number_cache["generation"] == generation:
+            record_number_cache["numbers"] = all_record_numbers
+            record_number_cache["time"] = timer.monotonic()
+    return list(all_record_numbers)
+
+
+def invalidate_record_numbers():
+    """Forgets the cached list of medical record numbers
+
+       This function is called whenever a patient is added, so the next
+       call to list_record_numbers queries the database again. The
+       generation count stops a listing that started before the change
+       from caching its outdated result.
+       """
+    with _record_number_lock:
+        record_number_cache["numbers"] = None
+        record_number_cache["generation"] += 1
 
 
 def retrieve_all_info(id_no):
@@ -438,7 +800,8 @@ def retrieve_all_info(id_no):
 
        This function queries the Mongo database using the
        medical record number passed in as a parameter to receive
-       all the information in the database about that patient.
+       all the information in the database about that patient,
+       and looks up the images that the patient references.
        It then creates a dictionary to store all the information
        for the patient in appropriate keys and then returns
        that dictionary.
@@ -458,14 +821,196 @@ def retrieve_all_info(id_no):
     info = {"name": patient.name,
             "medical_record_number": patient.medical_record_number,
             "medical_images": patient.medical_images,
-            "medical_images_b64": patient.medical_images_b64,
+            "medical_images_b64":
+                load_images_b64(patient.medical_image_ids),
+            "medical_image_ids": [str(i) for i in patient.medical_image_ids],
             "ecg_images": patient.ecg_images,
-            "ecg_images_b64": patient.ecg_images_b64,
+            "ecg_images_b64": load_images_b64(patient.ecg_image_ids),
+            "ecg_image_ids": [str(i) for i in patient.ecg_image_ids],
             "heart_rates": patient.heart_rates,
-            "datetimes": patient.datetimes}
+            "datetimes": patient.datetimes,
+            "hrv": patient.hrv}
     return info
 
 
+def retrieve_summary(id_no):
+    """Retrieves the information about a patient without the images
+
+       This function queries the Mongo database for the patient with a
+       projection of SUMMARY_FIELDS, so images still stored inline in
+       records that were not migrated are not sent by the database, and
+       the image collection is not queried at all. It returns the same
+       lists as retrieve_all_info except the b64 strings of the images,
+       and the number of images of each kind.
+
+       Parameters
+       ----------
+        id_no : int
+            Contains the medical record number of interest
+
+       Returns
+       -------
+       Dict
+           Containing the information about the patient, or None if there
+           is no patient with the record number
+       """
+    collection = Patient._mongometa.collection
+    document = collection.find_one({"_id": id_no},
+                                   {field: 1 for field in SUMMARY_FIELDS})
+    if document is None:
+        return None
+    summary = {"name": document.get("name", ""),
+               "medical_record_number": id_no}
+    for field in SUMMARY_FIELDS[1:]:
+        summary[field] = document.get(field, [])
+    for field in ("medical_image_ids", "ecg_image_ids"):
+        summary[field] = [str(i) for i in summary[field]]
+    summary["num_medical_images"] = len(summary["medical_images"])
+    summary["num_ecg_images"] = len(summary["ecg_images"])
+    return summary
+
+
+def find_patient_image(id_no, kind, index):
+    """Finds one image of a patient by its kind and position
+
+       This function asks the database for the one image id at the index
+       with a $slice projection, so the other ids of the patient are not
+       sent, and then looks up that image alone. A negative index counts
+       from the end. $slice returns the last ids for a negative index, and
+       the first id if the index is further back than the list is long,
+       so the number of ids returned is checked in that case.
+
+       Parameters
+       ----------
+        id_no : int
+            Contains the patient's medical record / ID number
+        kind : Str
+            Contains "medical" or "ecg"
+        index : int
+            Contains the position of the image in the patient's list
+
+       Returns
+       -------
+       Image object
+           Containing the image, or None if the patient, kind or image
+           does not exist
+       """
+    if kind not in ("medical", "ecg"):
+        return None
+    field = "{}_image_ids".format(kind)
+    if index < 0:
+        projection = {field: {"$slice": index}}
+    else:
+        projection = {field: {"$slice": [index, 1]}}
+    projection["_id"] = 1
+    collection = Patient._mongometa.collection
+    document = collection.find_one({"_id": id_no}, projection)
+    if document is None:
+        return None
+    image_ids = document.get(field, [])
+    if not image_ids or index < 0 and len(image_ids) < -index:
+        return None
+    return find_image(image_ids[0])
+
+
+def _legacy_image(id_no, b64):
+    """Decodes an image saved by an older version of the server
+
+       Older versions stored whatever string the client sent, so a string
+       that is not valid b64 is kept as its text instead of being lost.
+
+       Parameters
+       ----------
+        id_no : int
+            Contains the patient's medical record / ID number
+        b64 : Str
+            Contains the stored b64 string of the image
+
+       Returns
+       -------
+       bytes
+           Containing the decoded image
+       """
+    try:
+        return decode_image(b64)
+    except (binascii.Error, ValueError):
+        logging.warning("Stored image of patient {} is not a valid b64 "
+                        "string and is kept as text".format(id_no))
+        return b64.encode("utf-8")
+
+
+def migrate_images():
+    """Moves stored images to the image collection as binary data
+
+       Records saved before images had their own collection hold every b64
+       string in medical_images_b64 and ecg_images_b64 lists. This function
+       finds those records with the raw pymongo collection, saves each of
+       their images as an Image, replaces the lists with the image ids and
+       removes the old fields. The _cls field that pymodm adds to its
+       queries is set as well, in case the record was saved without it. A
+       record is only changed once all of its images are saved. Image
+       documents saved before images were stored as bytes hold a b64 field
+       instead, which is decoded into data, content_type and size.
+       Migrated documents no longer match either query, so the migration
+       can be run again after an interruption.
+
+       Returns
+       -------
+       int
+           Containing the number of patient and image documents that were
+           migrated
+       """
+    collection = Patient._mongometa.collection
+    query = {"$or": [{"medical_images_b64": {"$exists": True}},
+                     {"ecg_images_b64": {"$exists": True}}]}
+    migrated = 0
+    for document in collection.find(query):
+        id_no = document["_id"]
+        update = {"_cls": Patient._mongometa.object_name}
+        for kind, names, images in [("medical", "medical_images",
+                                     "medical_images_b64"),
+                                    ("ecg", "ecg_images", "ecg_images_b64")]:
+            filenames = document.get(names, [])
+            b64_strings = document.get(images, [])
+            ids = [store_image(id_no, kind, filename,
+                               _legacy_image(id_no, b64))
+                   for filename, b64 in zip(filenames, b64_strings)]
+            update["{}_image_ids".format(kind)] = \
+                document.get("{}_image_ids".format(kind), []) + ids
+        collection.update_one({"_id": id_no},
+                              {"$set": update,
+                               "$unset": {"medical_images_b64": "",
+                                          "ecg_images_b64": ""}})
+        logging.info("Moved images of patient {} to the image collection"
+                     .format(id_no))
+        migrated += 1
+    images = Image._mongometa.collection
+    for document in images.find({"b64": {"$exists": True}}):
+        data = _legacy_image(document.get("medical_record_number"),
+                             document["b64"])
+        content_type = guess_content_type(data, document.get("filename", ""))
+        images.update_one({"_id": document["_id"]},
+                          {"$set": {"data": data,
+                                    "content_type": content_type,
+                                    "size": len(data)},
+                           "$unset": {"b64": ""}})
+        migrated += 1
+    return migrated
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the patient server")
+    parser.add_argument("--migrate-images", action="store_true",
+                        help="only move images stored by older versions to "
+                             "the image collection as bytes, which is also "
+                             "done at every start, and exit")
+    args = parser.parse_args()
     initialize_server()
-    app.run(host="0.0.0.0", port=5002)
+    # Records left by older versions are migrated before serving, so that
+    # get_info finds their images through the image ids
+    migrated = migrate_images()
+    if args.migrate_images:
+        print("Migrated {} documents".format(migrated))
+    else:
+        logging.info("Migrated {} documents at start-up".format(migrated))
+        app.run(host="0.0.0.0", port=5002)
@@ -8,14 +8,43 @@ class Patient(MongoModel):
 
     This class defines the MongoModel database entry for the Patient database.
     The fields are self-descriptive.  It is used for accessing the MongoDB
-    database through the PyMODM package.
+    database through the PyMODM package. The images themselves are kept in
+    the Image collection and only referenced here by their ids, so the size
+    of a patient document does not grow with the size of the images.
 
     """
     name = fields.CharField()
     medical_record_number = fields.IntegerField(primary_key=True)
     medical_images = fields.ListField()
-    medical_images_b64 = fields.ListField()
+    medical_image_ids = fields.ListField(fields.ObjectIdField())
     ecg_images = fields.ListField()
-    ecg_images_b64 = fields.ListField()
+    ecg_image_ids = fields.ListField(fields.ObjectIdField())
     heart_rates = fields.ListField()
     datetimes = fields.ListField()
+    hrv = fields.ListField()
+
+    class Meta:
+        # Records saved before the images moved to their own collection
+        # still hold them inline until cloud_server.migrate_images runs
+        ignore_unknown_fields = True
+
+
+class Image(MongoModel):
+    """ Database format for one uploaded image
+
+    This class defines the MongoModel database entry for a medical or ECG
+    image uploaded for a patient. The image is kept as its raw bytes, with
+    its media type and size in bytes, rather than as a b64 string.
+
+    """
+    medical_record_number = fields.IntegerField()
+    kind = fields.CharField(choices=("medical", "ecg"))
+    filename = fields.CharField()
+    content_type = fields.CharField()
+    size = fields.IntegerField()
+    data = fields.BinaryField()
+
+    class Meta:
+        # Images saved before they were stored as bytes hold a b64 string
+        # until cloud_server.migrate_images runs
+        ignore_unknown_fields = True
@@ -1,75 +1,316 @@
 # ecg_analysis.py
 
+import argparse
+import base64
+import csv
+import glob
+import importlib
+import itertools
 import json
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks, butter, filtfilt
-import math
+import os
+import threading
+import time as timer
+from concurrent.futures import ProcessPoolExecutor
 import logging
-import csv
+import numpy as np
+import ecg_binary
+from ecg_detectors import detect, DETECTORS, DEFAULT_DETECTOR
+from ecg_filters import bandpass, decimate, decimation_factor, \
+    refine_peaks, DEFAULT_BAND, DEFAULT_ORDER
+from ecg_instrument import instrumented, stage
+from ecg_preprocess import uniform
+from ecg_render import render_trace
 
+# Increase whenever a change to the analysis can change its results, so that
+# results cached by ecg_cache under an older version are recomputed.
+ANALYSIS_VERSION = 5
 
+
+@instrumented("read", lambda result, args: len(result[0]))
 def read(filename):
-    """Open file using csv reader and load variable with data
+    """Load time and voltage data from an ECG csv file into float arrays
+
+    This code parses the whole file at once with numpy instead of converting
+    every row by hand. Clean files go through the fast np.loadtxt parser;
+    files containing empty or non-numeric entries are parsed a second time
+    with a converter that turns every unparseable field into NaN. Rows with a
+    NaN time or voltage are then dropped with a single boolean mask and the
+    number of dropped rows is logged once. A non-numeric first row is treated
+    as a column header and skipped without being counted.
 
-    This code loads every five lines of the text file into an element of a list
-    called patients.
+    Binary ECG containers written by ecg_binary are recognized by their
+    first bytes and memory-mapped instead, in which case the voltage of the
+    first lead is a float32 memory map that is only read from disk when it
+    is used.
 
     :param filename: string containing the file name to-be-opened
 
-    :returns: string containing each patient's full data in a separate element
-    """
-    with open(filename) as f:
-        reader = csv.reader(f, delimiter='\t')
-        time = []
-        voltage = []
-        for i in reader:
-            both = i[0]
-            both_list = both.split(',')
-            time_val = both_list[0]
-            voltage_val = both_list[1]
-            try:
-                if not math.isnan(float(time_val)) and\
-                  not math.isnan(float(voltage_val)):
-                    time.append(float(time_val))
-                    voltage.append(float(voltage_val))
-            except ValueError:
-                logging.error("Missing data")
+    :returns: contiguous array of floats containing all time data points
+    :returns: contiguous array of floats containing all voltage data points
+    """
+    if ecg_binary.is_binary(filename):
+        time, voltage, header = ecg_binary.load(filename)
+        return time, voltage[:, 0]
+    with open(filename, encoding="utf-8-sig") as f:
+        lines = f.read().splitlines()
+    if lines and _is_header(lines[0]):
+        lines = lines[1:]
+    return _parse_lines(lines)
+
+
+def read_chunks(filename, chunk_size=65536):
+    """Load an ECG csv file a block of rows at a time
+
+    This code parses the file in the same way as read, but only holds
+    chunk_size rows in memory at once, so files of any length can be
+    processed with constant memory. Bad rows are dropped and counted per
+    chunk. Binary ECG containers are sliced from their memory map instead.
+
+    :param filename: string containing the file name to-be-opened
+    :param chunk_size: int containing the number of rows per chunk
+
+    :returns: generator of tuples containing an array of time data points
+    and an array of voltage data points for each chunk
+    """
+    if ecg_binary.is_binary(filename):
+        time, voltage, header = ecg_binary.load(filename)
+        for start in range(0, len(time), chunk_size):
+            yield (np.array(time[start:start + chunk_size]),
+                   np.array(voltage[start:start + chunk_size, 0],
+                            dtype=float))
+        return
+    with open(filename, encoding="utf-8-sig") as f:
+        first = True
+        while True:
+            lines = [line.rstrip("\r\n")
+                     for line in itertools.islice(f, chunk_size)]
+            if not lines:
+                return
+            if first and _is_header(lines[0]):
+                lines = lines[1:]
+            first = False
+            time, voltage = _parse_lines(lines)
+            if len(time):
+                yield time, voltage
+
+
+@instrumented("read", lambda result, args: len(result[0]))
+def read_leads(filename):
+    """Load time and every voltage column of a multi-lead ECG csv file
+
+    This code parses the file like read, but keeps every column after the
+    time column as one lead. A row is dropped if its time or any of its
+    leads is missing. Lead names come from the header line if the file has
+    one. Binary ECG containers are memory-mapped and keep the lead names
+    they were written with.
+
+    :param filename: string containing the file name to-be-opened
+
+    :returns: contiguous array of floats containing all time data points
+    :returns: (n_samples, n_leads) array of floats containing the voltage
+    of every lead
+    :returns: list of strings containing the name of every lead
+    """
+    if ecg_binary.is_binary(filename):
+        time, voltage, header = ecg_binary.load(filename)
+        return time, voltage, header["names"]
+    with open(filename, encoding="utf-8-sig") as f:
+        lines = f.read().splitlines()
+    names = None
+    if lines and _is_header(lines[0]):
+        names = [name.strip() for name in lines[0].split(",")[1:]]
+        lines = lines[1:]
+    num_columns = len(lines[0].split(",")) if lines else 2
+    time, voltage = _parse_lines(lines, num_columns)
+    voltage = voltage.reshape(len(time), num_columns - 1)
+    if names is None or len(names) != num_columns - 1:
+        names = ["lead {}".format(i + 1) for i in range(num_columns - 1)]
+    return time, voltage, names
+
+
+def _parse_lines(lines, num_columns=2):
+    """Parse csv lines into time and voltage arrays, dropping bad rows
+
+    :param lines: list of strings containing csv lines without a header
+    :param num_columns: int containing the number of columns to parse
+
+    :returns: contiguous array of floats containing all time data points
+    :returns: contiguous array of floats containing all voltage data points,
+    with one column per lead when there is more than one voltage column
+    """
+    data = _load_columns(lines, num_columns)
+    valid = ~np.isnan(data).any(axis=1)
+    num_bad = int(data.shape[0] - np.count_nonzero(valid))
+    if num_bad:
+        logging.error("Missing data in {} of {} rows".format(
+            num_bad, data.shape[0]))
+    time = np.ascontiguousarray(data[valid, 0])
+    if num_columns == 2:
+        voltage = np.ascontiguousarray(data[valid, 1])
+    else:
+        voltage = np.ascontiguousarray(data[valid, 1:])
     return time, voltage
 
 
-def filter(time, voltage):
+def _load_columns(lines, num_columns=2):
+    """Parse the first columns of csv lines into a 2-D array
+
+    :param lines: list of strings containing csv lines without a header
+    :param num_columns: int containing the number of columns to parse
+
+    :returns: (n_rows, num_columns) array of floats, with NaN for
+    unparseable fields
+    """
+    if not lines:
+        return np.empty((0, num_columns))
+    usecols = tuple(range(num_columns))
+    try:
+        data = np.loadtxt(lines, delimiter=",", usecols=usecols, ndmin=2)
+    except ValueError:
+        data = np.loadtxt(lines, delimiter=",", usecols=usecols, ndmin=2,
+                          converters=_to_float)
+    return data
+
+
+def _to_float(field):
+    """Convert one csv field to a float, using NaN if it is not numeric
+
+    :param field: string containing a single csv field
+
+    :returns: float containing the field value or NaN
+    """
+    try:
+        return float(field)
+    except ValueError:
+        return np.nan
+
+
+def _is_header(line):
+    """Check whether a csv line is a column header rather than data
+
+    :param line: string containing the first line of a csv file
+
+    :returns: bool that is True if no field of the line is numeric
+    """
+    for field in line.split(","):
+        try:
+            float(field)
+            return False
+        except ValueError:
+            pass
+    return True
+
+
+@instrumented("filter", lambda result, args: len(result))
+def filter(time, voltage, band=DEFAULT_BAND, order=DEFAULT_ORDER,
+           notch=None, sampling_rate=None):
     """Filter voltage data using bandpass butter filter
 
     This code filters the 1 Hz and 50 Hz noise in the voltage data using
-    a butter filter and the scipy.signal filtfilt function. It uses a third
-    order filter and Nyquist sampling frequency to calculate critical
-    frequency.
+    a third order butter filter in second-order sections form and the
+    scipy.signal sosfiltfilt function. The filter design is cached by
+    ecg_filters, so strips that share a sampling rate reuse it. The band
+    edges and order can be changed and an optional notch removes mains hum.
 
     :param time: list of floats containing all time data points
     :param voltage: list of floats containing all voltage data points
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param sampling_rate: float containing the sampling rate in Hz, or
+    None to derive it from the number of samples and the duration
 
     :returns: list of floats containing filtered voltage values
     """
-    fc = [1, 50]
-    sampling_rate = len(voltage) / duration_calc(time)
-    w = [fc[0] / (sampling_rate / 2), fc[1] / (sampling_rate / 2)]
-    b, a = butter(3, w, 'band')
-    output = filtfilt(b, a, voltage)
+    if sampling_rate is None:
+        sampling_rate = len(voltage) / duration_calc(time)
+    output = bandpass(voltage, sampling_rate, band, order, notch)
     return output
 
 
-def exceptions(voltage):
+VOLTAGE_LIMIT = 300
+
+
+def signal_stats(voltage, limit=VOLTAGE_LIMIT, min_flat_run=50,
+                 min_saturation_run=3):
+    """Compute the summary statistics of a strip with vectorized numpy
+
+    This code replaces the separate Python loops of exceptions and
+    extremes with one set of whole-array operations. Besides the minimum,
+    maximum, mean and RMS voltage it finds where the signal left the normal
+    range, where it stayed exactly flat (a disconnected lead) and where it
+    stuck at its minimum or maximum (a saturated amplifier). Each of these
+    is reported as a list of [start, end) sample index ranges.
+
+    :param voltage: list of floats containing all voltage data points
+    :param limit: float containing the largest normal absolute voltage
+    :param min_flat_run: int containing the fewest consecutive equal samples
+    reported as a flat-line run
+    :param min_saturation_run: int containing the fewest consecutive samples
+    at the minimum or maximum reported as a saturation run
+
+    :returns: dictionary containing min, max, mean, rms,
+    out_of_range_count, out_of_range_fraction, out_of_range_ranges,
+    flat_runs and saturation_runs
+    """
+    voltage = np.asarray(voltage, dtype=float)
+    minimum = voltage.min()
+    maximum = voltage.max()
+    outside = np.abs(voltage) > limit
+    count = int(np.count_nonzero(outside))
+    flat = np.zeros(voltage.size, dtype=bool)
+    flat[1:] = voltage[1:] == voltage[:-1]
+    flat[:-1] |= flat[1:]
+    saturated = (voltage == minimum) | (voltage == maximum)
+    return {"min": float(minimum),
+            "max": float(maximum),
+            "mean": float(voltage.mean()),
+            "rms": float(np.sqrt(np.dot(voltage, voltage) / voltage.size)),
+            "out_of_range_count": count,
+            "out_of_range_fraction": count / voltage.size,
+            "out_of_range_ranges": _runs(outside),
+            "flat_runs": _runs(flat, min_flat_run),
+            "saturation_runs": _runs(saturated, min_saturation_run)}
+
+
+def _runs(mask, min_length=1):
+    """Find the runs of consecutive True values in a boolean array
+
+    :param mask: array of bools
+    :param min_length: int containing the shortest run to report
+
+    :returns: list of lists of ints containing the [start, end) index of
+    each run
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask, [0]))
+                                   .astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    keep = ends - starts >= min_length
+    return np.column_stack((starts[keep], ends[keep])).tolist()
+
+
+def exceptions(voltage, stats=None):
     """Log warning in values are outside the normal range of +/- 300 mV
 
     This code creates a warning log when the voltage exceeds the normal
-    range of values between -300 mV and +300 mV.
+    range of values between -300 mV and +300 mV. The check is vectorized,
+    and statistics already computed by signal_stats can be passed in to
+    avoid looking at the voltages again.
 
     :param voltage: list of floats containing all voltage data points
+    :param stats: dictionary returned by signal_stats for the voltage, or
+    None
+
+    :returns: bool that is True if any voltage was out of range
     """
-    for v in voltage:
-        if v > 300 or v < -300:
-            logging.warning("Voltage exceeded normal range")
-            break
+    if stats is None:
+        outside = np.any(np.abs(np.asarray(voltage)) > VOLTAGE_LIMIT)
+    else:
+        outside = stats["out_of_range_count"] > 0
+    if outside:
+        logging.warning("Voltage exceeded normal range")
+    return bool(outside)
 
 
 def duration_calc(time):
@@ -86,10 +327,31 @@ def duration_calc(time):
     return duration
 
 
+def report_stats(time, stats):
+    """Log where a strip left the normal range, went flat or saturated
+
+    :param time: list of floats containing all time data points
+    :param stats: dictionary returned by signal_stats for the strip
+    """
+    ranges = stats["out_of_range_ranges"]
+    if ranges:
+        logging.warning("Voltage exceeded normal range in {} samples ({:.1%})"
+                        " from {:.3f} s to {:.3f} s".format(
+                            stats["out_of_range_count"],
+                            stats["out_of_range_fraction"],
+                            time[ranges[0][0]], time[ranges[-1][1] - 1]))
+    for start, end in stats["flat_runs"]:
+        logging.info("Flat line from {:.3f} s to {:.3f} s".format(
+            time[start], time[end - 1]))
+    for start, end in stats["saturation_runs"]:
+        logging.info("Saturated from {:.3f} s to {:.3f} s".format(
+            time[start], time[end - 1]))
+
+
 def extremes(voltage):
     """Calculate voltage min and max of ECG strip
 
-    This code uses min() and max() functions to calculate the minimum
+    This code uses the numpy min and max functions to calculate the minimum
     and maximum voltages values within one ECG strip.
 
     :param voltage: list of floats containing all voltage data points
@@ -97,8 +359,9 @@ def extremes(voltage):
     :returns: float containing minimum voltage value
     :returns: float containing maximum voltage value
     """
-    minimum = min(voltage)
-    maximum = max(voltage)
+    voltage = np.asarray(voltage)
+    minimum = float(voltage.min())
+    maximum = float(voltage.max())
     return minimum, maximum
 
 
@@ -112,7 +375,8 @@ def show_peaks(filename, time, voltage, plot):
     voltage, and peaks are never less than 100 data points away from
     one another. Therefore, these parameters were used in the find_peaks
     function. If the user enters the fourth paramater as "save," the
-    time and voltage data is plotted and saved as a png.
+    time and voltage data is plotted and saved as a png named after the
+    file, with the extension replaced.
 
     :param filename: string containing file name
     :param time: list of floats containing all time data points
@@ -122,16 +386,63 @@ def show_peaks(filename, time, voltage, plot):
 
     :returns: list of floats containing times where peaks occured
     """
-    filename_png = "{}.png".format(filename.strip(".csv"))
-    peaks, _ = find_peaks(voltage, height=max(voltage) * 0.35, distance=100)
+    filename_png = png_name(filename)
+    peaks = peak_indices(voltage)
     time_peaks = [time[i] for i in peaks]
     if plot == "save":
-        plt.figure()
-        plt.plot(time, voltage)
-        plt.savefig(filename_png)
+        save_plot(time, voltage, filename_png)
     return time_peaks
 
 
+@instrumented("peaks", lambda result, args: len(args[0]))
+def peak_indices(voltage, sampling_rate=None, detector=DEFAULT_DETECTOR):
+    """Find the sample index of every R-peak in a filtered ECG strip
+
+    By default this code runs the scipy find_peaks function with the
+    thresholds described in show_peaks: a minimum height of 35% of the
+    maximum voltage and a minimum spacing of 100 data points. Any other
+    detector registered in ecg_detectors.DETECTORS, such as
+    "pan_tompkins", can be chosen by name.
+
+    :param voltage: list of floats containing all filtered voltage data
+    points
+    :param sampling_rate: float containing the sampling rate in Hz, which
+    is required by every detector except "find_peaks"
+    :param detector: string containing the name of the beat detector
+
+    :returns: array of ints containing the index of each peak
+    """
+    return detect(voltage, sampling_rate, detector)
+
+
+def png_name(filename):
+    """Build the name of the png saved for an ECG file
+
+    :param filename: string containing file name
+
+    :returns: string containing the file name with a .png extension
+    """
+    return os.path.splitext(filename)[0] + ".png"
+
+
+@instrumented("plot", lambda result, args: len(args[0]))
+def save_plot(time, voltage, filename_png, peaks=None):
+    """Plot voltage against time and save the figure as a png
+
+    The figure is drawn by ecg_render, which reuses one off-screen figure
+    and reduces the trace to the plot width before drawing.
+
+    :param time: list of floats containing all time data points
+    :param voltage: list of floats containing all filtered voltage data
+    points
+    :param filename_png: string containing the name of the saved figure
+    :param peaks: list of ints containing the index of each peak to mark,
+    or None for no markers
+    """
+    with open(filename_png, "wb") as f:
+        f.write(render_trace(time, voltage, peaks))
+
+
 def num_peaks(time_peaks):
     """Calculate the number of peaks in ECG strip
 
@@ -147,6 +458,7 @@ def num_peaks(time_peaks):
     return num_beats
 
 
+@instrumented("bpm")
 def bpm_calc(duration, num_beats):
     """Calculate average heartrate within ECG strip
 
@@ -163,46 +475,827 @@ def bpm_calc(duration, num_beats):
     return bpm
 
 
+# Heart rate variability measures returned by hrv_metrics
+HRV_FIELDS = ["mean_hr", "min_hr", "max_hr", "sdnn", "rmssd", "pnn50",
+              "num_intervals"]
+
+
+def rr_intervals(time_peaks, sampling=None):
+    """Calculate the interval between every pair of successive beats
+
+    Intervals that span a gap the strip was split at are left out, since
+    beats inside the gap were never recorded. Intervals across gaps that
+    were filled by interpolation are kept.
+
+    :param time_peaks: list of floats containing times where peaks occured
+    :param sampling: dictionary returned by ecg_preprocess.uniform, or None
+    if the strip has no gaps
+
+    :returns: array of floats containing the RR intervals in s
+    """
+    time_peaks = np.asarray(time_peaks, dtype=float)
+    rr = np.diff(time_peaks)
+    if sampling is not None and rr.size:
+        splits = [start for start, end, filled in sampling["gaps"]
+                  if not filled]
+        spanning = np.searchsorted(time_peaks, splits) - 1
+        spanning = spanning[(spanning >= 0) & (spanning < rr.size)]
+        rr = np.delete(rr, spanning)
+    return rr
+
+
+def hrv_metrics(rr):
+    """Summarize the heart rate variability of a series of RR intervals
+
+    The instantaneous heart rate of every beat is 60 / RR. SDNN is the
+    standard deviation of the intervals, RMSSD the root mean square of the
+    differences between successive intervals and pNN50 the percentage of
+    those differences larger than 50 ms. Every measure is computed with a
+    few whole-array operations. Measures that need more intervals than the
+    strip has are None.
+
+    :param rr: array of floats containing the RR intervals in s
+
+    :returns: dictionary containing the "mean_hr", "min_hr" and "max_hr"
+    in bpm, the "sdnn" and "rmssd" in ms, the "pnn50" in percent and the
+    "num_intervals"
+    """
+    rr = np.asarray(rr, dtype=float)
+    metrics = dict.fromkeys(HRV_FIELDS)
+    metrics["num_intervals"] = int(rr.size)
+    if rr.size == 0:
+        return metrics
+    instant_hr = 60 / rr
+    metrics["mean_hr"] = float(60 / rr.mean())
+    metrics["min_hr"] = float(instant_hr.min())
+    metrics["max_hr"] = float(instant_hr.max())
+    if rr.size < 2:
+        return metrics
+    successive = np.diff(rr)
+    metrics["sdnn"] = float(rr.std(ddof=1) * 1000)
+    metrics["rmssd"] = float(np.sqrt(np.mean(successive ** 2)) * 1000)
+    metrics["pnn50"] = float(np.mean(np.abs(successive) > 0.05) * 100)
+    return metrics
+
+
+def encode_rr(rr):
+    """Pack RR intervals into a short string for storage
+
+    Every interval is rounded to a whole millisecond and stored as a
+    little-endian uint16, which is two bytes per beat before base64
+    encoding instead of a JSON number per beat.
+
+    :param rr: array of floats containing the RR intervals in s
+
+    :returns: string containing the base64 encoded intervals
+    """
+    ms = np.clip(np.rint(np.asarray(rr, dtype=float) * 1000), 0, 65535)
+    return base64.b64encode(ms.astype("<u2").tobytes()).decode("ascii")
+
+
+def decode_rr(encoded):
+    """Unpack RR intervals packed by encode_rr
+
+    :param encoded: string containing the base64 encoded intervals
+
+    :returns: array of floats containing the RR intervals in s
+    """
+    ms = np.frombuffer(base64.b64decode(encoded), dtype="<u2")
+    return ms.astype(float) / 1000
+
+
+class ECGAnalysis:
+    """Results of analyzing one ECG strip
+
+    This class holds everything computed from a single read and filter of
+    an ECG file so that the plot and the heart rate can both be produced
+    without parsing or filtering the file again. It is created by the
+    analyze function.
+
+    :ivar filename: string containing file name
+    :ivar time: array of floats containing all time data points
+    :ivar voltage: array of floats containing all filtered voltage data
+    points
+    :ivar peaks: array of ints containing the index of each peak
+    :ivar time_peaks: list of floats containing times where peaks occured,
+    refined between samples if the strip was decimated
+    :ivar duration: float containing time duration of ECG strip in seconds
+    :ivar extremes: tuple of floats containing the minimum and maximum
+    voltage of the unfiltered strip
+    :ivar bpm: int containing heartrate of ECG strip in bpm
+    :ivar rr: array of floats containing the RR intervals in s
+    :ivar instant_hr: array of floats containing the heart rate of every
+    RR interval in bpm
+    :ivar hrv: dictionary returned by hrv_metrics for the RR intervals
+    :ivar out_of_range: bool that is True if the unfiltered voltage
+    exceeded +/- 300 mV
+    :ivar stats: dictionary returned by signal_stats for the unfiltered
+    voltage, or None if it was not computed
+    :ivar sampling: dictionary returned by ecg_preprocess.uniform with the
+    effective rate, gaps and segments of the strip, or None if the strip
+    was not preprocessed
+    :ivar provisional: bool that is True if only the start of the file was
+    analyzed, as by preview, so the results may still change
+    """
+    def __init__(self, filename, time, voltage, peaks, extremes,
+                 out_of_range, stats=None, sampling=None,
+                 provisional=False, time_peaks=None):
+        self.filename = filename
+        self.time = time
+        self.voltage = voltage
+        self.peaks = peaks
+        if time_peaks is None:
+            time_peaks = [time[i] for i in peaks]
+        self.time_peaks = time_peaks
+        self.duration = duration_calc(time)
+        self.extremes = extremes
+        covered = self.duration if sampling is None else sampling["duration"]
+        self.bpm = bpm_calc(covered, num_peaks(self.time_peaks))
+        self.rr = rr_intervals(self.time_peaks, sampling)
+        self.instant_hr = 60 / self.rr
+        self.hrv = hrv_metrics(self.rr)
+        self.out_of_range = out_of_range
+        self.stats = stats
+        self.sampling = sampling
+        self.provisional = provisional
+
+    def heart_rate(self):
+        """Format the heart rate the way overall_rate returns it
+
+        :returns: string containing the heart rate for the chosen ECG
+        """
+        return "{}".format(self.bpm)
+
+    @instrumented("plot", lambda result, args: len(args[0].time))
+    def render(self, format="png", mark_peaks=True):
+        """Render the filtered strip to encoded image bytes
+
+        :param format: string containing "png", "jpeg" or "jpg"
+        :param mark_peaks: bool that is True to mark the detected peaks
+
+        :returns: bytes containing the encoded image
+        """
+        peaks = self.peaks if mark_peaks else None
+        return render_trace(self.time, self.voltage, peaks, format=format)
+
+    def save_plot(self, filename_png):
+        """Plot the filtered strip and save the figure as a png
+
+        :param filename_png: string containing the name of the saved figure
+        """
+        with open(filename_png, "wb") as f:
+            f.write(self.render())
+
+
+@instrumented("analyze", lambda result, args: len(result.time))
+def analyze(filename, band=DEFAULT_BAND, order=DEFAULT_ORDER, notch=None,
+            detector=DEFAULT_DETECTOR, target_rate=None):
+    """Read, filter and measure an ECG strip in a single pass
+
+    This code reads the file and filters the voltage exactly once, then
+    collects the peaks, duration, extremes, heart rate and out-of-range
+    flag into an ECGAnalysis object that callers can use for both the
+    plot and the heart rate. The extremes and out-of-range flag come from
+    a single signal_stats pass over the unfiltered voltage, whose results
+    are kept in the stats attribute. Before filtering, the strip is put on
+    a uniform time grid by ecg_preprocess.uniform, so that dropped rows
+    and irregular timestamps do not change the filter cutoffs. A strip
+    split at long gaps is filtered and searched for beats one segment at a
+    time, and its heart rate only counts the time covered by segments.
+    With a target_rate, strips recorded at least twice as fast are first
+    decimated by decimate_strip, and the peak times are refined between
+    the decimated samples.
+
+    :param filename: string containing file name
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector
+    :param target_rate: float containing the lowest sampling rate in Hz to
+    decimate to, or None to keep every sample
+
+    :returns: ECGAnalysis containing the results for the chosen ECG
+    """
+    time, voltage = read(filename)
+    return analyze_strip(filename, time, voltage, band, order, notch,
+                         detector, target_rate)
+
+
+def analyze_strip(filename, time, voltage, band=DEFAULT_BAND,
+                  order=DEFAULT_ORDER, notch=None, detector=DEFAULT_DETECTOR,
+                  target_rate=None, provisional=False):
+    """Measure a strip that has already been read
+
+    This code runs every step of analyze after reading, so strips that are
+    already in memory, such as the start of a file read by preview, are
+    analyzed in exactly the same way as whole files.
+
+    :param filename: string containing file name
+    :param time: array of floats containing all time data points
+    :param voltage: array of floats containing all voltage data points
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector
+    :param target_rate: float containing the lowest sampling rate in Hz to
+    decimate to, or None to keep every sample
+    :param provisional: bool that is True if the strip is only the start of
+    the file
+
+    :returns: ECGAnalysis containing the results for the strip
+    """
+    stats = signal_stats(voltage)
+    report_stats(time, stats)
+    with stage("preprocess", len(time)):
+        time, voltage, sampling = uniform(time, voltage)
+    factor = decimation_factor(sampling["rate"], target_rate)
+    if factor > 1:
+        time, voltage, sampling = decimate_strip(time, voltage, sampling,
+                                                 factor)
+    voltage_clean, peaks = _filter_segments(time, voltage, sampling, band,
+                                            order, notch, detector)
+    time_peaks = None
+    if factor > 1:
+        refined = refine_peaks(voltage_clean, peaks)
+        time_peaks = list(time[peaks] + (refined - peaks) / sampling["rate"])
+    return ECGAnalysis(filename, time, voltage_clean, peaks,
+                       (stats["min"], stats["max"]),
+                       stats["out_of_range_count"] > 0, stats, sampling,
+                       provisional, time_peaks)
+
+
+@instrumented("decimate", lambda result, args: len(args[0]))
+def decimate_strip(time, voltage, sampling, factor):
+    """Decimate every segment of a uniform strip by a whole factor
+
+    Each segment is decimated separately with ecg_filters.decimate, whose
+    anti-aliasing filter keeps the 1-50 Hz band of the ECG intact at any
+    rate above about 125 Hz. The decimated samples keep the times of the
+    samples they line up with, so every time is still in the timebase of
+    the file.
+
+    :param time: array of floats containing the uniform time data points
+    :param voltage: array of floats containing the uniform voltage data
+    points, or an (n_samples, n_leads) array
+    :param sampling: dictionary returned by ecg_preprocess.uniform
+    :param factor: int containing the decimation factor
+
+    :returns: array of floats containing the decimated time data points
+    :returns: array of floats containing the decimated voltage data points
+    :returns: dictionary like sampling for the decimated strip, with the
+    decimated "rate", the "original_rate", the "decimation" factor and the
+    segments counted in decimated samples; the duration is unchanged
+    """
+    times = []
+    voltages = []
+    segments = []
+    count = 0
+    for start, end in sampling["segments"]:
+        times.append(time[start:end:factor])
+        voltages.append(decimate(voltage[start:end], factor))
+        segments.append([count, count + len(times[-1])])
+        count += len(times[-1])
+    decimated = dict(sampling, rate=sampling["rate"] / factor,
+                     segments=segments, decimation=factor,
+                     original_rate=sampling["rate"])
+    logging.info("Decimated from {:.1f} Hz to {:.1f} Hz".format(
+        sampling["rate"], decimated["rate"]))
+    return np.concatenate(times), np.concatenate(voltages), decimated
+
+
+@instrumented("preview", lambda result, args: len(result.time))
+def preview(filename, seconds=20.0, band=DEFAULT_BAND, order=DEFAULT_ORDER,
+            notch=None, detector=DEFAULT_DETECTOR, chunk_size=8192,
+            target_rate=None):
+    """Quickly estimate the heart rate from the start of an ECG file
+
+    This code reads the file with read_chunks and stops as soon as it has
+    the first seconds of signal, so the time taken does not depend on the
+    length of the file. The start of the strip is then analyzed in the same
+    way as analyze does for the whole file. The result is marked as
+    provisional unless the file ended within the first seconds, in which
+    case it is the same as the result of analyze.
+
+    :param filename: string containing file name
+    :param seconds: float containing the length of signal to analyze in s
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector
+    :param chunk_size: int containing the number of rows read at a time
+    :param target_rate: float containing the lowest sampling rate in Hz to
+    decimate to, or None to keep every sample
+
+    :returns: ECGAnalysis containing the results for the start of the file
+    """
+    times = []
+    voltages = []
+    provisional = False
+    for time, voltage in read_chunks(filename, chunk_size):
+        times.append(time)
+        voltages.append(voltage)
+        if time[-1] - times[0][0] > seconds:
+            provisional = True
+            break
+    time = np.concatenate(times)
+    voltage = np.concatenate(voltages)
+    if provisional:
+        end = np.searchsorted(time, time[0] + seconds, side="right")
+        time = time[:end]
+        voltage = voltage[:end]
+    return analyze_strip(filename, time, voltage, band, order, notch,
+                         detector, target_rate, provisional)
+
+
+def _filter_segments(time, voltage, sampling, band, order, notch,
+                     detector):
+    """Filter every segment of a uniform strip and find its peaks
+
+    When a strip was split, segments shorter than one second are left at
+    zero without peaks.
+
+    :param time: array of floats containing the uniform time data points
+    :param voltage: array of floats containing the uniform voltage data
+    points, or an (n_samples, n_leads) array
+    :param sampling: dictionary returned by ecg_preprocess.uniform
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector, or
+    None to only filter
+
+    :returns: array of floats containing the filtered voltage
+    :returns: array of ints containing the index of each peak, or None if
+    no detector was given
+    """
+    rate = sampling["rate"]
+    segments = sampling["segments"]
+    voltage_clean = np.zeros_like(voltage)
+    peaks = []
+    for start, end in segments:
+        if len(segments) > 1 and end - start < rate:
+            continue
+        segment = filter(time[start:end], voltage[start:end], band, order,
+                         notch, rate)
+        voltage_clean[start:end] = segment
+        if detector is not None:
+            peaks.append(start + peak_indices(segment, rate, detector))
+    if detector is None:
+        return voltage_clean, None
+    return voltage_clean, np.concatenate(peaks or [np.empty(0, dtype=int)])
+
+
+class MultiLeadAnalysis:
+    """Results of analyzing every lead of a multi-lead ECG recording
+
+    :ivar filename: string containing file name
+    :ivar names: list of strings containing the name of every lead
+    :ivar time: array of floats containing all time data points
+    :ivar voltage: (n_samples, n_leads) array of floats containing the
+    filtered voltage of every lead
+    :ivar leads: list of ECGAnalysis containing the results of each lead
+    :ivar combined: ECGAnalysis containing the results of the combined
+    lead, or None if it was not requested
+    """
+    def __init__(self, filename, names, time, voltage, leads, combined):
+        self.filename = filename
+        self.names = names
+        self.time = time
+        self.voltage = voltage
+        self.leads = leads
+        self.combined = combined
+
+    def heart_rates(self):
+        """Collect the heart rate of every lead
+
+        :returns: dictionary containing the bpm of each lead by name
+        """
+        return {name: lead.bpm for name, lead in zip(self.names, self.leads)}
+
+
+def combine_leads(voltage):
+    """Combine filtered leads into one lead for beat detection
+
+    Every lead is first flipped if its largest deflection is negative, so
+    that the R-waves of all leads point up, and the leads are then
+    averaged sample by sample. Noise that is independent between leads
+    partly cancels while the QRS complexes add up.
+
+    :param voltage: (n_samples, n_leads) array of floats containing the
+    filtered voltage of every lead
+
+    :returns: array of floats containing the combined lead
+    """
+    polarity = np.where(-voltage.min(axis=0) > voltage.max(axis=0), -1, 1)
+    return voltage @ polarity / voltage.shape[1]
+
+
+@instrumented("analyze", lambda result, args: len(result.time))
+def analyze_leads(filename, combine=True, band=DEFAULT_BAND,
+                  order=DEFAULT_ORDER, notch=None, detector=DEFAULT_DETECTOR):
+    """Read, filter and measure every lead of a multi-lead ECG recording
+
+    This code reads all leads at once with read_leads, computes the
+    extremes and out-of-range flags of all leads with single vectorized
+    reductions and filters all leads along the sample axis in a single
+    call. Peaks are then found in each lead and, if requested, in the
+    combined lead from combine_leads. A lead whose largest deflection is
+    negative, as in a lead that sees the QRS complex upside down, is
+    searched for minima instead of maxima.
+
+    :param filename: string containing file name
+    :param combine: bool that is True to also analyze the combined lead
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector
+
+    :returns: MultiLeadAnalysis containing the results of every lead
+    """
+    time, voltage, names = read_leads(filename)
+    minimums = voltage.min(axis=0)
+    maximums = voltage.max(axis=0)
+    out_of_range = np.any(np.abs(voltage) > VOLTAGE_LIMIT, axis=0)
+    if out_of_range.any():
+        logging.warning("Voltage exceeded normal range")
+    with stage("preprocess", len(time)):
+        time, voltage, sampling = uniform(time, voltage)
+    voltage_clean, _ = _filter_segments(time, voltage, sampling, band,
+                                        order, notch, None)
+    sampling_rate = sampling["rate"]
+    leads = []
+    for i in range(voltage_clean.shape[1]):
+        lead = voltage_clean[:, i]
+        if -lead.min() > lead.max():
+            peaks = peak_indices(-lead, sampling_rate, detector)
+        else:
+            peaks = peak_indices(lead, sampling_rate, detector)
+        leads.append(ECGAnalysis(filename, time, lead, peaks,
+                                 (minimums[i], maximums[i]),
+                                 bool(out_of_range[i]), sampling=sampling))
+    combined = None
+    if combine:
+        lead = combine_leads(voltage_clean)
+        peaks = peak_indices(lead, sampling_rate, detector)
+        combined = ECGAnalysis(filename, time, lead, peaks,
+                               (minimums.min(), maximums.max()),
+                               bool(out_of_range.any()), sampling=sampling)
+    return MultiLeadAnalysis(filename, names, time, voltage_clean, leads,
+                             combined)
+
+
 def overall_plotting(filename):
     """Plot filtered data beginning from file name
 
-    This code uses the read, filter, and show_peaks functions to go
-    from a file name to a saved figure of the filtered data.
+    This code is a thin wrapper around analyze that saves a figure of the
+    filtered data next to the file, as show_peaks does.
 
     :param filename: string containing file name
     """
-    time, voltage = read(filename)
-    voltage_clean = filter(time, voltage)
-    show_peaks(filename, time, voltage_clean, "save")
+    filename_png = png_name(filename)
+    analyze(filename).save_plot(filename_png)
 
 
 def overall_rate(filename):
     """Calculate heart rate beginning from file name
 
-    This code uses most of the previous functions, including read,
-    filter, duration_calc, show_peaks, num_peaks, and bpm_calc, to
-    calculate the heart rate of the ECG graph corresponding to the
-    given file name.
+    This code is a thin wrapper around analyze that returns only the
+    heart rate of the ECG graph corresponding to the given file name.
 
     :param filename: string containing file name
 
     :returns: string containing the heart rate for the chosen ECG
     """
-    time, voltage = read(filename)
-    voltage_clean = filter(time, voltage)
-    duration = duration_calc(time)
-    time_peaks = show_peaks(filename, time, voltage_clean, "")
-    num_beats = num_peaks(time_peaks)
-    bpm = bpm_calc(duration, num_beats)
-    return "{}".format(bpm)
+    return analyze(filename).heart_rate()
+
+
+# Modules that the analysis only imports on first use, which warm_up loads
+# ahead of time
+HEAVY_MODULES = ["scipy.signal", "matplotlib.figure",
+                 "matplotlib.backends.backend_agg", "PIL.Image", "PIL.ImageTk",
+                 "cloud_client"]
+
+
+def warm_up():
+    """Load the heavy modules and prepare the plot before they are needed
+
+    This code imports HEAVY_MODULES, designs the default filter and renders
+    a short dummy trace, so that the first real analysis does not pay for
+    the imports, the font cache or the first figure.
+
+    :returns: float containing the time taken in seconds
+    """
+    start = timer.perf_counter()
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+    time = np.arange(1000) / 250
+    voltage = np.sin(2 * np.pi * 1.2 * time)
+    bandpass(voltage, 250)
+    render_trace(time, voltage, [100])
+    seconds = timer.perf_counter() - start
+    logging.info("Warmed up the analysis in {:.2f} s".format(seconds))
+    return seconds
+
+
+def start_warm_up():
+    """Run warm_up in a background daemon thread
+
+    Python's import lock makes a real analysis that starts in the meantime
+    wait for any module that is still being imported instead of importing it
+    twice.
+
+    :returns: threading.Thread running warm_up
+    """
+    thread = threading.Thread(target=warm_up, name="ecg-warm-up",
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+WINDOW_FIELDS = ["start", "end", "bpm", "num_beats", "min_voltage",
+                 "max_voltage", "out_of_range", "covered", "gap"]
+
+
+def analyze_windows(filename, window=60.0, step=None, margin=2.0,
+                    chunk_size=65536, band=DEFAULT_BAND, order=DEFAULT_ORDER,
+                    notch=None, detector=DEFAULT_DETECTOR):
+    """Analyze a long recording as a series of windows with bounded memory
+
+    This code streams the file with read_chunks and keeps only the samples
+    needed for the current window. Each window is filtered together with
+    margin seconds of the neighbouring signal on both sides so that the
+    transients at the edges of the zero-phase filter fall outside the
+    window, and only the peaks inside the window itself are counted. The
+    heart rate, beat count, extremes and out-of-range flag of every window
+    are returned as a time series. Windows start every step seconds, so a
+    step smaller than the window gives overlapping windows. A last window
+    shorter than the others is kept if it covers at least half a window.
+    Like analyze, every window is put on a uniform grid by
+    ecg_preprocess.uniform and split at long gaps, and its heart rate only
+    counts the time covered by signal, which is returned with a flag for
+    windows that contain a gap. A window that falls entirely into a gap in
+    the recording has no beats and NaN for its heart rate and extremes.
+
+    :param filename: string containing file name
+    :param window: float containing the length of each window in s
+    :param step: float containing the time between window starts in s, or
+    None to use the window length
+    :param margin: float containing the extra signal filtered on each side
+    of a window in s
+    :param chunk_size: int containing the number of rows read at a time
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector
+
+    :returns: dictionary of arrays, keyed by WINDOW_FIELDS, with one entry
+    per window
+    """
+    step = step or window
+    rows = []
+    buffer_t = np.empty(0)
+    buffer_v = np.empty(0)
+    start = None
+    for time, voltage in read_chunks(filename, chunk_size):
+        buffer_t = np.concatenate((buffer_t, time))
+        buffer_v = np.concatenate((buffer_v, voltage))
+        if start is None:
+            start = buffer_t[0]
+        while buffer_t.size and buffer_t[-1] >= start + window + margin:
+            rows.append(_window_row(buffer_t, buffer_v, start, start + window,
+                                    margin, band, order, notch, detector))
+            start += step
+            keep = np.searchsorted(buffer_t, start - margin)
+            buffer_t = buffer_t[keep:]
+            buffer_v = buffer_v[keep:]
+    while start is not None and buffer_t.size and \
+            buffer_t[-1] - start >= window / 2:
+        end = min(start + window, buffer_t[-1])
+        rows.append(_window_row(buffer_t, buffer_v, start, end, margin,
+                                band, order, notch, detector))
+        start += step
+    series = {}
+    for i, field in enumerate(WINDOW_FIELDS):
+        series[field] = np.array([row[i] for row in rows])
+    return series
+
+
+def _window_row(time, voltage, start, end, margin, band, order, notch,
+                detector):
+    """Measure one window of a long recording
+
+    :param time: array of floats containing the buffered time data points
+    :param voltage: array of floats containing the buffered voltage data
+    points
+    :param start: float containing the start time of the window in s
+    :param end: float containing the end time of the window in s
+    :param margin: float containing the extra signal filtered on each side
+    of the window in s
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector
+
+    :returns: tuple containing the values of WINDOW_FIELDS for the window
+    """
+    lo, hi = np.searchsorted(time, [start - margin, end + margin])
+    segment_t = time[lo:hi]
+    segment_v = voltage[lo:hi]
+    core_lo, core_hi = np.searchsorted(segment_t, [start, end])
+    core_v = segment_v[core_lo:core_hi]
+    if not core_v.size:
+        return (start, end, np.nan, 0, np.nan, np.nan, False, 0.0, True)
+    grid_t, grid_v, sampling = uniform(segment_t, segment_v)
+    _, peaks = _filter_segments(grid_t, grid_v, sampling, band, order,
+                                notch, detector)
+    rate = sampling["rate"]
+    inside = (grid_t >= start) & (grid_t < end)
+    for first, last in sampling["segments"]:
+        if len(sampling["segments"]) > 1 and last - first < rate:
+            inside[first:last] = False
+    num_beats = num_peaks(peaks[inside[peaks]])
+    covered = np.count_nonzero(inside) / rate
+    bpm = bpm_calc(covered, num_beats) if covered else np.nan
+    gap = bool(covered < end - start - 1.5 / rate)
+    out_of_range = bool(np.any(np.abs(core_v) > VOLTAGE_LIMIT))
+    return (start, end, bpm, num_beats, float(core_v.min()),
+            float(core_v.max()), out_of_range, covered, gap)
+
+
+SUMMARY_FIELDS = ["filename", "bpm", "duration", "min_voltage",
+                  "max_voltage", "out_of_range_fraction", "num_beats",
+                  "sdnn", "rmssd", "pnn50", "warnings", "error"]
+
+
+class _LogCollector(logging.Handler):
+    """Logging handler that keeps the messages of warnings and errors"""
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def summarize(filename, plot=False, detector=DEFAULT_DETECTOR,
+              target_rate=None):
+    """Analyze one ECG file and summarize it as a row of the batch table
+
+    This code runs analyze on the file and collects the heart rate, its
+    variability, duration, extremes and every warning or error logged
+    along the way.
+    An exception raised while analyzing the file is recorded in the error
+    field instead of being raised, so that one broken file does not stop a
+    batch run.
+
+    :param filename: string containing file name
+    :param plot: bool that is True to save a png of the filtered data next
+    to the file
+    :param detector: string containing the name of the beat detector
+    :param target_rate: float containing the lowest sampling rate in Hz to
+    decimate to, or None to keep every sample
+
+    :returns: dictionary containing the summary fields of the file
+    """
+    row = dict.fromkeys(SUMMARY_FIELDS, "")
+    row["filename"] = filename
+    collector = _LogCollector()
+    logger = logging.getLogger()
+    logger.addHandler(collector)
+    try:
+        analysis = analyze(filename, detector=detector,
+                           target_rate=target_rate)
+        if plot:
+            analysis.save_plot(png_name(filename))
+        row["bpm"] = analysis.bpm
+        row["duration"] = float(analysis.duration)
+        row["min_voltage"] = float(analysis.extremes[0])
+        row["max_voltage"] = float(analysis.extremes[1])
+        row["out_of_range_fraction"] = \
+            analysis.stats["out_of_range_fraction"]
+        row["num_beats"] = len(analysis.time_peaks)
+        for field in ("sdnn", "rmssd", "pnn50"):
+            if analysis.hrv[field] is not None:
+                row[field] = analysis.hrv[field]
+    except Exception as e:
+        row["error"] = "{}: {}".format(type(e).__name__, e)
+    finally:
+        logger.removeHandler(collector)
+    row["warnings"] = "; ".join(collector.messages)
+    return row
+
+
+def batch_analyze(filenames, workers=None, plot=False,
+                  detector=DEFAULT_DETECTOR, target_rate=None):
+    """Summarize many ECG files in parallel
+
+    This code spreads the files over a pool of worker processes, each of
+    which runs summarize on its share of the files. The rows are returned
+    in the same order as the file names.
+
+    :param filenames: list of strings containing file names
+    :param workers: int containing the number of worker processes, or None
+    to use every core
+    :param plot: bool that is True to save a png of every file
+    :param detector: string containing the name of the beat detector
+    :param target_rate: float containing the lowest sampling rate in Hz to
+    decimate to, or None to keep every sample
+
+    :returns: list of dictionaries containing the summary of each file
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return []
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(filenames))
+    if workers == 1:
+        return [summarize(filename, plot, detector, target_rate)
+                for filename in filenames]
+    chunksize = max(1, len(filenames) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(summarize, filenames,
+                             [plot] * len(filenames),
+                             [detector] * len(filenames),
+                             [target_rate] * len(filenames),
+                             chunksize=chunksize))
+    return rows
+
+
+def write_summary(rows, output):
+    """Write batch summary rows as a csv file or as JSON lines
+
+    The format is chosen from the output file extension: ".jsonl" writes
+    one JSON object per line and anything else writes a csv table.
+
+    :param rows: list of dictionaries containing the summary of each file
+    :param output: string containing the name of the summary file
+    """
+    with open(output, "w", newline="") as f:
+        if output.endswith(".jsonl"):
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def main(argv=None):
+    """Run the command line interface of ecg_analysis
+
+    "python -m ecg_analysis batch DIRECTORY" analyzes every csv and binary
+    ECG file in the directory with a pool of worker processes, writes one
+    summary table and prints how many files per second were processed.
+
+    :param argv: list of strings containing command line arguments
+    """
+    parser = argparse.ArgumentParser(prog="ecg_analysis")
+    commands = parser.add_subparsers(dest="command")
+    batch = commands.add_parser("batch", help="analyze a directory of "
+                                              "ECG csv files")
+    batch.add_argument("directory")
+    batch.add_argument("--workers", type=int, default=None)
+    batch.add_argument("--output", default="ecg_summary.csv",
+                       help="summary file, .csv or .jsonl")
+    batch.add_argument("--plot", action="store_true",
+                       help="save a png of every file")
+    batch.add_argument("--detector", default=DEFAULT_DETECTOR,
+                       choices=sorted(DETECTORS),
+                       help="beat detector")
+    batch.add_argument("--target-rate", type=float, default=None,
+                       help="decimate recordings sampled at least twice "
+                            "this rate in Hz before filtering")
+    args = parser.parse_args(argv)
+    if args.command != "batch":
+        parser.print_help()
+        return
+    filenames = sorted(
+        glob.glob(os.path.join(args.directory, "*.csv")) +
+        glob.glob(os.path.join(args.directory, "*" + ecg_binary.EXTENSION)))
+    start = timer.perf_counter()
+    rows = batch_analyze(filenames, args.workers, args.plot, args.detector,
+                         args.target_rate)
+    elapsed = timer.perf_counter() - start
+    write_summary(rows, args.output)
+    logging.info("Analyzed {} files in {:.2f} s".format(len(rows), elapsed))
+    print("Analyzed {} files in {:.2f} s ({:.1f} files/s), summary written "
+          "to {}".format(len(rows), elapsed, len(rows) / elapsed,
+                         args.output))
 
 
 if __name__ == "__main__":
-    """Runs main code and asks for user input
+    """Runs main code and parses the command line
 
-    This code allows the user to input their text file of choice and then runs
-    through all of the aforementioned functions in order to create json files
-    for each patient in the text file.
+    This code configures logging and then runs the command line interface,
+    which analyzes a whole directory of ECG files with the batch command.
     """
     logging.basicConfig(filename="Logging.log",
                         filemode='w', level=logging.INFO)
+    main()
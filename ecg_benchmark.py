@@ -0,0 +1,827 @@
+# ecg_benchmark.py
+
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time as timer
+import tracemalloc
+import numpy as np
+from scipy.signal import butter, filtfilt
+from ecg_analysis import read, filter, duration_calc, show_peaks, \
+    num_peaks, bpm_calc, overall_rate, analyze_strip
+from ecg_detectors import DETECTORS
+import ecg_synth
+from ecg_filters import bandpass_many, DEFAULT_BAND, DEFAULT_ORDER
+
+
+def read_throughput(filename, repeats=5):
+    """Measure how many samples per second read() can load from a file
+
+    This code loads the same file several times with the read function and
+    keeps the fastest run, which is the least disturbed by other processes.
+    The throughput is logged and returned.
+
+    :param filename: string containing the file name to-be-opened
+    :param repeats: int containing the number of timed runs
+
+    :returns: float containing the number of samples loaded per second
+    """
+    best = float("inf")
+    num_samples = 0
+    for _ in range(repeats):
+        start = timer.perf_counter()
+        time, voltage = read(filename)
+        best = min(best, timer.perf_counter() - start)
+        num_samples = len(time)
+    samples_per_second = num_samples / best
+    logging.info("Read {} samples from {} at {:.0f} samples/s".format(
+        num_samples, filename, samples_per_second))
+    return samples_per_second
+
+
+def legacy_filter(time, voltage):
+    """Filter voltage data the way ecg_analysis.filter used to
+
+    This is the reference path for filter_benchmark: it redesigns a third
+    order (b, a) Butterworth band-pass on every call and runs filtfilt.
+
+    :param time: list of floats containing all time data points
+    :param voltage: list of floats containing all voltage data points
+
+    :returns: array of floats containing filtered voltage values
+    """
+    sampling_rate = len(voltage) / duration_calc(time)
+    w = [1 / (sampling_rate / 2), 50 / (sampling_rate / 2)]
+    b, a = butter(3, w, "band")
+    return filtfilt(b, a, voltage)
+
+
+def _best_time(func, repeats):
+    """Time a function several times and keep the fastest run
+
+    :param func: function taking no arguments
+    :param repeats: int containing the number of timed runs
+
+    :returns: float containing the fastest run time in seconds
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = timer.perf_counter()
+        func()
+        best = min(best, timer.perf_counter() - start)
+    return best
+
+
+def filter_benchmark(filenames, repeats=20):
+    """Compare the legacy filtfilt path with the cached SOS filter
+
+    For every file this code times legacy_filter against
+    ecg_analysis.filter and records the largest difference between the two
+    outputs, then times filtering all strips that share a sampling rate
+    with one cached design through ecg_filters.bandpass_many.
+
+    :param filenames: list of strings containing file names
+    :param repeats: int containing the number of timed runs
+
+    :returns: list of dictionaries containing the timings of each file
+    """
+    results = []
+    strips = {}
+    for filename in filenames:
+        time, voltage = read(filename)
+        legacy = _best_time(lambda: legacy_filter(time, voltage), repeats)
+        cached = _best_time(lambda: filter(time, voltage), repeats)
+        difference = np.max(np.abs(legacy_filter(time, voltage) -
+                                   filter(time, voltage)))
+        results.append({"filename": filename,
+                        "samples": len(voltage),
+                        "legacy_s": legacy,
+                        "sos_s": cached,
+                        "speedup": legacy / cached,
+                        "max_difference": float(difference)})
+        rate = round(len(voltage) / duration_calc(time), 6)
+        strips.setdefault(rate, []).append((time, voltage))
+    for rate, group in strips.items():
+        voltages = [voltage for time, voltage in group]
+        legacy = _best_time(lambda: [legacy_filter(t, v) for t, v in group],
+                            repeats)
+        shared = _best_time(lambda: bandpass_many(voltages, rate), repeats)
+        results.append({"filename": "{} strips at {:.1f} Hz".format(
+                            len(group), rate),
+                        "samples": sum(len(v) for v in voltages),
+                        "legacy_s": legacy,
+                        "sos_s": shared,
+                        "speedup": legacy / shared,
+                        "max_difference": ""})
+    return results
+
+
+def matched_beats(reference, beats, tolerance):
+    """Count the beats that match a reference beat within a tolerance
+
+    Every beat is paired with the nearest reference beat, and a reference
+    beat is only counted once.
+
+    :param reference: array of floats containing the reference beat times
+    :param beats: array of floats containing the beat times to check
+    :param tolerance: float containing the largest time difference of a
+    match in s
+
+    :returns: int containing the number of matched beats
+    """
+    reference = np.asarray(reference, dtype=float)
+    beats = np.asarray(beats, dtype=float)
+    if reference.size == 0 or beats.size == 0:
+        return 0
+    right = np.clip(np.searchsorted(reference, beats), 1, reference.size - 1)
+    left = right - 1
+    nearest = np.where(np.abs(reference[left] - beats) <=
+                       np.abs(reference[right] - beats), left, right)
+    if reference.size == 1:
+        nearest = np.zeros(beats.size, dtype=int)
+    close = np.abs(reference[nearest] - beats) <= tolerance
+    return int(np.unique(nearest[close]).size)
+
+
+def detector_benchmark(filenames, repeats=20, tolerance=0.15):
+    """Compare the speed and beats of every registered beat detector
+
+    Every file is read and filtered once, then each detector in
+    ecg_detectors.DETECTORS is timed on the filtered strip. The beats of
+    each detector are compared with those of "find_peaks", the original
+    detector, and the agreement is the number of matched beats divided by
+    the mean beat count of the two detectors.
+
+    :param filenames: list of strings containing file names
+    :param repeats: int containing the number of timed runs
+    :param tolerance: float containing the largest time difference of two
+    matching beats in s
+
+    :returns: list of dictionaries containing the file, detector, samples,
+    seconds, beats and agreement of each detector on each file
+    """
+    results = []
+    for filename in filenames:
+        time, voltage = read(filename)
+        voltage_clean = filter(time, voltage)
+        rate = len(voltage) / duration_calc(time)
+        reference = time[DETECTORS["find_peaks"](voltage_clean, rate)]
+        for name, detector in sorted(DETECTORS.items()):
+            seconds = _best_time(lambda: detector(voltage_clean, rate),
+                                 repeats)
+            beats = time[detector(voltage_clean, rate)]
+            matched = matched_beats(reference, beats, tolerance)
+            mean_count = (reference.size + beats.size) / 2
+            results.append({"filename": filename,
+                            "detector": name,
+                            "samples": len(voltage),
+                            "seconds": seconds,
+                            "beats": int(beats.size),
+                            "agreement": matched / mean_count
+                            if mean_count else 1.0})
+    return results
+
+
+def decimation_benchmark(filenames, target_rate=250, repeats=5,
+                         detector="pan_tompkins"):
+    """Compare the analysis of high-rate recordings with and without
+    decimation
+
+    Every file is read once, then analyze_strip is timed on the samples
+    with every sample kept and with decimation to target_rate. Reading is
+    left out of the times since it does not depend on the decimation. The
+    peak times of both runs are paired to show how far decimation moves
+    them.
+
+    :param filenames: list of strings containing file names
+    :param target_rate: float containing the lowest sampling rate in Hz to
+    decimate to
+    :param repeats: int containing the number of timed runs
+    :param detector: string containing the name of the beat detector
+
+    :returns: list of dictionaries containing the filename, samples, rate,
+    decimated_rate, full_s, decimated_s, speedup, full_bpm, decimated_bpm,
+    matched beats and the max_shift of a matched peak in s
+    """
+    results = []
+    for filename in filenames:
+        time, voltage = read(filename)
+
+        def run(rate):
+            return analyze_strip(filename, time, voltage, DEFAULT_BAND,
+                                 DEFAULT_ORDER, None, detector, rate)
+        full = run(None)
+        decimated = run(target_rate)
+        full_peaks = np.array(full.time_peaks)
+        peaks = np.array(decimated.time_peaks)
+        shifts = [0.0]
+        if full_peaks.size and peaks.size:
+            right = np.clip(np.searchsorted(full_peaks, peaks), 1,
+                            max(full_peaks.size - 1, 1))
+            nearest = np.minimum(
+                np.abs(full_peaks[right - 1] - peaks),
+                np.abs(full_peaks[np.minimum(right, full_peaks.size - 1)] -
+                       peaks))
+            shifts = nearest[nearest <= 0.15]
+        full_s = _best_time(lambda: run(None), repeats)
+        decimated_s = _best_time(lambda: run(target_rate), repeats)
+        results.append({"filename": os.path.basename(filename),
+                        "samples": len(time),
+                        "rate": full.sampling["rate"],
+                        "decimated_rate": decimated.sampling["rate"],
+                        "full_s": full_s,
+                        "decimated_s": decimated_s,
+                        "speedup": full_s / decimated_s,
+                        "full_bpm": full.bpm,
+                        "decimated_bpm": decimated.bpm,
+                        "matched": matched_beats(full_peaks, peaks, 0.15),
+                        "max_shift": float(np.max(shifts, initial=0.0))})
+    return results
+
+
+RECORDING_LENGTHS = {"1min": 60, "1h": 3600, "24h": 86400}
+STAGES = ["read", "filter", "show_peaks", "bpm_calc", "overall_rate"]
+
+
+def write_synthetic_csv(filename, duration, sampling_rate=250, bpm=72,
+                        chunk_seconds=600, seed=0):
+    """Write a synthetic ECG recording in the test_data csv format
+
+    The recording comes from ecg_synth with a fixed heart rate, baseline
+    wander and white noise, and is generated and written in chunks so that
+    a 24 hour file does not have to fit in memory.
+
+    :param filename: string containing the name of the csv file to write
+    :param duration: float containing the length of the recording in s
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param bpm: float containing the heart rate of the recording
+    :param chunk_seconds: float containing the seconds written at a time
+    :param seed: int containing the seed of the noise generator
+    """
+    ecg_synth.write_csv(filename, duration, chunk_seconds,
+                        sampling_rate=sampling_rate, bpm=bpm, hrv=0,
+                        seed=seed)
+
+
+def synthetic_files(directory, lengths, sampling_rate=250):
+    """Create the generated recordings of the suite, reusing old ones
+
+    :param directory: string containing the directory for the files
+    :param lengths: list of strings containing keys of RECORDING_LENGTHS
+    :param sampling_rate: float containing the sampling rate in Hz
+
+    :returns: list of strings containing the file names
+    """
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    for length in lengths:
+        filename = os.path.join(directory, "synthetic_{}_{}hz.csv".format(
+            length, sampling_rate))
+        if not os.path.exists(filename):
+            logging.info("Generating {}".format(filename))
+            write_synthetic_csv(filename, RECORDING_LENGTHS[length],
+                                sampling_rate)
+        filenames.append(filename)
+    return filenames
+
+
+def measure(func, repeats=3):
+    """Time a function and measure the peak memory it allocates
+
+    The time is the fastest of several runs. Peak memory is measured with
+    tracemalloc in one extra run, since tracing slows the code down.
+
+    :param func: function taking no arguments
+    :param repeats: int containing the number of timed runs
+
+    :returns: float containing the fastest run time in seconds
+    :returns: int containing the peak number of bytes allocated
+    """
+    seconds = _best_time(func, repeats)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def benchmark_file(filename, repeats=3):
+    """Benchmark every stage of the pipeline on one recording
+
+    :param filename: string containing file name
+    :param repeats: int containing the number of timed runs per stage
+
+    :returns: list of dictionaries containing the file, stage, samples,
+    seconds, peak_bytes and samples_per_second of each stage
+    """
+    time, voltage = read(filename)
+    voltage_clean = filter(time, voltage)
+    time_peaks = show_peaks(filename, time, voltage_clean, "")
+    duration = duration_calc(time)
+    stages = {
+        "read": lambda: read(filename),
+        "filter": lambda: filter(time, voltage),
+        "show_peaks": lambda: show_peaks(filename, time, voltage_clean, ""),
+        "bpm_calc": lambda: bpm_calc(duration, num_peaks(time_peaks)),
+        "overall_rate": lambda: overall_rate(filename)}
+    results = []
+    for stage in STAGES:
+        seconds, peak = measure(stages[stage], repeats)
+        results.append({"file": os.path.basename(filename),
+                        "stage": stage,
+                        "samples": len(voltage),
+                        "seconds": seconds,
+                        "peak_bytes": peak,
+                        "samples_per_second": len(voltage) / seconds})
+    return results
+
+
+def run_suite(filenames, repeats=3):
+    """Benchmark the pipeline on a list of recordings
+
+    :param filenames: list of strings containing file names
+    :param repeats: int containing the number of timed runs per stage
+
+    :returns: dictionary containing the environment and the results of
+    every file and stage
+    """
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try:
+        results = []
+        for filename in filenames:
+            results.extend(benchmark_file(filename, repeats))
+    finally:
+        logger.setLevel(level)
+    return {"python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "results": results}
+
+
+def compare(report, baseline, tolerance=0.25):
+    """Find the stages that got slower than a baseline report
+
+    :param report: dictionary returned by run_suite
+    :param baseline: dictionary returned by run_suite on an earlier run
+    :param tolerance: float containing the allowed fractional slowdown
+
+    :returns: list of strings describing each regression
+    """
+    previous = {(r["file"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = previous.get((result["file"], result["stage"]))
+        if old is None:
+            continue
+        if result["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append("{} {}: {:.4f} s, baseline {:.4f} s".format(
+                result["file"], result["stage"], result["seconds"],
+                old["seconds"]))
+    return regressions
+
+
+def print_report(report):
+    """Print the results of run_suite as a table
+
+    :param report: dictionary returned by run_suite
+    """
+    print("{:<28} {:<13} {:>10} {:>11} {:>10} {:>14}".format(
+        "file", "stage", "samples", "ms", "peak MB", "samples/s"))
+    for r in report["results"]:
+        print("{:<28} {:<13} {:>10} {:>11.3f} {:>10.2f} {:>14,.0f}".format(
+            r["file"], r["stage"], r["samples"], r["seconds"] * 1000,
+            r["peak_bytes"] / 2 ** 20, r["samples_per_second"]))
+
+
+STARTUP_MODULES = ["numpy", "scipy.signal", "matplotlib.figure",
+                   "PIL.ImageTk", "requests", "ecg_analysis", "ecg_cache",
+                   "cloud_client", "patient_GUI"]
+
+_IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {}
+print(time.perf_counter() - start)
+print(int("scipy.signal" in sys.modules), int("matplotlib" in sys.modules),
+      int("PIL" in sys.modules), int("requests" in sys.modules))
+"""
+
+_WINDOW_SCRIPT = """
+import time
+start = time.perf_counter()
+import patient_GUI
+root = patient_GUI.design_window(run=False)
+root.update()
+print(time.perf_counter() - start)
+root.destroy()
+"""
+
+
+def _run_script(script):
+    """Run a Python snippet in a fresh interpreter in this directory
+
+    :param script: string containing the code to run
+
+    :returns: list of strings containing the printed lines
+    :returns: float containing the wall time of the whole process in s
+    """
+    start = timer.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    return output.stdout.split(), timer.perf_counter() - start
+
+
+def import_costs(modules=STARTUP_MODULES, repeats=3):
+    """Measure how long each module takes to import in a new interpreter
+
+    Every import runs in a fresh process, so modules imported by an
+    earlier measurement are not already loaded. The fastest run is kept.
+
+    :param modules: list of strings containing module names
+    :param repeats: int containing the number of runs per module
+
+    :returns: list of dictionaries containing the module, the import
+    seconds and whether scipy.signal, matplotlib, Pillow and requests were
+    loaded with it
+    """
+    results = []
+    for module in modules:
+        best = None
+        for _ in range(repeats):
+            lines, _ = _run_script(_IMPORT_SCRIPT.format(module))
+            if best is None or float(lines[0]) < best[0]:
+                best = (float(lines[0]),) + tuple(
+                    flag == "1" for flag in lines[1:5])
+        results.append({"module": module, "seconds": best[0],
+                        "loads_scipy": best[1],
+                        "loads_matplotlib": best[2],
+                        "loads_pil": best[3],
+                        "loads_requests": best[4]})
+    return results
+
+
+def time_to_window(repeats=3):
+    """Measure how long the patient GUI takes to show its window
+
+    :param repeats: int containing the number of runs
+
+    :returns: float containing the fastest time in s from the start of the
+    imports until the window is drawn, or None if no display is available
+    :returns: float containing the fastest wall time in s of the whole
+    process, including interpreter start-up, or None
+    """
+    best = (None, None)
+    for _ in range(repeats):
+        try:
+            lines, wall = _run_script(_WINDOW_SCRIPT)
+        except subprocess.CalledProcessError:
+            logging.warning("Could not open the patient GUI window")
+            return None, None
+        if best[0] is None or float(lines[0]) < best[0]:
+            best = (float(lines[0]), wall)
+    return best
+
+
+def patient_images(image_files, ecg_files, uploads=20):
+    """Make the images of a realistic patient history
+
+    Every upload has one medical image, cycling through image_files, and
+    the rendered trace of one ECG strip, cycling through ecg_files.
+
+    :param image_files: list of strings containing medical image files
+    :param ecg_files: list of strings containing ECG csv files
+    :param uploads: int containing the number of uploads in the history
+
+    :returns: list of tuples containing the kind, file name and bytes of
+    every image
+    """
+    from ecg_analysis import analyze
+    medical = []
+    for filename in image_files:
+        with open(filename, "rb") as f:
+            medical.append((os.path.basename(filename), f.read()))
+    traces = [(os.path.basename(filename) + ".png",
+               analyze(filename).render()) for filename in ecg_files]
+    images = []
+    for i in range(uploads):
+        images.append(("medical",) + medical[i % len(medical)])
+        images.append(("ecg",) + traces[i % len(traces)])
+    return images
+
+
+def _mock_database():
+    """Point the database models of the server at an in-memory database
+
+    The server functions run unchanged against mongomock, so the
+    benchmarks measure the code that ships without a MongoDB server.
+
+    :returns: the connection the models used before, to be given to
+    _restore_database
+    """
+    import mongomock
+    from pymodm import connection
+    alias = connection.DEFAULT_CONNECTION_ALIAS
+    previous = connection._CONNECTIONS.get(alias)
+    connection._CONNECTIONS[alias] = connection.ConnectionInfo(
+        parsed_uri=None, conn_string="mongomock://localhost/benchmark",
+        database=mongomock.MongoClient()["benchmark"])
+    return previous
+
+
+def _restore_database(previous):
+    """Give the database models of the server back their connection
+
+    :param previous: connection returned by _mock_database
+    """
+    from pymodm import connection
+    alias = connection.DEFAULT_CONNECTION_ALIAS
+    if previous is None:
+        connection._CONNECTIONS.pop(alias, None)
+    else:
+        connection._CONNECTIONS[alias] = previous
+
+
+def _upload_history(images, hrv=None):
+    """Upload a patient history through cloud_server.upsert_patient
+
+    Every upload is sent as the b64 strings the patient GUI sends, so the
+    server decodes and stores it as it does for /api/add_files.
+
+    :param images: list of tuples returned by patient_images
+    :param hrv: list of dictionaries containing the heart rate variability
+    stored for the uploads in turn, or None to store none
+    """
+    import base64
+    import cloud_server
+    hrv = hrv or [None]
+    uploads = zip(images[0::2], images[1::2])
+    for i, ((_, medical, medical_data), (_, ecg, ecg_data)) in \
+            enumerate(uploads):
+        cloud_server.upsert_patient(
+            "Yume Choi", 1, medical,
+            base64.b64encode(medical_data).decode("utf-8"), ecg,
+            base64.b64encode(ecg_data).decode("utf-8"), 60 + i % 40,
+            "2021-04-10 12:{:02d}:{:02d}".format(i // 60 % 60, i % 60),
+            hrv[i % len(hrv)])
+
+
+def image_storage_benchmark(images, repeats=5):
+    """Compare storing images as b64 strings with storing their bytes
+
+    The patient history is uploaded through the server functions into an
+    in-memory mongomock database, which stores every image as its bytes,
+    content type and size, and the same images are also stored as the b64
+    string documents that older versions of the server saved. The BSON
+    size of both kinds of documents is what Mongo stores and sends. The
+    time of cloud_server.retrieve_all_info, which encodes the bytes as b64
+    for get_info, is compared with reading the b64 documents the way the
+    older server did, and cloud_server.load_images, which the images route
+    uses, reads the bytes alone. Network and disk time are left out, and
+    both readings include the copying mongomock does in place of BSON
+    decoding.
+
+    :param images: list of tuples returned by patient_images
+    :param repeats: int containing the number of timed runs
+
+    :returns: dictionary containing the number of "images", the total
+    "raw_bytes" of the images, the stored "b64_bytes" and "binary_bytes",
+    the "b64_get_info_s" and "binary_get_info_s" and the "binary_raw_s"
+    of reading the bytes alone
+    """
+    import base64
+    import bson
+    import cloud_server
+    from database_definitions import Image
+    previous = _mock_database()
+    try:
+        _upload_history(images)
+        collection = Image._mongometa.collection
+        binary_documents = list(collection.find())
+        image_ids = [document["_id"] for document in binary_documents]
+        legacy = collection.database["legacy_images"]
+        legacy.insert_many([
+            {"medical_record_number": 1, "kind": document["kind"],
+             "filename": document["filename"],
+             "b64": base64.b64encode(document["data"]).decode("utf-8")}
+            for document in binary_documents])
+
+        def get_info_b64():
+            return json.dumps({"images_b64": [
+                document["b64"] for document in
+                legacy.find({"medical_record_number": 1})]})
+
+        def get_info_binary():
+            return json.dumps(cloud_server.retrieve_all_info(1))
+        info = cloud_server.retrieve_all_info(1)
+        assert sorted(info["medical_images_b64"] + info["ecg_images_b64"]) \
+            == sorted(json.loads(get_info_b64())["images_b64"])
+        return {"images": len(binary_documents),
+                "raw_bytes": sum(len(data) for _, _, data in images),
+                "b64_bytes": sum(len(bson.encode(document))
+                                 for document in legacy.find()),
+                "binary_bytes": sum(len(bson.encode(document))
+                                    for document in binary_documents),
+                "b64_get_info_s": _best_time(get_info_b64, repeats),
+                "binary_get_info_s": _best_time(get_info_binary, repeats),
+                "binary_raw_s": _best_time(
+                    lambda: cloud_server.load_images(image_ids), repeats)}
+    finally:
+        _restore_database(previous)
+
+
+def patient_view_benchmark(images, hrv=None, repeats=5):
+    """Compare get_info with the summary route and fetching one image
+
+    The patient history is uploaded through the server functions into an
+    in-memory mongomock database, with one upload holding a medical image,
+    an ECG trace, a heart rate, a timestamp and heart rate variability.
+    Three ways of showing the patient are then timed with the functions
+    behind the routes: cloud_server.retrieve_all_info for get_info, which
+    encodes every image as b64 in one JSON response,
+    cloud_server.retrieve_summary for the summary route, and
+    cloud_server.find_patient_image for the latest ECG image. Like
+    image_storage_benchmark this leaves out network and disk time, but the
+    response sizes are what would be sent.
+
+    :param images: list of tuples returned by patient_images
+    :param hrv: list of dictionaries containing the heart rate variability
+    stored for the uploads in turn, or None to store empty ones
+    :param repeats: int containing the number of timed runs
+
+    :returns: dictionary containing the number of "uploads", the
+    "get_info_bytes", "summary_bytes" and "image_bytes" of the responses
+    and the "get_info_s", "summary_s" and "image_s" it takes to make them
+    """
+    import cloud_server
+    previous = _mock_database()
+    try:
+        _upload_history(images, hrv)
+
+        def get_info():
+            return json.dumps(cloud_server.retrieve_all_info(1))
+
+        def summary():
+            return json.dumps(cloud_server.retrieve_summary(1))
+
+        def image():
+            return bytes(cloud_server.find_patient_image(1, "ecg", -1).data)
+        return {"uploads": len(cloud_server.retrieve_summary(1)["datetimes"]),
+                "get_info_bytes": len(get_info()),
+                "summary_bytes": len(summary()),
+                "image_bytes": len(image()),
+                "get_info_s": _best_time(get_info, repeats),
+                "summary_s": _best_time(summary, repeats),
+                "image_s": _best_time(image, repeats)}
+    finally:
+        _restore_database(previous)
+
+
+def main(argv=None):
+    """Run the ecg_analysis benchmarks
+
+    "read" prints the read throughput of every file, "filter" compares the
+    legacy filtfilt path with the cached SOS filter, "detectors" compares
+    the speed and beats of the beat detectors, "decimation" compares the
+    analysis of 1 and 2 kHz recordings with and without decimation to
+    --target-rate, "startup" measures the import cost of every module and
+    the time until the patient GUI window is shown, "images" compares the
+    stored size and get_info cost of images kept as b64 strings and as
+    bytes, "patient" compares the response size and cost of get_info with
+    the summary route and one image, and "suite" times every pipeline
+    stage on the bundled strips and on generated recordings. The suite
+    can save its results as JSON and exits with status 1 if any stage is
+    slower than in a baseline JSON file.
+
+    :param argv: list of strings containing command line arguments
+
+    :returns: int containing the exit status
+    """
+    parser = argparse.ArgumentParser(description="Benchmark ecg_analysis")
+    parser.add_argument("benchmark",
+                        choices=["read", "filter", "detectors", "decimation",
+                                 "startup", "images", "patient",
+                                 "suite"])
+    parser.add_argument("directory", nargs="?", default="test_data")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--lengths", default="1min,1h,24h",
+                        help="generated recordings, from "
+                             + ",".join(RECORDING_LENGTHS))
+    parser.add_argument("--data-dir", default="bench_data",
+                        help="where generated recordings are kept")
+    parser.add_argument("--output", help="save suite results as JSON")
+    parser.add_argument("--baseline", help="suite results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--target-rate", type=float, default=250,
+                        help="rate in Hz to decimate to")
+    parser.add_argument("--uploads", type=int, default=20,
+                        help="uploads in the patient history of images")
+    args = parser.parse_args(argv)
+    pattern = os.path.join(args.directory, "test_data*.csv")
+    filenames = sorted(glob.glob(pattern))
+    if args.benchmark == "read":
+        for filename in filenames:
+            rate = read_throughput(filename, args.repeats)
+            print("{:<40} {:>14,.0f} samples/s".format(filename, rate))
+    elif args.benchmark == "filter":
+        print("{:<32} {:>8} {:>11} {:>11} {:>8}".format(
+            "file", "samples", "legacy ms", "sos ms", "speedup"))
+        for row in filter_benchmark(filenames, args.repeats):
+            print("{:<32} {:>8} {:>11.3f} {:>11.3f} {:>7.2f}x".format(
+                row["filename"], row["samples"], row["legacy_s"] * 1000,
+                row["sos_s"] * 1000, row["speedup"]))
+    elif args.benchmark == "detectors":
+        print("{:<32} {:<13} {:>8} {:>9} {:>6} {:>10}".format(
+            "file", "detector", "samples", "ms", "beats", "agreement"))
+        for row in detector_benchmark(filenames, args.repeats):
+            print("{:<32} {:<13} {:>8} {:>9.3f} {:>6} {:>9.1%}".format(
+                row["filename"], row["detector"], row["samples"],
+                row["seconds"] * 1000, row["beats"], row["agreement"]))
+    elif args.benchmark == "decimation":
+        filenames = synthetic_files(args.data_dir, ["1min"], 1000) + \
+            synthetic_files(args.data_dir, ["1min"], 2000)
+        print("{:<28} {:>8} {:>8} {:>9} {:>9} {:>8} {:>10} {:>10}".format(
+            "file", "samples", "rate", "full ms", "dec. ms", "speedup",
+            "bpm", "max shift"))
+        for row in decimation_benchmark(filenames, args.target_rate,
+                                        args.repeats):
+            print("{:<28} {:>8} {:>8.0f} {:>9.2f} {:>9.2f} {:>7.2f}x "
+                  "{:>4} / {:<3} {:>7.2f} ms".format(
+                      row["filename"], row["samples"], row["rate"],
+                      row["full_s"] * 1000, row["decimated_s"] * 1000,
+                      row["speedup"], row["full_bpm"],
+                      row["decimated_bpm"], row["max_shift"] * 1000))
+    elif args.benchmark == "startup":
+        print("{:<20} {:>9} {:>7} {:>11} {:>6} {:>9}".format(
+            "module", "import s", "scipy", "matplotlib", "PIL", "requests"))
+        for row in import_costs(repeats=args.repeats):
+            print("{:<20} {:>9.3f} {:>7} {:>11} {:>6} {:>9}".format(
+                row["module"], row["seconds"],
+                "yes" if row["loads_scipy"] else "no",
+                "yes" if row["loads_matplotlib"] else "no",
+                "yes" if row["loads_pil"] else "no",
+                "yes" if row["loads_requests"] else "no"))
+        window, wall = time_to_window(args.repeats)
+        if window is None:
+            print("No display available to time the patient GUI window")
+        else:
+            print("Patient GUI window shown after {:.3f} s of imports and "
+                  "setup, {:.3f} s including interpreter start".format(
+                      window, wall))
+    elif args.benchmark == "images":
+        images = patient_images(sorted(glob.glob("images/*.jpg")),
+                                filenames[:10], args.uploads)
+        result = image_storage_benchmark(images, args.repeats)
+        print("{} images of {:.2f} MB".format(
+            result["images"], result["raw_bytes"] / 2 ** 20))
+        print("{:<8} {:>10} {:>13}".format("storage", "stored MB",
+                                           "get_info ms"))
+        for name in ("b64", "binary"):
+            print("{:<8} {:>10.2f} {:>13.2f}".format(
+                name, result[name + "_bytes"] / 2 ** 20,
+                result[name + "_get_info_s"] * 1000))
+        print("Reading the binary images without b64 encoding takes "
+              "{:.2f} ms".format(result["binary_raw_s"] * 1000))
+    elif args.benchmark == "patient":
+        from ecg_analysis import analyze, encode_rr
+        images = patient_images(sorted(glob.glob("images/*.jpg")),
+                                filenames[:10], args.uploads)
+        hrv = []
+        for filename in filenames[:10]:
+            analysis = analyze(filename)
+            hrv.append(dict(analysis.hrv, rr=encode_rr(analysis.rr)))
+        result = patient_view_benchmark(images, hrv, args.repeats)
+        print("Patient with {} uploads".format(result["uploads"]))
+        print("{:<10} {:>12} {:>10}".format("response", "bytes", "ms"))
+        for name in ("get_info", "summary", "image"):
+            print("{:<10} {:>12,} {:>10.3f}".format(
+                name, result[name + "_bytes"], result[name + "_s"] * 1000))
+    elif args.benchmark == "suite":
+        lengths = [x for x in args.lengths.split(",") if x]
+        filenames += synthetic_files(args.data_dir, lengths)
+        report = run_suite(filenames, args.repeats)
+        print_report(report)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(report, json.load(f), args.tolerance)
+            for regression in regressions:
+                print("REGRESSION " + regression)
+            if regressions:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
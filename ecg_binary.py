@@ -0,0 +1,418 @@
+# ecg_binary.py
+
+import argparse
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from ecg_preprocess import effective_rate
+
+MAGIC = b"ECGB"
+VERSION = 1
+EXTENSION = ".ecgb"
+# magic, version, flags, number of leads, offset of the sample data, number
+# of samples, sampling rate in Hz, start time in s and voltage units
+HEADER = struct.Struct("<4sHHIIQdd16s")
+EXPLICIT_TIME = 1
+SLOT_TIME = 2
+ALIGNMENT = 16
+
+
+def is_binary(filename):
+    """Check whether a file is a binary ECG container
+
+    :param filename: string containing the file name to-be-opened
+
+    :returns: bool that is True if the file starts with MAGIC
+    """
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def time_layout(time, tolerance=0.25):
+    """Choose the most compact way to store the times of a strip
+
+    The sampling rate is estimated with ecg_preprocess.effective_rate and
+    every time is given the nearest slot of a grid starting at time[0]. If
+    every time lies within tolerance sampling periods of its slot, so that
+    times rounded when printed still count, the times are rebuilt from the
+    start time and the rate, plus the slot numbers if rows are missing.
+    Otherwise the times have to be stored as they are.
+
+    :param time: array of floats containing increasing time data points
+    :param tolerance: float containing the largest distance of a time from
+    its slot as a fraction of the sampling period
+
+    :returns: float containing the sampling rate in Hz
+    :returns: int containing the time flags, 0 for a uniform grid,
+    SLOT_TIME for a grid with missing slots or EXPLICIT_TIME
+    :returns: array of uint32 containing the slot of every sample
+    """
+    if len(time) < 2:
+        return 0.0, 0, np.zeros(len(time), dtype=np.uint32)
+    rate = effective_rate(time)
+    position = (time - time[0]) * rate
+    slots = np.rint(position)
+    on_grid = np.abs(position - slots).max() <= tolerance and \
+        (np.diff(slots) > 0).all() and slots[-1] < 2 ** 32
+    if not on_grid:
+        return rate, EXPLICIT_TIME, slots.astype(np.uint32)
+    flags = 0 if slots[-1] == len(time) - 1 else SLOT_TIME
+    return rate, flags, slots.astype(np.uint32)
+
+
+def write(filename, time, voltage, units="mV", names=None, tolerance=0.25):
+    """Save a strip as a binary ECG container
+
+    The file holds a fixed header, the lead names and the samples. The
+    voltage is stored as float32 with one row per sample and one column
+    per lead. Times on a uniform grid are stored as the start time and the
+    sampling rate alone, and times on a grid with missing rows also keep
+    the uint32 slot of every sample. Any other times are stored as
+    float64, since float32 cannot tell samples apart after a few hours.
+
+    :param filename: string containing the name of the file to write
+    :param time: array of floats containing all time data points
+    :param voltage: array of floats containing all voltage data points, or
+    an (n_samples, n_leads) array
+    :param units: string containing the voltage units, at most 16 bytes
+    :param names: list of strings containing the name of every lead, or
+    None for "lead 1", "lead 2", ...
+    :param tolerance: float containing the largest distance of a time from
+    a uniform grid, as a fraction of the sampling period, for the times to
+    be left out
+
+    :returns: dictionary containing the header written to the file
+    """
+    time = np.asarray(time, dtype=float)
+    voltage = np.asarray(voltage, dtype=np.float32)
+    voltage = voltage.reshape(len(time), -1)
+    num_leads = voltage.shape[1]
+    if names is None:
+        names = ["lead {}".format(i + 1) for i in range(num_leads)]
+    if len(names) != num_leads:
+        raise ValueError("Expected {} lead names, got {}".format(
+            num_leads, len(names)))
+    rate, flags, slots = time_layout(time, tolerance)
+    start = float(time[0]) if len(time) else 0.0
+    with open(filename, "wb") as f:
+        f.write(_header_bytes(flags, len(time), rate, start, units, names))
+        if flags & EXPLICIT_TIME:
+            f.write(np.ascontiguousarray(time).tobytes())
+        elif flags & SLOT_TIME:
+            f.write(slots.tobytes())
+        f.write(np.ascontiguousarray(voltage).tobytes())
+    return read_header(filename)
+
+
+def _header_bytes(flags, num_samples, rate, start, units, names):
+    """Pack the header and lead names that come before the samples
+
+    :param flags: int containing the time flags
+    :param num_samples: int containing the number of samples
+    :param rate: float containing the sampling rate in Hz
+    :param start: float containing the time of the first sample in s
+    :param units: string containing the voltage units, at most 16 bytes
+    :param names: list of strings containing the name of every lead
+
+    :returns: bytes containing the header padded to the data offset
+    """
+    encoded_units = units.encode("utf-8")
+    if len(encoded_units) > 16:
+        raise ValueError("Units {} are longer than 16 bytes".format(units))
+    encoded_names = "\n".join(names).encode("utf-8")
+    data_offset = HEADER.size + len(encoded_names)
+    data_offset += -data_offset % ALIGNMENT
+    fixed = HEADER.pack(MAGIC, VERSION, flags, len(names), data_offset,
+                        num_samples, rate, start, encoded_units)
+    return fixed + encoded_names.ljust(data_offset - HEADER.size, b"\0")
+
+
+class BinaryWriter:
+    """Write a binary ECG container a block of samples at a time
+
+    Samples are appended to the file as they arrive, so recordings of any
+    length are written with constant memory. The times must lie on the
+    grid start_time + slot / sampling_rate, as they do for generated or
+    resampled recordings. If every slot is filled the file gets the
+    uniform layout and the header is updated in place when the writer is
+    closed. Otherwise the slot numbers, which are kept in a temporary file
+    meanwhile, are copied in front of the samples when the writer is
+    closed. The writer is a context manager that closes itself.
+
+    :param filename: string containing the name of the file to write
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param start_time: float containing the time of slot 0 in s
+    :param num_leads: int containing the number of leads
+    :param units: string containing the voltage units, at most 16 bytes
+    :param names: list of strings containing the name of every lead, or
+    None for "lead 1", "lead 2", ...
+    """
+    def __init__(self, filename, sampling_rate, start_time=0.0,
+                 num_leads=1, units="mV", names=None):
+        if names is None:
+            names = ["lead {}".format(i + 1) for i in range(num_leads)]
+        if len(names) != num_leads:
+            raise ValueError("Expected {} lead names, got {}".format(
+                num_leads, len(names)))
+        self.filename = filename
+        self.sampling_rate = float(sampling_rate)
+        self.start_time = float(start_time)
+        self.num_leads = num_leads
+        self.units = units
+        self.names = names
+        self.num_samples = 0
+        self._regular = True
+        self._last_slot = -1
+        self._file = open(filename, "wb")
+        self._file.write(_header_bytes(0, 0, self.sampling_rate,
+                                       self.start_time, units, names))
+        self._slots = tempfile.TemporaryFile()
+
+    def write(self, time, voltage):
+        """Append a block of samples
+
+        :param time: array of floats containing the time of every sample
+        :param voltage: array of floats containing the voltage of every
+        sample, or an (n_samples, n_leads) array
+        """
+        time = np.asarray(time, dtype=float)
+        if time.size == 0:
+            return
+        slots = np.rint((time - self.start_time) * self.sampling_rate)
+        if slots[0] <= self._last_slot or (np.diff(slots) <= 0).any():
+            raise ValueError("Sample times must increase")
+        if slots[-1] >= 2 ** 32:
+            raise ValueError("Recording is too long for uint32 slots")
+        if slots[0] != self._last_slot + 1 or \
+                slots[-1] - slots[0] != time.size - 1:
+            self._regular = False
+        self._last_slot = slots[-1]
+        self._slots.write(slots.astype(np.uint32).tobytes())
+        voltage = np.asarray(voltage, dtype=np.float32)
+        self._file.write(voltage.reshape(time.size, self.num_leads)
+                         .tobytes())
+        self.num_samples += time.size
+
+    def close(self):
+        """Finish the header and close the file
+
+        :returns: dictionary containing the header written to the file
+        """
+        if self._file.closed:
+            return read_header(self.filename)
+        flags = 0 if self._regular else SLOT_TIME
+        header = _header_bytes(flags, self.num_samples, self.sampling_rate,
+                               self.start_time, self.units, self.names)
+        if self._regular:
+            self._file.seek(0)
+            self._file.write(header)
+            self._file.close()
+        else:
+            self._file.close()
+            partial = self.filename + ".part"
+            os.replace(self.filename, partial)
+            with open(self.filename, "wb") as f, open(partial, "rb") as p:
+                f.write(header)
+                self._slots.seek(0)
+                shutil.copyfileobj(self._slots, f)
+                p.seek(len(header))
+                shutil.copyfileobj(p, f)
+            os.remove(partial)
+        self._slots.close()
+        return read_header(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class TimeAxis:
+    """Times of a container that are computed only when they are used
+
+    The times of a container whose samples lie on a grid are not stored,
+    or only stored as slot numbers, so they are computed from the start
+    time and the sampling rate. This class computes them for the samples
+    that are indexed or sliced, so opening a long recording does not build
+    an array of all its times. Converting the whole axis with np.asarray,
+    or using it in a numpy operation, computes every time.
+
+    :ivar start_time: float containing the time of slot 0 in s
+    :ivar sampling_rate: float containing the sampling rate in Hz
+    :ivar slots: memory map of uint32 containing the slot of every sample,
+    or None if the samples fill every slot
+    """
+    ndim = 1
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, start_time, sampling_rate, num_samples, slots=None):
+        self.start_time = start_time
+        self.sampling_rate = sampling_rate
+        self.slots = slots
+        self._num_samples = num_samples
+
+    def __len__(self):
+        return self._num_samples
+
+    @property
+    def shape(self):
+        return (self._num_samples,)
+
+    @property
+    def size(self):
+        return self._num_samples
+
+    def __getitem__(self, index):
+        """Compute the times of some samples
+
+        :param index: int, slice or array of ints or bools selecting the
+        samples
+
+        :returns: float or array of floats containing the times
+        """
+        if isinstance(index, slice):
+            picked = range(self._num_samples)[index]
+            positions = np.arange(picked.start, picked.stop, picked.step)
+        elif isinstance(index, (int, np.integer)):
+            positions = range(self._num_samples)[index]
+        else:
+            positions = np.asarray(index)
+            if positions.dtype == bool:
+                positions = np.flatnonzero(positions)
+            positions = np.where(positions < 0,
+                                 positions + self._num_samples, positions)
+        if self.slots is not None:
+            positions = self.slots[positions]
+        return self.start_time + positions / self.sampling_rate
+
+    def __array__(self, dtype=None, copy=None):
+        time = self[:]
+        return time if dtype is None else time.astype(dtype)
+
+
+def read_header(filename):
+    """Read the header of a binary ECG container
+
+    :param filename: string containing the file name to-be-opened
+
+    :returns: dictionary containing the "sampling_rate", "start_time",
+    "num_samples", "num_leads", "units", lead "names", the time "layout"
+    as "uniform", "slots" or "explicit" and the "data_offset" of the
+    samples in bytes
+    """
+    with open(filename, "rb") as f:
+        fixed = f.read(HEADER.size)
+        if len(fixed) < HEADER.size or not fixed.startswith(MAGIC):
+            raise ValueError("{} is not a binary ECG file".format(filename))
+        magic, version, flags, num_leads, data_offset, num_samples, rate, \
+            start, units = HEADER.unpack(fixed)
+        if version > VERSION:
+            raise ValueError("{} has unsupported version {}".format(
+                filename, version))
+        names = f.read(data_offset - HEADER.size).rstrip(b"\0")
+    return {"sampling_rate": rate,
+            "start_time": start,
+            "num_samples": num_samples,
+            "num_leads": num_leads,
+            "units": units.rstrip(b"\0").decode("utf-8"),
+            "names": names.decode("utf-8").split("\n"),
+            "layout": ("explicit" if flags & EXPLICIT_TIME else
+                       "slots" if flags & SLOT_TIME else "uniform"),
+            "data_offset": data_offset}
+
+
+def load(filename):
+    """Memory-map the samples of a binary ECG container
+
+    Opening a file only reads its header. The voltage is a read-only
+    float32 memory map, so samples are read from disk when they are
+    touched, and slicing a long recording only reads the slice. Times
+    stored as float64 are mapped in the same way; otherwise they are a
+    TimeAxis, which computes them from the start time, the sampling rate
+    and the mapped slots for the samples that are used.
+
+    :param filename: string containing the file name to-be-opened
+
+    :returns: memory map or TimeAxis containing all time data points
+    :returns: (n_samples, n_leads) memory map of float32 containing the
+    voltage of every lead
+    :returns: dictionary containing the header, as from read_header
+    """
+    header = read_header(filename)
+    num_samples = header["num_samples"]
+    shape = (num_samples, header["num_leads"])
+    if num_samples == 0:
+        return np.empty(0), np.empty(shape, dtype=np.float32), header
+    offset = header["data_offset"]
+    if header["layout"] == "explicit":
+        time = np.memmap(filename, dtype=np.float64, mode="r",
+                         offset=offset, shape=(num_samples,))
+        offset += time.nbytes
+    elif header["layout"] == "slots":
+        slots = np.memmap(filename, dtype=np.uint32, mode="r",
+                          offset=offset, shape=(num_samples,))
+        offset += slots.nbytes
+        time = TimeAxis(header["start_time"], header["sampling_rate"],
+                        num_samples, slots)
+    else:
+        time = TimeAxis(header["start_time"], header["sampling_rate"],
+                        num_samples)
+    voltage = np.memmap(filename, dtype=np.float32, mode="r",
+                        offset=offset, shape=shape)
+    return time, voltage, header
+
+
+def convert(filename, output=None, units="mV"):
+    """Convert an ECG csv file into a binary ECG container
+
+    Rows with missing data are dropped as in ecg_analysis.read_leads, and
+    the lead names are taken from the csv header if there is one.
+
+    :param filename: string containing the name of the csv file
+    :param output: string containing the name of the binary file, or None
+    to replace the extension of filename with EXTENSION
+    :param units: string containing the voltage units
+
+    :returns: string containing the name of the binary file
+    """
+    from ecg_analysis import read_leads
+    if output is None:
+        output = os.path.splitext(filename)[0] + EXTENSION
+    time, voltage, names = read_leads(filename)
+    header = write(output, time, voltage, units, names)
+    logging.info("Converted {} to {} ({} samples, {} bytes)".format(
+        filename, output, header["num_samples"], os.path.getsize(output)))
+    return output
+
+
+def main(argv=None):
+    """Convert ECG csv files given on the command line
+
+    :param argv: list of strings containing command line arguments
+    """
+    parser = argparse.ArgumentParser(description="Convert ECG csv files "
+                                                 "to binary containers")
+    parser.add_argument("filenames", nargs="+")
+    parser.add_argument("--output-dir", help="where the converted files "
+                                             "are written")
+    parser.add_argument("--units", default="mV")
+    args = parser.parse_args(argv)
+    for filename in args.filenames:
+        output = None
+        if args.output_dir:
+            base = os.path.splitext(os.path.basename(filename))[0]
+            output = os.path.join(args.output_dir, base + EXTENSION)
+        output = convert(filename, output, args.units)
+        print("{} -> {} ({:.0%} of the csv size)".format(
+            filename, output,
+            os.path.getsize(output) / os.path.getsize(filename)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,289 @@
+# ecg_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from ecg_analysis import analyze, preview, encode_rr, ANALYSIS_VERSION, \
+    DEFAULT_BAND, DEFAULT_ORDER, DEFAULT_DETECTOR
+from ecg_instrument import instrumented
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".ecg_cache")
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+def file_digest(filename, block_size=1024 * 1024):
+    """Hash the contents of a file with SHA-256
+
+    :param filename: string containing file name
+    :param block_size: int containing the number of bytes read at a time
+
+    :returns: string containing the hexadecimal digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def analysis_entry(analysis):
+    """Collect the results of an analysis that are kept in the cache
+
+    :param analysis: ECGAnalysis containing the results to store
+
+    :returns: dictionary containing the version, bpm, time_peaks, the RR
+    intervals packed by ecg_analysis.encode_rr in "rr", the hrv metrics,
+    duration, extremes, out_of_range, signal stats and sampling of the
+    analysis
+    """
+    return {"version": ANALYSIS_VERSION,
+            "bpm": analysis.bpm,
+            "time_peaks": [float(t) for t in analysis.time_peaks],
+            "rr": encode_rr(analysis.rr),
+            "hrv": analysis.hrv,
+            "duration": float(analysis.duration),
+            "extremes": [float(v) for v in analysis.extremes],
+            "out_of_range": analysis.out_of_range,
+            "stats": analysis.stats,
+            "sampling": analysis.sampling}
+
+
+class AnalysisCache:
+    """Persistent, size-bounded cache of ECG analysis results
+
+    Every entry is stored as a JSON file holding the heart rate and peak
+    times plus a png of the rendered trace. Entries are keyed by a hash of
+    the file contents, the analysis parameters and ANALYSIS_VERSION, so a
+    renamed copy of a file is still a hit, an edited file is a miss and
+    results from an older version of the analysis are never returned. The
+    modification time of the JSON file records the last use of an entry;
+    the least recently used entries are deleted once the cache grows past
+    max_bytes.
+
+    :param directory: string containing the cache directory
+    :param max_bytes: int containing the maximum total size of the cache
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, filename, **params):
+        """Build the cache key of a file analyzed with given parameters
+
+        :param filename: string containing file name
+        :param params: analysis parameters passed on to analyze
+
+        :returns: string containing the hexadecimal cache key
+        """
+        stamp = json.dumps({"file": file_digest(filename),
+                            "params": params,
+                            "version": ANALYSIS_VERSION}, sort_keys=True)
+        return hashlib.sha256(stamp.encode()).hexdigest()
+
+    def paths(self, key):
+        """Find the files that make up a cache entry
+
+        :param key: string containing the cache key
+
+        :returns: string containing the path of the JSON result
+        :returns: string containing the path of the png trace
+        """
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".png"
+
+    def get(self, key):
+        """Look up a cache entry and mark it as recently used
+
+        :param key: string containing the cache key
+
+        :returns: dictionary containing the cached result, the png bytes in
+        "png" and their path in "image", or None if there is no valid entry
+        """
+        json_path, png_path = self.paths(key)
+        try:
+            with open(json_path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("version") != ANALYSIS_VERSION or \
+                not os.path.exists(png_path):
+            self.remove(key)
+            return None
+        with open(png_path, "rb") as f:
+            entry["png"] = f.read()
+        os.utime(json_path)
+        entry["image"] = png_path
+        return entry
+
+    def put(self, key, analysis):
+        """Store the result and rendered trace of an analysis
+
+        :param key: string containing the cache key
+        :param analysis: ECGAnalysis containing the results to store
+
+        :returns: dictionary containing the stored result, the png bytes in
+        "png" and their path in "image"
+        """
+        json_path, png_path = self.paths(key)
+        entry = analysis_entry(analysis)
+        png = analysis.render()
+        tmp_png = self._temporary(".png")
+        with open(tmp_png, "wb") as f:
+            f.write(png)
+        os.replace(tmp_png, png_path)
+        tmp_json = self._temporary(".json")
+        with open(tmp_json, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_json, json_path)
+        self.evict(keep=key)
+        entry["png"] = png
+        entry["image"] = png_path
+        return entry
+
+    def remove(self, key):
+        """Delete the files of a cache entry if they exist
+
+        :param key: string containing the cache key
+        """
+        for path in self.paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def size(self):
+        """Add up the size of every file in the cache directory
+
+        :returns: int containing the total size in bytes
+        """
+        return sum(entry.stat().st_size
+                   for entry in os.scandir(self.directory))
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits
+
+        :param keep: string containing the key of an entry that must not
+        be deleted, such as the one that was just stored
+        """
+        entries = []
+        total = 0
+        for item in os.scandir(self.directory):
+            total += item.stat().st_size
+            if item.name.endswith(".json") and item.name[:-5] != keep:
+                entries.append((item.stat().st_mtime, item.name[:-5]))
+        entries.sort()
+        while total > self.max_bytes and entries:
+            mtime, key = entries.pop(0)
+            for path in self.paths(key):
+                try:
+                    total -= os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            logging.info("Evicted {} from the analysis cache".format(key))
+
+    def _temporary(self, suffix):
+        """Create an empty temporary file inside the cache directory
+
+        :param suffix: string containing the file extension
+
+        :returns: string containing the path of the temporary file
+        """
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=self.directory,
+                                        prefix=".tmp")
+        os.close(handle)
+        return path
+
+
+@instrumented("cached_analysis")
+def cached_analysis(filename, cache=None, band=DEFAULT_BAND,
+                    order=DEFAULT_ORDER, notch=None,
+                    detector=DEFAULT_DETECTOR, target_rate=None):
+    """Return the heart rate and trace of a file, analyzing it only once
+
+    This code looks the file up in the analysis cache and only runs
+    analyze and renders the trace when there is no valid entry for the
+    file contents and parameters.
+
+    :param filename: string containing file name
+    :param cache: AnalysisCache to use, or None for the default cache
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector
+    :param target_rate: float containing the lowest sampling rate in Hz to
+    decimate to, or None to keep every sample
+
+    :returns: dictionary containing the bpm, time_peaks, rr, hrv, duration,
+    extremes, out_of_range, signal stats and sampling of the file, its png
+    bytes in "png", their path in "image" and "provisional" set to False
+    """
+    if cache is None:
+        cache = AnalysisCache()
+    key = cache.key(filename, band=list(band), order=order, notch=notch,
+                    detector=detector, target_rate=target_rate)
+    entry = cache.get(key)
+    if entry is not None:
+        logging.info("Analysis cache hit for {}".format(filename))
+    else:
+        analysis = analyze(filename, band, order, notch, detector,
+                           target_rate)
+        entry = cache.put(key, analysis)
+    entry["provisional"] = False
+    return entry
+
+
+def progressive_analysis(filename, cache=None, seconds=20.0,
+                         band=DEFAULT_BAND, order=DEFAULT_ORDER, notch=None,
+                         detector=DEFAULT_DETECTOR, target_rate=None):
+    """Produce a quick heart rate estimate first and the exact result last
+
+    This generator first yields a provisional result from ecg_analysis
+    preview, which only reads the first seconds of the file, and then the
+    final result from cached_analysis. A file that is already cached, or
+    that is short enough for the preview to cover all of it, only yields
+    the final result. Every result has a "provisional" key saying which
+    one it is, and the last result is always final. Provisional results are
+    not stored in the cache and have None as their "image" path.
+
+    :param filename: string containing file name
+    :param cache: AnalysisCache to use, or None for the default cache
+    :param seconds: float containing the length of signal in s used for
+    the provisional result
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+    :param detector: string containing the name of the beat detector
+    :param target_rate: float containing the lowest sampling rate in Hz to
+    decimate to, or None to keep every sample
+
+    :returns: generator of dictionaries like those of cached_analysis
+    """
+    if cache is None:
+        cache = AnalysisCache()
+    key = cache.key(filename, band=list(band), order=order, notch=notch,
+                    detector=detector, target_rate=target_rate)
+    entry = cache.get(key)
+    if entry is None:
+        analysis = preview(filename, seconds, band, order, notch, detector,
+                           target_rate=target_rate)
+        if not analysis.provisional:
+            entry = cache.put(key, analysis)
+        else:
+            entry = analysis_entry(analysis)
+            entry["png"] = analysis.render()
+            entry["image"] = None
+            entry["provisional"] = True
+            yield entry
+            entry = cache.put(key, analyze(filename, band, order, notch,
+                                           detector, target_rate))
+    else:
+        logging.info("Analysis cache hit for {}".format(filename))
+    entry["provisional"] = False
+    yield entry
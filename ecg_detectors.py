@@ -0,0 +1,316 @@
+# ecg_detectors.py
+
+import collections
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from ecg_filters import design_bandpass
+
+# scipy.signal takes over a second to import, so it is imported inside the
+# functions that use it rather than when this module is loaded.
+
+
+def find_peaks_detector(voltage, sampling_rate=None):
+    """Find R-peaks with the fixed thresholds of ecg_analysis.show_peaks
+
+    This is the original beat detector: the scipy find_peaks function with
+    a minimum height of 35% of the maximum voltage and a minimum spacing of
+    100 data points. The sampling rate is not used.
+
+    :param voltage: list of floats containing all filtered voltage data
+    points
+    :param sampling_rate: float containing the sampling rate in Hz
+
+    :returns: array of ints containing the index of each peak
+    """
+    from scipy.signal import find_peaks
+    voltage = np.asarray(voltage, dtype=float)
+    peaks, _ = find_peaks(voltage, height=voltage.max() * 0.35, distance=100)
+    return peaks
+
+
+class PanTompkins:
+    """Pan-Tompkins QRS detector that processes a signal chunk by chunk
+
+    The filtered signal is narrowed to the 5-15 Hz band of the QRS complex
+    with a causal band-pass filter whose state is carried between chunks,
+    differentiated with the five-point derivative of Pan and Tompkins,
+    squared and smoothed with a moving-window integrator, all with
+    vectorized numpy operations on each chunk. Local maxima of the
+    integrated signal are the QRS candidates. They are compared one by one
+    with an adaptive threshold that sits a quarter of the way from the
+    running noise level to the running signal level. A candidate within the
+    refractory period of a detected QRS replaces it only if it is larger, a
+    candidate within the T-wave period whose steepest slope is less than
+    half that of the previous QRS is taken for a T-wave, and if no QRS is
+    found for searchback times the average RR interval the largest
+    candidate above half the threshold is taken instead, or the signal
+    level is halved if there is none. Each candidate can move the levels by
+    at most an eighth of the signal level, so a single large artifact only
+    raises the threshold a little. The R-peak is the input sample of
+    largest magnitude under the integration window of the detected
+    candidate, widened by 50 ms for the delay of the causal filter.
+
+    All times are given in seconds and converted to samples, so the
+    detector behaves the same at any sampling rate. The signal levels are
+    learned from the first learning seconds before any decision is made.
+    Only a few samples of history, the levels and the last eight RR
+    intervals are kept between chunks, so memory is constant and the work
+    grows linearly with the signal length. Splitting a signal into chunks
+    does not change the detected beats.
+
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param window: float containing the integration window in seconds
+    :param refractory: float containing the minimum time in seconds
+    between two beats
+    :param t_wave: float containing the time in seconds after a beat
+    within which a candidate may be a T-wave
+    :param learning: float containing the seconds used to learn the
+    initial signal and noise levels
+    :param searchback: float containing the multiple of the average RR
+    interval after which a missed beat is searched for
+    """
+    def __init__(self, sampling_rate, window=0.15, refractory=0.2,
+                 t_wave=0.36, learning=2.0, searchback=1.66):
+        self.sampling_rate = float(sampling_rate)
+        self.window = max(1, int(round(window * self.sampling_rate)))
+        self.refractory = int(round(refractory * self.sampling_rate))
+        self.t_wave = int(round(t_wave * self.sampling_rate))
+        self.learning = int(round(learning * self.sampling_rate))
+        self.searchback = searchback
+        self._sos = design_bandpass(self.sampling_rate, (5, 15), 2)
+        self._span = self.window + int(round(0.05 * self.sampling_rate)) + 4
+        self._zi = None
+        self._y = np.zeros(4)
+        self._x = np.zeros(self._span + 2)
+        self._slope = np.zeros(self.window + 2)
+        self._squared = np.zeros(self.window - 1)
+        self._mwi_tail = np.empty(0)
+        self._count = 0
+        self._learn_max = 0.0
+        self._learn_sum = 0.0
+        self._queue = []
+        self._signal = None
+        self._noise = None
+        self._rr = collections.deque(maxlen=8)
+        self._searchback_limit = None
+        self._lowered = 0
+        self._pending = None
+        self._last_beat = None
+        self._best_noise = None
+        self._beats = []
+
+    def process(self, chunk):
+        """Detect the QRS complexes completed within one chunk
+
+        :param chunk: list of floats containing the next filtered voltage
+        samples
+
+        :returns: array of ints containing the sample index of every
+        R-peak confirmed within the chunk
+        """
+        from scipy.signal import sosfilt, sosfilt_zi
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.size == 0:
+            return np.empty(0, dtype=int)
+        if self._zi is None:
+            self._zi = sosfilt_zi(self._sos) * chunk[0]
+        band, self._zi = sosfilt(self._sos, chunk, zi=self._zi)
+        y = np.concatenate((self._y, band))
+        slope = (2 * y[4:] + y[3:-1] - y[1:-3] - 2 * y[:-4]) \
+            * (self.sampling_rate / 8)
+        self._y = y[-4:]
+        squared = np.concatenate((self._squared, slope * slope))
+        slope = np.concatenate((self._slope, np.abs(slope)))
+        s_offset = self._count - self._slope.size
+        total = np.concatenate(([0.0], np.cumsum(squared)))
+        mwi = (total[self.window:] - total[:-self.window]) / self.window
+        self._squared = squared[squared.size - self.window + 1:]
+        self._learn(mwi)
+        x = np.concatenate((self._x, chunk))
+        x_offset = self._count - self._x.size
+        m = np.concatenate((self._mwi_tail, mwi))
+        m_offset = self._count - self._mwi_tail.size
+        middle = m[1:-1]
+        is_peak = (middle > m[:-2]) & (middle >= m[2:])
+        j = np.flatnonzero(is_peak) + 1
+        if j.size:
+            index = m_offset + j
+            spans = sliding_window_view(np.abs(x), self._span + 1)
+            r_index = index - self._span + \
+                spans[index - self._span - x_offset].argmax(axis=1)
+            windows = sliding_window_view(slope, self.window + 1)
+            steepest = windows[index - self.window - s_offset].max(axis=1)
+            self._queue.extend(zip(index.tolist(),
+                                   np.maximum(r_index, 0).tolist(),
+                                   m[j].tolist(), steepest.tolist()))
+        self._mwi_tail = m[-2:]
+        self._x = x[-(self._span + 2):]
+        self._slope = slope[-(self.window + 2):]
+        self._count += chunk.size
+        if self._signal is None and self._count >= self.learning:
+            self._start()
+        if self._signal is not None:
+            self._classify_queue()
+            if self._pending is not None and \
+                    self._count - 1 - self._pending[0] >= self.refractory:
+                self._commit()
+        return self._take()
+
+    def finish(self):
+        """Confirm the last beat at the end of the signal
+
+        :returns: array of ints containing the sample index of every
+        R-peak confirmed since the last call to process
+        """
+        if self._signal is None and self._count:
+            self._start()
+        self._classify_queue()
+        if self._pending is not None:
+            self._commit()
+        return self._take()
+
+    def _learn(self, mwi):
+        """Track the integrated signal during the learning period
+
+        :param mwi: array of floats containing the integrated chunk
+        """
+        learn = mwi[:max(self.learning - self._count, 0)]
+        if learn.size:
+            self._learn_max = max(self._learn_max, float(learn.max()))
+            self._learn_sum += float(learn.sum())
+
+    def _start(self):
+        """Set the initial signal and noise levels after learning"""
+        learned = min(self._count, self.learning) or 1
+        self._signal = self._learn_max / 3
+        self._noise = self._learn_sum / learned / 2
+
+    def _classify_queue(self):
+        """Compare every queued candidate with the adaptive threshold"""
+        for candidate in self._queue:
+            self._classify(*candidate)
+        self._queue = []
+
+    def _classify(self, index, r_index, value, steepest):
+        """Decide whether one candidate is a QRS complex or noise
+
+        :param index: int containing the sample index of the candidate
+        :param r_index: int containing the sample index of the R-peak
+        under the candidate
+        :param value: float containing the integrated signal at the
+        candidate
+        :param steepest: float containing the largest slope magnitude
+        under the integration window of the candidate
+        """
+        threshold = self._noise + 0.25 * (self._signal - self._noise)
+        last = self._pending or self._last_beat
+        limit = self._searchback_limit or self.learning
+        quiet = index - max(last[0] if last else 0, self._lowered)
+        if quiet > limit:
+            found = self._best_noise
+            if found is not None and found[2] > threshold / 2:
+                self._signal = 0.25 * min(found[2], 2 * self._signal) + \
+                    0.75 * self._signal
+                self._detected(found)
+            else:
+                self._signal /= 2
+                self._lowered = index
+        candidate = (index, r_index, value, steepest)
+        last = self._pending or self._last_beat
+        since = None if last is None else index - last[0]
+        t_wave = since is not None and \
+            self.refractory <= since < self.t_wave and \
+            steepest < last[3] / 2
+        if value > threshold and not t_wave:
+            if since is not None and since < self.refractory:
+                if self._pending is not None and value > self._pending[2]:
+                    self._pending = candidate
+                return
+            self._signal = 0.125 * min(value, 2 * self._signal) + \
+                0.875 * self._signal
+            self._detected(candidate)
+            return
+        self._noise = 0.125 * min(value, self._signal) + 0.875 * self._noise
+        if since is not None and since < self.refractory:
+            return
+        if self._best_noise is None or value > self._best_noise[2]:
+            self._best_noise = candidate
+
+    def _detected(self, candidate):
+        """Make a candidate the pending QRS complex
+
+        :param candidate: tuple containing the sample index, R-peak index,
+        integrated value and steepest slope of the candidate
+        """
+        if self._pending is not None:
+            self._commit()
+        self._pending = candidate
+        self._best_noise = None
+
+    def _commit(self):
+        """Record the pending QRS complex as a beat"""
+        if self._last_beat is not None:
+            self._rr.append(self._pending[0] - self._last_beat[0])
+            self._searchback_limit = \
+                self.searchback * sum(self._rr) / len(self._rr)
+        if self._last_beat is None or \
+                self._pending[1] > self._last_beat[1]:
+            self._beats.append(self._pending[1])
+        self._last_beat = self._pending
+        self._pending = None
+
+    def _take(self):
+        """Hand over the beats confirmed since the last call
+
+        :returns: array of ints containing the sample index of each R-peak
+        """
+        beats = np.array(self._beats, dtype=int)
+        self._beats = []
+        return beats
+
+
+def pan_tompkins(voltage, sampling_rate, block_size=65536):
+    """Find R-peaks in a whole strip with the Pan-Tompkins detector
+
+    The strip is fed to a PanTompkins detector in blocks, which keeps the
+    intermediate arrays small on long recordings and gives the same beats
+    as streaming the strip.
+
+    :param voltage: list of floats containing all filtered voltage data
+    points
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param block_size: int containing the samples processed at a time
+
+    :returns: array of ints containing the index of each peak
+    """
+    voltage = np.asarray(voltage, dtype=float)
+    detector = PanTompkins(sampling_rate)
+    beats = [detector.process(voltage[start:start + block_size])
+             for start in range(0, voltage.size, block_size)]
+    beats.append(detector.finish())
+    return np.concatenate(beats)
+
+
+# Whole-strip detectors take the filtered voltage and the sampling rate and
+# return the index of every peak. Streaming detectors are classes created
+# with the sampling rate whose process method takes the next chunk of
+# filtered voltage and returns the index of every newly confirmed peak.
+DETECTORS = {"find_peaks": find_peaks_detector,
+             "pan_tompkins": pan_tompkins}
+STREAMING_DETECTORS = {"pan_tompkins": PanTompkins}
+DEFAULT_DETECTOR = "find_peaks"
+
+
+def detect(voltage, sampling_rate=None, detector=DEFAULT_DETECTOR):
+    """Find R-peaks with a detector chosen by name
+
+    :param voltage: list of floats containing all filtered voltage data
+    points
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param detector: string containing a key of DETECTORS
+
+    :returns: array of ints containing the index of each peak
+    """
+    if detector not in DETECTORS:
+        raise ValueError("Unknown beat detector {}".format(detector))
+    return DETECTORS[detector](voltage, sampling_rate)
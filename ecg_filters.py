@@ -0,0 +1,213 @@
+# ecg_filters.py
+
+import functools
+import numpy as np
+
+# scipy.signal takes over a second to import, so it is imported inside the
+# functions that use it rather than when this module is loaded.
+
+DEFAULT_BAND = (1, 50)
+DEFAULT_ORDER = 3
+
+
+def _rate_key(sampling_rate):
+    """Round a sampling rate so that nearly equal rates share a design
+
+    Rates derived from len(voltage) / duration differ in the last digits
+    between files recorded at the same rate, so they are rounded before
+    being used as a cache key.
+
+    :param sampling_rate: float containing the sampling rate in Hz
+
+    :returns: float containing the rounded sampling rate
+    """
+    return round(float(sampling_rate), 6)
+
+
+@functools.lru_cache(maxsize=64)
+def _bandpass_sos(sampling_rate, band, order):
+    """Design and cache a band-pass filter for a rounded sampling rate"""
+    from scipy.signal import butter
+    sos = butter(order, band, "band", fs=sampling_rate, output="sos")
+    return sos
+
+
+@functools.lru_cache(maxsize=64)
+def _notch_sos(sampling_rate, frequency, quality):
+    """Design and cache a notch filter for a rounded sampling rate"""
+    from scipy.signal import iirnotch, tf2sos
+    b, a = iirnotch(frequency, quality, fs=sampling_rate)
+    sos = tf2sos(b, a)
+    return sos
+
+
+def design_bandpass(sampling_rate, band=DEFAULT_BAND, order=DEFAULT_ORDER):
+    """Design a Butterworth band-pass filter as second-order sections
+
+    Designs are cached by sampling rate, band and order, so filtering many
+    strips that share a sampling rate only designs the filter once. A copy
+    of the cached sections is returned so callers cannot change the cache.
+
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the filter order
+
+    :returns: array of floats containing the second-order sections
+    """
+    sos = _bandpass_sos(_rate_key(sampling_rate), tuple(band), int(order))
+    return sos.copy()
+
+
+def design_notch(sampling_rate, frequency=60, quality=30):
+    """Design a notch filter for mains hum as second-order sections
+
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param frequency: float containing the mains frequency in Hz
+    :param quality: float containing the quality factor of the notch
+
+    :returns: array of floats containing the second-order sections
+    """
+    sos = _notch_sos(_rate_key(sampling_rate), float(frequency),
+                     float(quality))
+    return sos.copy()
+
+
+def design(sampling_rate, band=DEFAULT_BAND, order=DEFAULT_ORDER,
+           notch=None):
+    """Combine the band-pass and the optional notch into one filter
+
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+
+    :returns: array of floats containing the second-order sections
+    """
+    sos = design_bandpass(sampling_rate, band, order)
+    if notch is not None:
+        sos = np.vstack((sos, design_notch(sampling_rate, notch)))
+    return sos
+
+
+def bandpass(voltage, sampling_rate, band=DEFAULT_BAND, order=DEFAULT_ORDER,
+             notch=None):
+    """Zero-phase band-pass filter a strip with a cached SOS design
+
+    The filter runs along the first axis, so a 2-D array with one column
+    per lead is filtered in a single call.
+
+    :param voltage: list of floats containing all voltage data points, or
+    an (n_samples, n_leads) array
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+
+    :returns: array of floats containing filtered voltage values
+    """
+    from scipy.signal import sosfiltfilt
+    sos = design(sampling_rate, band, order, notch)
+    return sosfiltfilt(sos, voltage, axis=0)
+
+
+def bandpass_many(strips, sampling_rate, band=DEFAULT_BAND,
+                  order=DEFAULT_ORDER, notch=None):
+    """Zero-phase band-pass filter several strips that share a rate
+
+    Strips of equal length are stacked and filtered in a single call; the
+    others are filtered one by one with the same design.
+
+    :param strips: list of lists of floats containing voltage data points
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param band: list of floats containing the low and high cutoff in Hz
+    :param order: int containing the band-pass filter order
+    :param notch: float containing the mains frequency to remove in Hz, or
+    None for no notch
+
+    :returns: list of arrays of floats containing filtered voltage values
+    """
+    from scipy.signal import sosfiltfilt
+    sos = design(sampling_rate, band, order, notch)
+    lengths = {len(strip) for strip in strips}
+    if len(lengths) == 1:
+        return list(sosfiltfilt(sos, np.vstack(strips), axis=-1))
+    return [sosfiltfilt(sos, strip) for strip in strips]
+
+
+def decimation_factor(sampling_rate, target_rate):
+    """Find the largest whole decimation factor that keeps a target rate
+
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param target_rate: float containing the lowest acceptable rate in Hz,
+    or None for no decimation
+
+    :returns: int containing the factor, 1 if the strip is not decimated
+    """
+    if not target_rate:
+        return 1
+    return max(1, int(sampling_rate // target_rate))
+
+
+def decimate(voltage, factor):
+    """Anti-alias filter and downsample a strip by a whole factor
+
+    This code uses the polyphase resampler scipy.signal.resample_poly,
+    whose Kaiser-window low-pass removes everything above the new Nyquist
+    frequency before keeping every factor-th sample. Only the kept samples
+    are ever computed. Sample i of the result lines up with sample
+    i * factor of the input, so the input times can be reused with a
+    stride. The filter runs along the first axis, so a 2-D array with one
+    column per lead is decimated in a single call.
+
+    :param voltage: list of floats containing all voltage data points, or
+    an (n_samples, n_leads) array
+    :param factor: int containing the decimation factor
+
+    :returns: array of floats containing ceil(n_samples / factor)
+    decimated voltage values
+    """
+    from scipy.signal import resample_poly
+    voltage = np.asarray(voltage, dtype=float)
+    if factor == 1:
+        return voltage
+    return resample_poly(voltage, 1, factor, axis=0)
+
+
+def refine_peaks(voltage, peaks):
+    """Estimate the position of each peak between samples
+
+    A parabola is fitted through every peak sample and its two neighbours,
+    and the position of its vertex is returned, which recovers most of the
+    timing resolution lost by decimation.
+
+    :param voltage: array of floats containing the filtered voltage
+    :param peaks: array of ints containing the index of each peak
+
+    :returns: array of floats containing the fractional index of each peak
+    """
+    voltage = np.asarray(voltage, dtype=float)
+    peaks = np.asarray(peaks, dtype=int)
+    inner = (peaks > 0) & (peaks < voltage.size - 1)
+    index = peaks[inner]
+    left = voltage[index - 1]
+    middle = voltage[index]
+    right = voltage[index + 1]
+    curvature = left - 2 * middle + right
+    offset = np.zeros(index.size)
+    np.divide(0.5 * (left - right), curvature, out=offset,
+              where=curvature != 0)
+    refined = peaks.astype(float)
+    refined[inner] += np.clip(offset, -0.5, 0.5)
+    return refined
+
+
+def cache_info():
+    """Report how often the cached designs were reused
+
+    :returns: dictionary containing the functools cache statistics of the
+    band-pass and notch designs
+    """
+    return {"bandpass": _bandpass_sos.cache_info(),
+            "notch": _notch_sos.cache_info()}
@@ -0,0 +1,235 @@
+# ecg_instrument.py
+
+import functools
+import json
+import logging
+import os
+import threading
+import time as timer
+import tracemalloc
+
+# Set the ECG_INSTRUMENT environment variable to "log" to log every stage,
+# or to a file name to also append every stage to it as a JSON line.
+ENVIRONMENT_VARIABLE = "ECG_INSTRUMENT"
+
+_enabled = False
+_log = True
+_sink = None
+_memory = False
+_started_tracing = False
+# Stages open in each thread, innermost last
+_local = threading.local()
+_stats = {}
+# tracemalloc.reset_peak is new in Python 3.9; older versions record the
+# bytes still allocated at the end of a stage instead of the peak
+_PEAKS = hasattr(tracemalloc, "reset_peak")
+
+
+def enable(sink=None, log=True, memory=False):
+    """Start recording the pipeline stages
+
+    :param sink: string containing the name of a file that every stage is
+    appended to as a JSON line, or None for no file
+    :param log: bool that is True to log every stage at info level
+    :param memory: bool that is True to trace the bytes allocated by every
+    stage with tracemalloc, which slows the stages down
+    """
+    global _enabled, _log, _sink, _memory, _started_tracing
+    _log = log
+    _sink = sink
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+    _memory = memory
+    _enabled = True
+
+
+def disable():
+    """Stop recording the pipeline stages
+
+    The aggregate statistics are kept until reset is called.
+    """
+    global _enabled, _memory, _started_tracing
+    if _started_tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _started_tracing = False
+    _memory = False
+    _enabled = False
+
+
+def enabled():
+    """Check whether the pipeline stages are being recorded
+
+    :returns: bool that is True while recording
+    """
+    return _enabled
+
+
+def reset():
+    """Forget the aggregate statistics of every stage"""
+    _stats.clear()
+
+
+def stage_stats():
+    """Summarize every stage recorded since the last reset
+
+    :returns: dictionary keyed by stage name of dictionaries containing the
+    number of "calls", the "total_seconds", "mean_seconds" and
+    "max_seconds", the total "samples", the "samples_per_second" and the
+    "peak_bytes" allocated by a single call, which is None if memory was not
+    traced
+    """
+    summary = {}
+    for name, stats in _stats.items():
+        summary[name] = dict(stats)
+        summary[name]["mean_seconds"] = stats["total_seconds"] / \
+            stats["calls"]
+        summary[name]["samples_per_second"] = \
+            stats["samples"] / stats["total_seconds"] \
+            if stats["total_seconds"] else None
+    return summary
+
+
+class _NullStage:
+    """Stage returned while recording is disabled, which does nothing"""
+    samples = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """Context manager that records one run of a pipeline stage
+
+    :ivar name: string containing the stage name
+    :ivar samples: int containing the number of samples handled, which may
+    be set inside the with block
+    """
+    def __init__(self, name, samples=None):
+        self.name = name
+        self.samples = samples
+
+    def __enter__(self):
+        if _memory:
+            self._start_bytes = tracemalloc.get_traced_memory()[0]
+            self._child_peak = 0
+            if _PEAKS:
+                tracemalloc.reset_peak()
+        self._stack = _local.__dict__.setdefault("stack", [])
+        self._stack.append(self)
+        self._start = timer.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = timer.perf_counter() - self._start
+        self._stack.pop()
+        allocated = None
+        if _memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if _PEAKS:
+                # Resetting the peak hides it from the enclosing stage, so
+                # it is handed on explicitly
+                peak = max(peak, self._child_peak)
+                allocated = peak - self._start_bytes
+                if self._stack:
+                    outer = self._stack[-1]
+                    outer._child_peak = max(outer._child_peak, peak)
+            else:
+                allocated = current - self._start_bytes
+        _record(self.name, seconds, self.samples, allocated)
+        return False
+
+
+def stage(name, samples=None):
+    """Time a block of code as one run of a pipeline stage
+
+    Used as "with stage("plot", len(time)):". While recording is disabled
+    a shared object that does nothing is returned, so the cost is a single
+    function call.
+
+    :param name: string containing the stage name
+    :param samples: int containing the number of samples handled, which
+    can also be set later through the samples attribute
+
+    :returns: context manager that records the stage
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, samples)
+
+
+def instrumented(name, samples=None):
+    """Decorate a function so that every call is recorded as a stage
+
+    While recording is disabled the wrapper calls the function straight
+    away after checking one flag.
+
+    :param name: string containing the stage name
+    :param samples: function of the result and the positional arguments
+    of a call returning the number of samples handled, or None
+
+    :returns: function decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name) as record:
+                result = func(*args, **kwargs)
+                if samples is not None:
+                    record.samples = samples(result, args)
+            return result
+        return wrapper
+    return decorator
+
+
+def _record(name, seconds, samples, allocated):
+    """Add one run of a stage to the statistics and the sinks
+
+    :param name: string containing the stage name
+    :param seconds: float containing the wall time of the run
+    :param samples: int containing the number of samples, or None
+    :param allocated: int containing the peak bytes allocated, or None
+    """
+    stats = _stats.setdefault(name, {"calls": 0, "total_seconds": 0.0,
+                                     "max_seconds": 0.0, "samples": 0,
+                                     "peak_bytes": None})
+    stats["calls"] += 1
+    stats["total_seconds"] += seconds
+    stats["max_seconds"] = max(stats["max_seconds"], seconds)
+    stats["samples"] += samples or 0
+    if allocated is not None:
+        stats["peak_bytes"] = max(stats["peak_bytes"] or 0, allocated)
+    if _log:
+        logging.info("Stage {} took {:.3f} ms for {} samples{}".format(
+            name, seconds * 1000, samples,
+            "" if allocated is None else
+            " and allocated {:.1f} MB".format(allocated / 2 ** 20)))
+    if _sink is not None:
+        with open(_sink, "a") as f:
+            f.write(json.dumps({"stage": name, "seconds": seconds,
+                                "samples": samples, "bytes": allocated,
+                                "timestamp": timer.time(),
+                                "pid": os.getpid()}) + "\n")
+
+
+def enable_from_environment():
+    """Enable recording if the ECG_INSTRUMENT variable is set
+
+    :returns: bool that is True if recording was enabled
+    """
+    setting = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not setting:
+        return False
+    enable(sink=None if setting == "log" else setting)
+    return True
+
+
+enable_from_environment()
@@ -0,0 +1,208 @@
+# ecg_preprocess.py
+
+import logging
+import numpy as np
+
+
+def effective_rate(time, gap_factor=1.5, iterations=10):
+    """Estimate the sampling rate of a strip from its total duration
+
+    The sampling period is the total duration divided by the number of
+    sampling periods it spans, counting the samples missing in every time
+    step that _gap_steps finds. Rounding of the printed times
+    only affects the first and last time, unlike a median of the time
+    steps, and gaps do not lengthen the period. The count of missing
+    samples depends on the period, so the estimate is refined a few
+    times.
+
+    :param time: array of floats containing increasing time data points
+    :param gap_factor: float containing the multiple of the sampling
+    period above which a time step is a gap
+    :param iterations: int containing the largest number of refinements
+
+    :returns: float containing the sampling rate in Hz
+    """
+    steps = np.diff(time)
+    if steps.size == 0:
+        raise ValueError("At least two samples are needed to find the "
+                         "sampling rate")
+    span = time[-1] - time[0]
+    period = span / steps.size
+    for _ in range(iterations):
+        long_steps = steps[_gap_steps(steps, period, gap_factor)]
+        missing = np.sum(np.rint(long_steps / period)) - long_steps.size
+        refined = span / (steps.size + missing)
+        if refined == period:
+            break
+        period = refined
+    return 1 / float(period)
+
+
+def _gap_steps(steps, period, gap_factor):
+    """Find the time steps that skip at least one sample
+
+    A step longer than gap_factor periods is only a gap if it is also long
+    together with each of its neighbours, since jitter makes a long step
+    follow or precede a short one.
+
+    :param steps: array of floats containing the time steps in s
+    :param period: float containing the sampling period in s
+    :param gap_factor: float containing the multiple of the sampling
+    period above which a time step is a gap
+
+    :returns: array of ints containing the index of every gap step
+    """
+    index = np.flatnonzero(steps > gap_factor * period)
+    limit = (1 + gap_factor) * period
+    before = steps[np.maximum(index - 1, 0)]
+    before[index == 0] = np.inf
+    after = steps[np.minimum(index + 1, steps.size - 1)]
+    after[index == steps.size - 1] = np.inf
+    wide = (steps[index] + before > limit) & (steps[index] + after > limit)
+    return index[wide]
+
+
+def resample(time, voltage, grid):
+    """Linearly interpolate samples onto new time points
+
+    The position of every new time point is found with a single
+    searchsorted call, so one or many leads are interpolated with a few
+    whole-array operations.
+
+    :param time: array of floats containing increasing time data points
+    :param voltage: array of floats containing the voltage data points, or
+    an (n_samples, n_leads) array
+    :param grid: array of floats containing the new time points, within
+    the range of time
+
+    :returns: array of floats containing the voltage at each new time
+    point, with one column per lead for 2-D input
+    """
+    right = np.clip(np.searchsorted(time, grid), 1, time.size - 1)
+    left = right - 1
+    weight = (grid - time[left]) / (time[right] - time[left])
+    if voltage.ndim == 2:
+        weight = weight[:, np.newaxis]
+    return voltage[left] + weight * (voltage[right] - voltage[left])
+
+
+def uniform(time, voltage, max_gap=0.5, tolerance=0.25, gap_factor=1.5):
+    """Put a strip on a uniform time grid, filling or splitting at gaps
+
+    This code estimates the sampling rate with effective_rate and gives
+    every sample the nearest slot of a grid of exactly one sampling
+    period, after removing the average offset of the samples from the grid
+    so that truncated times are not rounded into the wrong slot. A strip
+    that fills every slot once is returned unchanged, so times that are
+    only rounded when printed are left alone. Slots left
+    empty by gaps of up to max_gap seconds, such as the rows dropped by
+    ecg_analysis.read, are filled by linear interpolation between their
+    neighbours, while longer gaps split the strip into segments that each
+    get their own grid, so no signal is made up over a long gap. If a
+    sample lies further than tolerance from its slot, or two samples fall
+    into the same slot, the timing is irregular and the strip is instead
+    resampled onto the grid by interpolating in time. Samples whose time
+    does not increase are dropped first. The ecg_binary.TimeAxis of a
+    container without missing slots is already on its grid and is returned
+    as it is, without computing its times. Every step is vectorized, so a
+    recording of millions of samples takes a fraction of a second.
+
+    :param time: array of floats containing all time data points
+    :param voltage: array of floats containing all voltage data points, or
+    an (n_samples, n_leads) array
+    :param max_gap: float containing the longest gap in seconds that is
+    filled by interpolation
+    :param tolerance: float containing the largest distance of a sample
+    from its slot, as a fraction of the sampling period, that is treated
+    as rounding of the printed time
+    :param gap_factor: float containing the multiple of the sampling
+    period above which a time step is a gap
+
+    :returns: array of floats containing the uniform time data points
+    :returns: array of floats containing the uniform voltage data points
+    :returns: dictionary containing the effective sampling "rate", whether
+    the strip was "resampled" in time, the "gaps" as [start, end, filled]
+    lists in s, the [start, end) sample index of each of the "segments"
+    and the "duration" in s covered by the segments
+    """
+    voltage = np.asarray(voltage, dtype=float)
+    if getattr(time, "slots", False) is None and len(time) > 1:
+        # The times of a container that fills every slot of its grid are
+        # left to be computed when they are used
+        return time, voltage, {"rate": time.sampling_rate,
+                               "resampled": False, "gaps": [],
+                               "segments": [[0, len(time)]],
+                               "duration": (len(time) - 1) /
+                               time.sampling_rate}
+    time = np.asarray(time, dtype=float)
+    steps = np.diff(time)
+    if not (steps > 0).all():
+        increasing = np.empty(time.size, dtype=bool)
+        increasing[:1] = True
+        increasing[1:] = time[1:] > np.maximum.accumulate(time)[:-1]
+        logging.warning("Dropped {} samples with out-of-order time".format(
+            time.size - np.count_nonzero(increasing)))
+        time = time[increasing]
+        voltage = voltage[increasing]
+        steps = np.diff(time)
+    rate = effective_rate(time, gap_factor)
+    period = 1 / rate
+    splits = np.flatnonzero(steps > max_gap) + 1
+    first = np.concatenate(([0], splits))
+    counts = np.diff(np.concatenate((first, [time.size])))
+    position = (time - np.repeat(time[first], counts)) / period
+    sample = position[::max(1, position.size // 65536)]
+    offset = np.angle(np.mean(np.exp(2j * np.pi * sample))) / (2 * np.pi)
+    shifted = position - offset
+    slot = np.rint(shifted)
+    jitter = np.abs(shifted - slot).max()
+    slot = slot.astype(np.int64)
+    slot -= np.repeat(slot[first], counts)
+    slot_steps = np.diff(slot)
+    slot_steps[splits - 1] = 1
+    resampled = bool(jitter > tolerance or (slot_steps < 1).any())
+    if resampled:
+        skipped = _gap_steps(steps, period, gap_factor)
+    else:
+        skipped = np.flatnonzero(slot_steps > 1)
+    gaps = np.union1d(skipped, splits - 1)
+    sampling = {"rate": rate,
+                "resampled": resampled,
+                "gaps": [[float(time[i]), float(time[i + 1]),
+                          bool(steps[i] <= max_gap)] for i in gaps]}
+    for start, end, filled in sampling["gaps"]:
+        if filled:
+            logging.info("Filled gap in data from {:.3f} s to {:.3f} s"
+                         .format(start, end))
+        else:
+            logging.warning("Split at gap in data from {:.3f} s to {:.3f} s"
+                            .format(start, end))
+    if not gaps.size and not sampling["resampled"]:
+        sampling["segments"] = [[0, int(time.size)]]
+        sampling["duration"] = float(time[-1] - time[0])
+        return time, voltage, sampling
+    last = np.concatenate((splits, [time.size])) - 1
+    if sampling["resampled"]:
+        logging.info("Resampled irregular time steps to {:.3f} Hz".format(
+            rate))
+        lengths = np.floor((time[last] - time[first]) * rate).astype(int) + 1
+    else:
+        lengths = slot[last] + 1
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    grid = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+    grid_time = np.repeat(time[first], lengths) + grid * period
+    if sampling["resampled"]:
+        voltage = resample(time, voltage, grid_time)
+    else:
+        index = slot + np.repeat(offsets[:-1], counts)
+        filled = np.empty((offsets[-1],) + voltage.shape[1:])
+        filled[index] = voltage
+        empty = np.ones(offsets[-1], dtype=bool)
+        empty[index] = False
+        empty = np.flatnonzero(empty)
+        filled[empty] = resample(index.astype(float), voltage, empty)
+        voltage = filled
+    sampling["segments"] = np.column_stack((offsets[:-1],
+                                            offsets[1:])).tolist()
+    sampling["duration"] = float(np.sum(lengths - 1) * period)
+    return grid_time, voltage, sampling
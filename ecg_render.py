@@ -0,0 +1,143 @@
+# ecg_render.py
+
+import io
+import threading
+import numpy as np
+
+# matplotlib takes most of a second to import, so it is imported when the
+# first figure is created rather than when this module is loaded. Pillow is
+# imported when the first image is made for the same reason.
+
+_figures = {}
+_lock = threading.Lock()
+
+
+def minmax_decimate(time, voltage, buckets):
+    """Reduce a trace to the minimum and maximum of each pixel column
+
+    This code splits the samples into equal buckets, one per horizontal
+    pixel, and keeps only the smallest and largest voltage of each bucket.
+    Plotting these pairs draws the same picture as plotting every sample
+    because each pixel column shows the full range of its samples anyway.
+
+    :param time: list of floats containing all time data points
+    :param voltage: list of floats containing all voltage data points
+    :param buckets: int containing the number of buckets, usually the plot
+    width in pixels
+
+    :returns: array of floats containing the time of each kept point
+    :returns: array of floats containing the voltage of each kept point
+    """
+    time = np.asarray(time, dtype=float)
+    voltage = np.asarray(voltage, dtype=float)
+    if voltage.size <= 2 * buckets:
+        return time, voltage
+    edges = np.linspace(0, voltage.size, buckets + 1).astype(int)[:-1]
+    lows = np.minimum.reduceat(voltage, edges)
+    highs = np.maximum.reduceat(voltage, edges)
+    times = np.repeat(time[edges], 2)
+    values = np.column_stack((lows, highs)).ravel()
+    return times, values
+
+
+def _reduce_peaks(time, voltage, peaks, buckets):
+    """Keep at most one peak marker per pixel column
+
+    :param time: array of floats containing all time data points
+    :param voltage: array of floats containing all voltage data points
+    :param peaks: list of ints containing the index of each peak
+    :param buckets: int containing the plot width in pixels
+
+    :returns: array of floats containing the time of each marker
+    :returns: array of floats containing the voltage of each marker
+    """
+    peaks = np.asarray(peaks, dtype=int)
+    if peaks.size > buckets:
+        column = (peaks * buckets) // max(len(voltage), 1)
+        keep = np.flatnonzero(np.diff(column, prepend=-1))
+        peaks = peaks[keep]
+    return time[peaks], voltage[peaks]
+
+
+def _figure(width, height, dpi):
+    """Get the reusable figure for one image size, creating it once
+
+    :param width: int containing the image width in pixels
+    :param height: int containing the image height in pixels
+    :param dpi: int containing the image resolution in dots per inch
+
+    :returns: tuple containing the figure, axes, trace line and peak
+    marker line
+    """
+    key = (width, height, dpi)
+    if key not in _figures:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        axes.set_xlabel("Time (s)")
+        axes.set_ylabel("Voltage (mV)")
+        trace, = axes.plot([], [], linewidth=0.8)
+        markers, = axes.plot([], [], "rx", markersize=5)
+        _figures[key] = (figure, axes, trace, markers)
+    return _figures[key]
+
+
+def render_image(time, voltage, peaks=None, width=640, height=480, dpi=100):
+    """Render an ECG trace to a PIL image
+
+    The trace is drawn with the Agg backend on a figure that is created
+    once per image size and reused, so nothing is left open between calls
+    and no window system is needed. The samples are reduced with
+    minmax_decimate to two points per pixel column before drawing, so the
+    drawing time does not grow with the length of the recording.
+
+    :param time: list of floats containing all time data points
+    :param voltage: list of floats containing all voltage data points
+    :param peaks: list of ints containing the index of each peak to mark,
+    or None for no markers
+    :param width: int containing the image width in pixels
+    :param height: int containing the image height in pixels
+    :param dpi: int containing the image resolution in dots per inch
+
+    :returns: PIL.Image.Image containing the rendered RGB trace
+    """
+    from PIL import Image
+    time = np.asarray(time, dtype=float)
+    voltage = np.asarray(voltage, dtype=float)
+    with _lock:
+        figure, axes, trace, markers = _figure(width, height, dpi)
+        trace.set_data(*minmax_decimate(time, voltage, width))
+        if peaks is None:
+            markers.set_data([], [])
+        else:
+            markers.set_data(*_reduce_peaks(time, voltage, peaks, width))
+        axes.relim()
+        axes.autoscale_view()
+        figure.canvas.draw()
+        rgba = np.asarray(figure.canvas.buffer_rgba())
+        image = Image.fromarray(rgba[:, :, :3].copy())
+    return image
+
+
+def render_trace(time, voltage, peaks=None, width=640, height=480, dpi=100,
+                 format="png"):
+    """Render an ECG trace to encoded image bytes
+
+    :param time: list of floats containing all time data points
+    :param voltage: list of floats containing all voltage data points
+    :param peaks: list of ints containing the index of each peak to mark,
+    or None for no markers
+    :param width: int containing the image width in pixels
+    :param height: int containing the image height in pixels
+    :param dpi: int containing the image resolution in dots per inch
+    :param format: string containing "png", "jpeg" or "jpg"
+
+    :returns: bytes containing the encoded image
+    """
+    image = render_image(time, voltage, peaks, width, height, dpi)
+    buffer = io.BytesIO()
+    format = format.upper()
+    image.save(buffer, format="JPEG" if format == "JPG" else format)
+    return buffer.getvalue()
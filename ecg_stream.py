@@ -0,0 +1,237 @@
+# ecg_stream.py
+
+import collections
+import logging
+import numpy as np
+from ecg_detectors import STREAMING_DETECTORS
+from ecg_filters import design_bandpass
+
+# scipy.signal takes over a second to import, so it is imported inside the
+# functions that use it rather than when this module is loaded.
+
+
+class StreamingHeartRate:
+    """Real-time heart rate engine for a live ECG feed
+
+    This class filters an ECG signal chunk by chunk with a causal band-pass
+    filter whose state is carried from one chunk to the next, detects
+    R-peaks online and reports a rolling heart rate at a fixed interval of
+    signal time. Only the filter state, the last two samples, the pending peak
+    and a bounded queue of recent beat times are kept between chunks, so
+    memory stays constant and the work per chunk only depends on the chunk
+    length.
+
+    A sample is a peak candidate when it is a local maximum above 35% of a
+    slowly decaying estimate of the R-wave amplitude, matching the height
+    rule of ecg_analysis.show_peaks. Candidates closer than the refractory
+    period to the previous peak replace it only if they are taller, and a
+    peak is committed once the refractory period has passed without a
+    taller candidate. Any streaming detector registered in
+    ecg_detectors.STREAMING_DETECTORS, such as "pan_tompkins", can be used
+    instead by name.
+
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param band: list of floats containing the band-pass edges in Hz
+    :param order: int containing the Butterworth filter order
+    :param refractory: float containing the minimum time in seconds
+    between two beats
+    :param window: float containing the length in seconds of the rolling
+    heart rate window
+    :param report_interval: float containing the time in seconds of signal
+    between two heart rate reports
+    :param decay: float containing the fraction of the amplitude estimate
+    kept after one second without a taller sample
+    :param detector: string containing the name of a streaming detector,
+    or None for the built-in peak rule
+    """
+    def __init__(self, sampling_rate, band=(1, 50), order=3,
+                 refractory=0.3, window=10.0, report_interval=1.0,
+                 decay=0.95, detector=None):
+        self.sampling_rate = float(sampling_rate)
+        self.refractory = int(round(refractory * self.sampling_rate))
+        self.window = window
+        self.report_interval = report_interval
+        self._sos = design_bandpass(self.sampling_rate, band, order)
+        self._zi = None
+        self._decay = decay ** (1 / self.sampling_rate)
+        self._amplitude = 0.0
+        self._amplitude_index = 0
+        self._tail = np.empty(0)
+        self._pending = None
+        self._last_peak = None
+        self._detector = None
+        if detector is not None:
+            if detector not in STREAMING_DETECTORS:
+                raise ValueError("Unknown streaming detector {}".format(
+                    detector))
+            self._detector = STREAMING_DETECTORS[detector](
+                self.sampling_rate)
+        max_beats = int(window * 300 / 60) + 2
+        self.beats = collections.deque(maxlen=max_beats)
+        self._count = 0
+        self._next_report = report_interval
+
+    def process(self, chunk):
+        """Filter one chunk of samples and detect the beats inside it
+
+        :param chunk: list of floats containing the next voltage samples
+
+        :returns: list of tuples containing the signal time in seconds and
+        rolling heart rate in bpm of every report due within the chunk
+        """
+        from scipy.signal import sosfilt, sosfilt_zi
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.size == 0:
+            return []
+        if self._zi is None:
+            self._zi = sosfilt_zi(self._sos) * chunk[0]
+        filtered, self._zi = sosfilt(self._sos, chunk, zi=self._zi)
+        start = self._count
+        if self._detector is None:
+            self._find_peaks(filtered, start)
+        else:
+            for index in self._detector.process(filtered):
+                self.beats.append(index / self.sampling_rate)
+        self._count += filtered.size
+        return self._reports()
+
+    def stream(self, chunks):
+        """Run the engine over an iterable of chunks
+
+        :param chunks: iterable of lists of floats containing voltage
+        samples, such as a generator or read_socket
+
+        :returns: generator of tuples containing the signal time in seconds
+        and the rolling heart rate in bpm
+        """
+        for chunk in chunks:
+            for report in self.process(chunk):
+                yield report
+
+    def bpm(self):
+        """Calculate the heart rate over the beats in the rolling window
+
+        :returns: float containing the rolling heart rate in bpm, or None if
+        fewer than two beats have been seen within the window
+        """
+        now = self._count / self.sampling_rate
+        recent = [t for t in self.beats if now - t <= self.window]
+        if len(recent) < 2 or recent[-1] == recent[0]:
+            return None
+        return 60 * (len(recent) - 1) / (recent[-1] - recent[0])
+
+    def _find_peaks(self, filtered, start):
+        """Detect local maxima above threshold and apply the refractory rule
+
+        Local maxima that are below the lowest threshold possible within
+        the chunk are discarded in one vectorized step. The rest are
+        compared one by one with the threshold and the pending peak.
+
+        :param filtered: array of floats containing the filtered chunk
+        :param start: int containing the sample index of the chunk start
+        """
+        x = np.concatenate((self._tail, filtered))
+        offset = start - self._tail.size
+        self._tail = x[-2:]
+        end = offset + x.size - 1
+        middle = x[1:-1]
+        is_peak = (middle > x[:-2]) & (middle >= x[2:]) & \
+                  (middle > 0.35 * self._amplitude_at(end))
+        for i in np.flatnonzero(is_peak) + 1:
+            self._offer(offset + int(i), x[i])
+        if self._pending is not None and \
+                end - self._pending[0] >= self.refractory:
+            self._commit()
+
+    def _amplitude_at(self, index):
+        """Decay the R-wave amplitude estimate up to a sample index
+
+        :param index: int containing the sample index
+
+        :returns: float containing the decayed amplitude estimate
+        """
+        elapsed = index - self._amplitude_index
+        return self._amplitude * self._decay ** elapsed
+
+    def _offer(self, index, value):
+        """Compare a peak candidate with the threshold and the pending peak
+
+        :param index: int containing the sample index of the candidate
+        :param value: float containing the filtered voltage of the candidate
+        """
+        amplitude = self._amplitude_at(index)
+        if value <= 0.35 * amplitude:
+            return
+        if value > amplitude:
+            self._amplitude = value
+            self._amplitude_index = index
+        if self._pending is not None:
+            if index - self._pending[0] < self.refractory:
+                if value > self._pending[1]:
+                    self._pending = (index, value)
+                return
+            self._commit()
+        if self._last_peak is not None and \
+                index - self._last_peak < self.refractory:
+            return
+        self._pending = (index, value)
+
+    def _commit(self):
+        """Record the pending peak as a beat"""
+        index = self._pending[0]
+        self.beats.append(index / self.sampling_rate)
+        self._last_peak = index
+        self._pending = None
+
+    def _reports(self):
+        """Collect the heart rate reports that fell due
+
+        :returns: list of tuples containing the signal time in seconds and
+        the rolling heart rate in bpm
+        """
+        reports = []
+        now = self._count / self.sampling_rate
+        while now >= self._next_report:
+            bpm = self.bpm()
+            if bpm is not None:
+                reports.append((self._next_report, bpm))
+                logging.debug("Rolling heart rate {:.1f} bpm at {:.2f} s"
+                              .format(bpm, self._next_report))
+            self._next_report += self.report_interval
+        return reports
+
+
+def read_socket(sock, chunk_size=256):
+    """Yield chunks of voltage samples received from a socket
+
+    The sender is expected to write little-endian float32 voltages. Bytes
+    that do not yet make up a whole sample are kept for the next receive.
+
+    :param sock: socket.socket connected to the ECG feed
+    :param chunk_size: int containing the number of samples per receive
+
+    :returns: generator of arrays of floats containing voltage samples
+    """
+    leftover = b""
+    while True:
+        data = sock.recv(chunk_size * 4)
+        if not data:
+            return
+        data = leftover + data
+        usable = len(data) - len(data) % 4
+        leftover = data[usable:]
+        if usable:
+            yield np.frombuffer(data[:usable], dtype="<f4")
+
+
+def chunk_array(voltage, chunk_size=256):
+    """Split a recorded strip into chunks to replay it as a live feed
+
+    :param voltage: list of floats containing all voltage data points
+    :param chunk_size: int containing the number of samples per chunk
+
+    :returns: generator of arrays of floats containing voltage samples
+    """
+    voltage = np.asarray(voltage, dtype=float)
+    for start in range(0, voltage.size, chunk_size):
+        yield voltage[start:start + chunk_size]
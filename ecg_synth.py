@@ -0,0 +1,426 @@
+# ecg_synth.py
+
+import argparse
+import io
+import logging
+import math
+import numpy as np
+import ecg_binary
+
+# Waves of one heartbeat as (offset from the R peak in s, amplitude in mV,
+# width in s). The P and T offsets grow with the square root of the RR
+# interval, like the QT interval does.
+WAVES = {"P": (-0.2, 0.12, 0.025),
+         "Q": (-0.03, -0.12, 0.008),
+         "R": (0.0, 1.2, 0.01),
+         "S": (0.03, -0.25, 0.01),
+         "T": (0.28, 0.3, 0.05)}
+# Part of a heartbeat around its R peak, in s, outside which the waves are
+# negligible
+BEAT_WINDOW = (-0.4, 0.6)
+# Angles of the limb leads II, I, III, aVR, aVL and aVF in degrees, in the
+# order the generated leads use them
+LEAD_ANGLES = (60, 0, 120, -150, -30, 90)
+# Electrical axis of the heart in degrees
+HEART_AXIS = 45
+# Decay time of an artifact in s
+ARTIFACT_DECAY = 0.5
+# Correlation of successive RR intervals
+RR_CORRELATION = 0.9
+# Number of beats or artifacts drawn at a time
+BATCH = 256
+
+
+class _Events:
+    """Times of random events, drawn a batch at a time as they are needed
+
+    Only the events that can still affect samples not yet generated are
+    kept, so the memory does not grow with the length of the recording.
+
+    :param draw: function returning an array of the intervals between the
+    next events and an array of a value of each event
+    :param start: float containing the time that the first interval is
+    counted from
+    """
+    def __init__(self, draw, start):
+        self._draw = draw
+        self._end = start
+        self.times = np.empty(0)
+        self.values = np.empty(0)
+
+    def until(self, end):
+        """Draw events until one of them falls after end"""
+        while self._end <= end:
+            intervals, values = self._draw()
+            times = self._end + np.cumsum(intervals)
+            self._end = times[-1]
+            self.times = np.concatenate((self.times, times))
+            self.values = np.concatenate((self.values, values))
+
+    def between(self, start, end):
+        """Find the events in [start, end) and forget the earlier ones
+
+        :returns: array of floats containing the event times
+        :returns: array of floats containing the event values
+        """
+        self.until(end)
+        first, last = np.searchsorted(self.times, (start, end))
+        self.times = self.times[first:]
+        self.values = self.values[first:]
+        return self.times[:last - first], self.values[:last - first]
+
+
+class SyntheticECG:
+    """Generator of realistic synthetic ECG recordings of any length
+
+    Every heartbeat is a sum of Gaussian P, Q, R, S and T waves centred on
+    a known R peak time. The RR intervals vary around 60 / bpm as a
+    correlated random process, and baseline wander, mains interference,
+    white noise, motion artifacts, rows with a missing field and dropped
+    rows can be added. The recording is generated a chunk at a time with
+    whole-array operations, so its length only costs time. Every kind of
+    randomness has its own random stream, so the recording does not depend
+    on the chunk length.
+
+    :param sampling_rate: float containing the sampling rate in Hz
+    :param bpm: float containing the mean heart rate
+    :param hrv: float containing the standard deviation of the RR
+    intervals as a fraction of their mean
+    :param num_leads: int containing the number of leads
+    :param wander: float containing the amplitude of the baseline wander
+    in mV
+    :param mains: float containing the amplitude of the mains
+    interference in mV
+    :param mains_frequency: float containing the mains frequency in Hz
+    :param noise: float containing the standard deviation of the white
+    noise in mV
+    :param artifact_rate: float containing the mean number of motion
+    artifacts per minute
+    :param bad_rate: float containing the fraction of rows with a missing
+    time or voltage
+    :param missing_rate: float containing the fraction of rows that are
+    left out
+    :param seed: int containing the seed of the random streams
+    """
+    def __init__(self, sampling_rate=250, bpm=72, hrv=0.05, num_leads=1,
+                 wander=0.2, mains=0.0, mains_frequency=60, noise=0.03,
+                 artifact_rate=0.0, bad_rate=0.0, missing_rate=0.0, seed=0):
+        self.sampling_rate = float(sampling_rate)
+        self.bpm = float(bpm)
+        self.hrv = float(hrv)
+        self.num_leads = int(num_leads)
+        self.wander = float(wander)
+        self.mains = float(mains)
+        self.mains_frequency = float(mains_frequency)
+        self.noise = float(noise)
+        self.artifact_rate = float(artifact_rate)
+        self.bad_rate = float(bad_rate)
+        self.missing_rate = float(missing_rate)
+        self.seed = seed
+        angles = np.radians(np.take(LEAD_ANGLES, np.arange(num_leads),
+                                    mode="wrap") - HEART_AXIS)
+        self.gains = np.cos(angles) if num_leads > 1 else np.ones(1)
+
+    def _streams(self):
+        """Start an independent random stream for every kind of randomness
+
+        :returns: dictionary of numpy random generators
+        """
+        names = ["beats", "noise", "artifacts", "bad", "missing"]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(names))
+        return {name: np.random.default_rng(seed)
+                for name, seed in zip(names, seeds)}
+
+    def _beat_draw(self, rng):
+        """Make the function that draws the next batch of RR intervals
+
+        The intervals follow a first order autoregressive process whose
+        state is carried from one batch to the next.
+
+        :param rng: numpy random generator of the beat stream
+
+        :returns: function returning the RR intervals of the next beats
+        twice, once as intervals and once as the value of each beat
+        """
+        mean = 60 / self.bpm
+        state = [rng.standard_normal()]
+
+        def draw():
+            innovations = rng.standard_normal(BATCH)
+            deviation = np.empty(BATCH)
+            previous = state[0]
+            scale = math.sqrt(1 - RR_CORRELATION ** 2)
+            for i in range(BATCH):
+                previous = RR_CORRELATION * previous + scale * innovations[i]
+                deviation[i] = previous
+            state[0] = previous
+            rr = mean * np.maximum(1 + self.hrv * deviation, 0.3)
+            return rr, rr
+        return draw
+
+    def _artifact_draw(self, rng):
+        """Make the function that draws the next batch of motion artifacts
+
+        :param rng: numpy random generator of the artifact stream
+
+        :returns: function returning the intervals between the next
+        artifacts and the amplitude of each of them in mV
+        """
+        mean = 60 / self.artifact_rate if self.artifact_rate else np.inf
+
+        def draw():
+            return (rng.exponential(mean, BATCH),
+                    rng.normal(0, 1.5, BATCH))
+        return draw
+
+    def beat(self, offset, rr):
+        """Evaluate heartbeats at times relative to their R peaks
+
+        :param offset: array of floats containing the time since the R peak
+        of the beat in s
+        :param rr: array of floats containing the RR interval of the beat
+        in s, broadcast against offset
+
+        :returns: array of floats containing the voltage of the beat in mV
+        """
+        stretch = np.sqrt(rr)
+        voltage = np.zeros(np.broadcast(offset, rr).shape)
+        for name, (centre, amplitude, width) in WAVES.items():
+            if name in ("P", "T"):
+                centre = centre * stretch
+            voltage += amplitude * np.exp(-0.5 * ((offset - centre) /
+                                                  width) ** 2)
+        return voltage
+
+    def chunks(self, duration, chunk_seconds=60):
+        """Generate a recording a chunk at a time
+
+        :param duration: float containing the length of the recording in s
+        :param chunk_seconds: float containing the length of every chunk
+        in s
+
+        :returns: generator of tuples containing an array of the time of
+        every row, an array of the voltage of every row, or an
+        (n_rows, n_leads) array for several leads, and an array of the
+        times of the R peaks in the chunk
+        """
+        rate = self.sampling_rate
+        streams = self._streams()
+        mean = 60 / self.bpm
+        beats = _Events(self._beat_draw(streams["beats"]), -mean / 2)
+        artifacts = _Events(self._artifact_draw(streams["artifacts"]), 0.0)
+        before = int(math.ceil(-BEAT_WINDOW[0] * rate))
+        after = int(math.ceil(BEAT_WINDOW[1] * rate))
+        window = np.arange(-before, after + 1)
+        num_samples = int(round(duration * rate))
+        chunk = max(1, int(round(chunk_seconds * rate)))
+        for start in range(0, num_samples, chunk):
+            end = min(start + chunk, num_samples)
+            n = np.arange(start, end)
+            time = n / rate
+            beat_times, rr = beats.between((start - after) / rate,
+                                           (end + before) / rate)
+            index = np.rint(beat_times * rate).astype(np.int64)
+            sample = index[:, np.newaxis] + window
+            shape = self.beat(sample / rate - beat_times[:, np.newaxis],
+                              rr[:, np.newaxis])
+            inside = (sample >= start) & (sample < end)
+            trace = np.bincount(sample[inside] - start, shape[inside],
+                                minlength=end - start)
+            baseline = self.wander * (np.sin(2 * np.pi * 0.3 * time) +
+                                      0.5 * np.sin(2 * np.pi * 0.05 * time +
+                                                   1))
+            if self.mains:
+                baseline += self.mains * np.sin(
+                    2 * np.pi * self.mains_frequency * time)
+            if self.artifact_rate:
+                baseline += self._artifacts(artifacts, time)
+            voltage = self.gains * trace[:, np.newaxis] + \
+                baseline[:, np.newaxis]
+            voltage += self.noise * streams["noise"].standard_normal(
+                (end - start, self.num_leads))
+            bad = streams["bad"].random(end - start) < self.bad_rate
+            voltage[bad & (n % 2 == 0)] = np.nan
+            time[bad & (n % 2 == 1)] = np.nan
+            kept = streams["missing"].random(end - start) >= \
+                self.missing_rate
+            if self.num_leads == 1:
+                voltage = voltage[:, 0]
+            first, last = np.searchsorted(beat_times, (start / rate,
+                                                       end / rate))
+            yield time[kept], voltage[kept], beat_times[first:last]
+
+    def _artifacts(self, artifacts, time):
+        """Add up the motion artifacts that affect a chunk
+
+        Every artifact is a step of the baseline that decays
+        exponentially.
+
+        :param artifacts: _Events containing the artifact times and
+        amplitudes
+        :param time: array of floats containing the time of every sample
+
+        :returns: array of floats containing the artifact voltage
+        """
+        onsets, amplitudes = artifacts.between(
+            time[0] - 30 * ARTIFACT_DECAY, time[-1])
+        since = time[:, np.newaxis] - onsets
+        decay = np.exp(-np.maximum(since, 0) / ARTIFACT_DECAY)
+        return np.sum(np.where(since >= 0, amplitudes * decay, 0), axis=1)
+
+
+def _time_format(sampling_rate):
+    """Find the number format that tells every sample time apart
+
+    :param sampling_rate: float containing the sampling rate in Hz
+
+    :returns: string containing the printf format of the time column
+    """
+    return "%.{}f".format(max(3, int(math.ceil(math.log10(sampling_rate)))
+                              + 1))
+
+
+def _write_beats(f, beats):
+    """Append R peak times to an open beat file, one per line"""
+    if f is not None and beats.size:
+        np.savetxt(f, beats, fmt="%.6f")
+
+
+def write_csv(filename, duration, chunk_seconds=60, beats_filename=None,
+              **params):
+    """Write a synthetic recording in the test_data csv format
+
+    Rows with a missing field are written with an empty field, like the
+    bad rows of the test data. Files with several leads get a header line
+    naming the columns.
+
+    :param filename: string containing the name of the csv file to write
+    :param duration: float containing the length of the recording in s
+    :param chunk_seconds: float containing the seconds generated at a time
+    :param beats_filename: string containing the name of a file to write
+    the time of every R peak to, or None
+    :param params: keyword arguments of SyntheticECG
+
+    :returns: int containing the number of R peaks in the recording
+    """
+    generator = SyntheticECG(**params)
+    formats = [_time_format(generator.sampling_rate)] + \
+        ["%.4f"] * generator.num_leads
+    num_beats = 0
+    beat_file = open(beats_filename, "w") if beats_filename else None
+    try:
+        with open(filename, "w") as f:
+            if generator.num_leads > 1:
+                f.write(",".join(["time"] + [
+                    "lead {}".format(i + 1)
+                    for i in range(generator.num_leads)]) + "\n")
+            for time, voltage, beats in generator.chunks(duration,
+                                                         chunk_seconds):
+                text = io.StringIO()
+                np.savetxt(text, np.column_stack((time, voltage)),
+                           fmt=formats, delimiter=",")
+                f.write(text.getvalue().replace("nan", ""))
+                _write_beats(beat_file, beats)
+                num_beats += beats.size
+    finally:
+        if beat_file is not None:
+            beat_file.close()
+    return num_beats
+
+
+def write_binary(filename, duration, chunk_seconds=60, beats_filename=None,
+                 **params):
+    """Write a synthetic recording as a binary ECG container
+
+    The container cannot hold a missing field, so the rows with one are
+    left out like the dropped rows.
+
+    :param filename: string containing the name of the file to write
+    :param duration: float containing the length of the recording in s
+    :param chunk_seconds: float containing the seconds generated at a time
+    :param beats_filename: string containing the name of a file to write
+    the time of every R peak to, or None
+    :param params: keyword arguments of SyntheticECG
+
+    :returns: int containing the number of R peaks in the recording
+    """
+    generator = SyntheticECG(**params)
+    num_beats = 0
+    beat_file = open(beats_filename, "w") if beats_filename else None
+    try:
+        with ecg_binary.BinaryWriter(filename, generator.sampling_rate,
+                                     num_leads=generator.num_leads) as out:
+            for time, voltage, beats in generator.chunks(duration,
+                                                         chunk_seconds):
+                voltage = voltage.reshape(time.size, -1)
+                valid = ~(np.isnan(time) | np.isnan(voltage).any(axis=1))
+                out.write(time[valid], voltage[valid])
+                _write_beats(beat_file, beats)
+                num_beats += beats.size
+    finally:
+        if beat_file is not None:
+            beat_file.close()
+    return num_beats
+
+
+def read_beats(filename):
+    """Load the R peak times written next to a synthetic recording
+
+    :param filename: string containing the name of the beat file
+
+    :returns: array of floats containing the time of every R peak
+    """
+    return np.loadtxt(filename, ndmin=1)
+
+
+def main(argv=None):
+    """Write a synthetic recording from the command line
+
+    The format follows the file extension: ecg_binary.EXTENSION gives a
+    binary container and anything else a csv file.
+
+    :param argv: list of strings containing the arguments, or None for
+    sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic ECG recording")
+    parser.add_argument("filename")
+    parser.add_argument("--duration", type=float, default=60,
+                        help="length of the recording in s")
+    parser.add_argument("--sampling-rate", type=float, default=250)
+    parser.add_argument("--bpm", type=float, default=72)
+    parser.add_argument("--hrv", type=float, default=0.05,
+                        help="standard deviation of the RR intervals as a "
+                             "fraction of their mean")
+    parser.add_argument("--leads", type=int, default=1)
+    parser.add_argument("--wander", type=float, default=0.2)
+    parser.add_argument("--mains", type=float, default=0.0)
+    parser.add_argument("--mains-frequency", type=float, default=60)
+    parser.add_argument("--noise", type=float, default=0.03)
+    parser.add_argument("--artifact-rate", type=float, default=0.0,
+                        help="motion artifacts per minute")
+    parser.add_argument("--bad-rate", type=float, default=0.0)
+    parser.add_argument("--missing-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-seconds", type=float, default=60)
+    parser.add_argument("--beats", default=None,
+                        help="file to write the R peak times to")
+    args = parser.parse_args(argv)
+    write = write_binary if args.filename.endswith(ecg_binary.EXTENSION) \
+        else write_csv
+    num_beats = write(args.filename, args.duration, args.chunk_seconds,
+                      args.beats, sampling_rate=args.sampling_rate,
+                      bpm=args.bpm, hrv=args.hrv, num_leads=args.leads,
+                      wander=args.wander, mains=args.mains,
+                      mains_frequency=args.mains_frequency,
+                      noise=args.noise, artifact_rate=args.artifact_rate,
+                      bad_rate=args.bad_rate,
+                      missing_rate=args.missing_rate, seed=args.seed)
+    logging.info("Wrote {} s with {} beats to {}".format(
+        args.duration, num_beats, args.filename))
+    print("Wrote {} beats to {}".format(num_beats, args.filename))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
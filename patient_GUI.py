@@ -2,11 +2,18 @@
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, Scrollbar
-from PIL import Image, ImageTk
-from ecg_analysis import overall_plotting, overall_rate
+import argparse
+from ecg_analysis import png_name, start_warm_up
+from ecg_cache import progressive_analysis
+from ecg_instrument import stage
 from datetime import datetime
 import os
-from cloud_client import add_files_to_server, convert_file_to_b64_string
+import io
+import queue
+import threading
+
+# Pillow and cloud_client, which imports requests, are imported by the
+# functions that show an image or upload, so they do not slow the start.
 
 
 server = "http://152.3.65.89:5002"
@@ -22,8 +29,9 @@ def load_and_resize_image(filename):
 
        Parameters
         ----------
-        filename : Str
-            containing the name of the image file
+        filename : Str or file object
+            containing the name of the image file, or a file object such as
+            io.BytesIO holding the image bytes
 
        Returns
        -------
@@ -32,6 +40,7 @@ def load_and_resize_image(filename):
         filename
             Containing the name of the image file
        """
+    from PIL import Image, ImageTk
     pil_image = Image.open(filename)
     resized_image = pil_image.resize((250, 250))
     tk_image = ImageTk.PhotoImage(resized_image)
@@ -63,7 +72,7 @@ def change_file(starting, type):
     return filename
 
 
-def design_window():
+def design_window(warm_up=False, run=True):
     """Creates the patient-side GUI window for the database
 
         A GUI window is created that is the database's patient interface. It
@@ -78,7 +87,23 @@ def design_window():
         The GUI also includes an "Upload" button. Upon hitting this button, the
         information is sent to the server and a return message is displayed
         below the button. Finally, the GUI includes a "Cancel" button that
-        closes the GUI window.
+        closes the GUI window. The analysis modules are only loaded when the
+        first ECG file is chosen; with warm_up they are loaded in a
+        background thread as soon as the window is idle instead.
+
+        Parameters
+        ----------
+        warm_up : bool
+            True to load the analysis modules in the background once the
+            window is shown
+        run : bool
+            True to run the tkinter main loop, False to return the window
+            right away, as the startup benchmark does
+
+        Returns
+        -------
+        tkinter.Tk
+            Containing the root window, once the main loop has ended
     """
     def upload_button_cmd():
         """Event to run when Upload button is pressed
@@ -94,6 +119,8 @@ def design_window():
            then prints the response from the post request to the server in the
            GUI.
         """
+        from cloud_client import add_files_to_server, \
+            convert_file_to_b64_string, convert_bytes_to_b64_string
         name = name_data.get()
         record_number = record_data.get()
         try:
@@ -104,12 +131,14 @@ def design_window():
             medical_b64 = ""
         try:
             ecg_filename = os.path.basename(ecg_file_label.name)
-            ecg_b64 = convert_file_to_b64_string(ecg_file_label.name)
+            ecg_b64 = convert_bytes_to_b64_string(ecg_file_label.image_bytes)
             heart_rate = bpm_label.hr
+            hrv = bpm_label.hrv
         except AttributeError:
             ecg_filename = ""
             ecg_b64 = ""
             heart_rate = ""
+            hrv = None
         time = datetime.now()
         timestamp = datetime.strftime(time, "%Y-%m-%d %H:%M:%S")
         answer = add_files_to_server(name,
@@ -119,7 +148,8 @@ def design_window():
                                      ecg_filename,
                                      ecg_b64,
                                      heart_rate,
-                                     timestamp)
+                                     timestamp,
+                                     hrv)
         output_string.configure(text=answer)
 
     def clear_ecg_cmd():
@@ -130,7 +160,9 @@ def design_window():
            empty strings, effectively erasing the filename and image from the
            GUI.
         """
+        ecg_request[0] += 1
         ecg_file_label.name = ''
+        ecg_file_label.image_bytes = b''
         ecg_file_label.config(text='')
         ecg_image_label.config(image='')
         bpm_label.config(text='')
@@ -159,30 +191,96 @@ def design_window():
         """Allows user to select a new ECG file to display as an image
 
            This function opens a dialog box to allow the user to choose a .csv
-           file. If the user does not cancel the dialog box, the chosen file is
-           plotted and saved as a .png file. The file is then set sent to an
-           external function for opening and resizing. The returned image is
-           then added to the ecg_image_label widget for display on the GUI. The
-           filename is added to the ecg_file_label widget for display. The
-           heart rate is also calculated and added to the bpm_label widget for
-           display.
+           file. If the user does not cancel the dialog box, the file is
+           analyzed in a background thread with progressive_analysis so the
+           window stays responsive. Unless the file is already in the
+           analysis cache, a provisional heart rate and trace from the start
+           of the file are shown within moments and replaced by the final
+           result from the whole file when it is ready. The whole lookup is
+           recorded as the "ecg_picture" stage when ecg_instrument is
+           enabled.
         """
         filename = change_file("test_data", [("CSV Files", ".csv")])
-        filename_png = "{}.png".format(filename.strip(".csv"))
         if filename == "":
             messagebox.showinfo("Cancel", "You cancelled the file selection")
             return
         elif filename == "no file":
             return
-        overall_plotting(filename)
-        hr = overall_rate(filename)
-        tk_image, filename = load_and_resize_image(filename_png)
+        ecg_request[0] += 1
+        request = ecg_request[0]
+        bpm_label.configure(text="Analyzing...")
+
+        def analyze_in_background():
+            try:
+                with stage("ecg_picture"):
+                    for result in progressive_analysis(filename):
+                        ecg_results.put((request, filename, result))
+            except Exception as error:
+                ecg_results.put((request, filename, error))
+
+        threading.Thread(target=analyze_in_background, daemon=True).start()
+
+    def show_ecg_results():
+        """Displays the ECG results handed over by the analysis thread
+
+           tkinter widgets may only be changed from the main thread, so the
+           analysis thread puts its results on the ecg_results queue and this
+           function, which reschedules itself with root.after, shows them.
+           Results of a file that has since been replaced or cleared are
+           dropped. A provisional heart rate is shown with "(preliminary)"
+           and is not uploaded; the ECG is only ready to upload once the
+           final result is shown.
+        """
+        while True:
+            try:
+                request, filename, result = ecg_results.get_nowait()
+            except queue.Empty:
+                break
+            if request != ecg_request[0]:
+                continue
+            if isinstance(result, Exception):
+                bpm_label.configure(text="")
+                messagebox.showerror("ECG Analysis", "Could not analyze "
+                                     "{}: {}".format(filename, result))
+                continue
+            show_ecg_result(filename, result)
+        root.after(50, show_ecg_results)
+
+    def show_ecg_result(filename, result):
+        """Shows the heart rate and trace of one ECG result
+
+           The .png bytes are sent to an external function for opening and
+           resizing without being written next to the file. The returned
+           image is then added to the ecg_image_label widget for display on
+           the GUI. The filename is added to the ecg_file_label widget for
+           display. The heart rate is also added to the bpm_label widget for
+           display.
+
+           Parameters
+            ----------
+            filename : Str
+                Contains the name of the analyzed ECG file
+            result : dict
+                Contains the result returned by progressive_analysis
+        """
+        filename_png = png_name(filename)
+        hr = "{}".format(result["bpm"])
+        tk_image, _ = load_and_resize_image(io.BytesIO(result["png"]))
         ecg_image_label.configure(image=tk_image)
         ecg_image_label.image = tk_image
         ecg_file_label.configure(text=filename_png)
-        ecg_file_label.name = filename
+        if result["provisional"]:
+            ecg_file_label.name = ''
+            ecg_file_label.image_bytes = b''
+            bpm_label.configure(text="{} (preliminary)".format(hr))
+            bpm_label.hr = ''
+            bpm_label.hrv = None
+            return
+        ecg_file_label.name = filename_png
+        ecg_file_label.image_bytes = result["png"]
         bpm_label.configure(text=hr)
         bpm_label.hr = hr
+        bpm_label.hrv = dict(result["hrv"], rr=result["rr"])
 
     def change_medical_picture_cmd():
         """Allows user to select a new medical image to display
@@ -207,6 +305,9 @@ def design_window():
         medical_file_label.configure(text=filename)
         medical_file_label.name = filename
 
+    ecg_request = [0]
+    ecg_results = queue.Queue()
+
     root = tk.Tk()
     root.configure(background="#ececec")
     root.title("Patient GUI")
@@ -282,8 +383,18 @@ def design_window():
                                command=cancel_cmd)
     cancel_button.grid(column=5, row=7, pady=[40, 0])
 
-    root.mainloop()
+    root.after(50, show_ecg_results)
+    if warm_up:
+        root.after_idle(start_warm_up)
+    if run:
+        root.mainloop()
+    return root
 
 
 if __name__ == '__main__':
-    design_window()
+    parser = argparse.ArgumentParser(description="Patient-side GUI")
+    parser.add_argument("--warm-up", action="store_true",
+                        help="load the ECG analysis in the background once "
+                             "the window is shown")
+    args = parser.parse_args()
+    design_window(args.warm_up)
@@ -4,11 +4,38 @@ from PIL import Image, ImageTk
 import requests
 import json
 from cloud_client import b64_to_ndarray, get_index, \
-    resize_image, b64_string_to_file, process_b64
+    resize_image, b64_string_to_file, process_b64, get_patient_summary, \
+    get_image_b64
 
 server = "http://152.3.65.89:5002"
 
 
+def display_image(label, b64_string):
+    """Shows an image from the server in a label of the GUI
+
+    The b64 string is converted to an ndarray, resized and displayed
+    in the label. If the server could not return the image, b64_string
+    is None and the label is cleared instead, so the GUI does not keep
+    showing an image from another patient.
+
+    Parameters
+    ----------
+    label : ttk.Label
+        The label the image is displayed in
+    b64_string : Str or None
+        Contains the b64 string for the image, or None if the server
+        could not return it
+    """
+    if b64_string is None:
+        label.configure(image="")
+        label.image = None
+        return
+    resized_nd = process_b64(b64_string)
+    tk_image = ImageTk.PhotoImage(image=Image.fromarray(resized_nd))
+    label.configure(image=tk_image)
+    label.image = tk_image
+
+
 def design_window():
     """Creates the provider-side GUI window
 
@@ -48,6 +75,7 @@ def design_window():
         medical_record_options = json.loads(r.text)
         record_selector['values'] = medical_record_options
         patient_info = update_patient_info()
+        patient_id = patient_info["medical_record_number"]
 
         namelabel.set(patient_info["name"])
         idlabel.set(patient_info["medical_record_number"])
@@ -57,18 +85,17 @@ def design_window():
         image_selector['values'] = patient_info["medical_images"]
         ecg_selector['values'] = patient_info["datetimes"]
 
-        resized_ecg_nd = process_b64(patient_info["ecg_images_b64"][-1])
-        tk_latest_ecg = ImageTk. \
-            PhotoImage(image=Image.fromarray(resized_ecg_nd))
-        latest_ecg_image_label.configure(image=tk_latest_ecg)
-        latest_ecg_image_label.image = tk_latest_ecg
+        b64_string = get_image_b64(patient_id, "ecg", -1)
+        display_image(latest_ecg_image_label, b64_string)
         root.after(10000, refresh)
 
     def update_patient_info():
         """
-        This function is called specifically to perform a post request
+        This function is called specifically to perform a get request
         the server to retrieve all the relevant information about a patient,
         specified by selection in the first combobox,from the database.
+        The images are not included and are fetched one at a time with
+        get_image_b64 when they are displayed or saved.
 
         Returns
         -------
@@ -76,8 +103,7 @@ def design_window():
             Containing all relevant updated information about selected patient
         """
         patient_id = int(variable.get())
-        r = requests.post(server + "/api/get_info", json=patient_id)
-        patient_info = json.loads(r.text)
+        patient_info = get_patient_summary(patient_id)
         return patient_info
 
     def update_info(event):
@@ -96,6 +122,7 @@ def design_window():
             Needed to trigger when bound combobox selection changes
         """
         patient_info = update_patient_info()
+        patient_id = patient_info["medical_record_number"]
 
         namelabel.set(patient_info["name"])
         idlabel.set(patient_info["medical_record_number"])
@@ -107,23 +134,14 @@ def design_window():
         image_selector['values'] = patient_info["medical_images"]
         ecg_selector['values'] = patient_info["datetimes"]
 
-        resized_medical_nd = process_b64(patient_info["medical_images_b64"][0])
-        tk_medical_image = ImageTk. \
-            PhotoImage(image=Image.fromarray(resized_medical_nd))
-        medical_image_label.configure(image=tk_medical_image)
-        medical_image_label.image = tk_medical_image
+        b64_string = get_image_b64(patient_id, "medical", 0)
+        display_image(medical_image_label, b64_string)
 
-        resized_ecg_nd = process_b64(patient_info["ecg_images_b64"][0])
-        tk_ecg_image = ImageTk. \
-            PhotoImage(image=Image.fromarray(resized_ecg_nd))
-        ecg_image_label.configure(image=tk_ecg_image)
-        ecg_image_label.image = tk_ecg_image
+        b64_string = get_image_b64(patient_id, "ecg", 0)
+        display_image(ecg_image_label, b64_string)
 
-        resized_ecg_nd = process_b64(patient_info["ecg_images_b64"][-1])
-        tk_latest_ecg = ImageTk. \
-            PhotoImage(image=Image.fromarray(resized_ecg_nd))
-        latest_ecg_image_label.configure(image=tk_latest_ecg)
-        latest_ecg_image_label.image = tk_latest_ecg
+        b64_string = get_image_b64(patient_id, "ecg", -1)
+        display_image(latest_ecg_image_label, b64_string)
 
     def update_medical_image(event):
         """
@@ -131,8 +149,8 @@ def design_window():
         a different selection is made in the medical image combobox.
         It reads the selected file, gets the index of that file
         in the medical image list for that patient, then uses that
-        index to retrieve the corresponding b64 string representing
-        that image selected from the parallel b64 list. Then, this
+        index to retrieve the b64 string of that image from the
+        server with get_image_b64. Then, this
         b64 string is converted to an ndarray, resized, and then
         displayed.
 
@@ -142,15 +160,12 @@ def design_window():
             Needed to trigger when bound combobox selection changes
         """
         patient_info = update_patient_info()
+        patient_id = patient_info["medical_record_number"]
 
         selected_image = variable2.get()
         index = get_index(patient_info["medical_images"], selected_image)
-        resized_medical_nd = process_b64(patient_info["medical_images_b64"]
-                                         [index])
-        tk_medical_image = ImageTk.\
-            PhotoImage(image=Image.fromarray(resized_medical_nd))
-        medical_image_label.configure(image=tk_medical_image)
-        medical_image_label.image = tk_medical_image
+        b64_string = get_image_b64(patient_id, "medical", index)
+        display_image(medical_image_label, b64_string)
 
     def update_ecg_image(event):
         """
@@ -158,8 +173,8 @@ def design_window():
         a different selection is made in the ecg image combobox.
         It reads the selected file, gets the index of that file
         in the ecg image list for that patient, then uses that
-        index to retrieve the corresponding b64 string representing
-        that image selected from the parallel b64 list. Then, this
+        index to retrieve the b64 string of that image from the
+        server with get_image_b64. Then, this
         b64 string is converted to an ndarray, resized, and then
         displayed.
 
@@ -169,14 +184,12 @@ def design_window():
             Needed to trigger when bound combobox selection changes
         """
         patient_info = update_patient_info()
+        patient_id = patient_info["medical_record_number"]
 
         selected_image = variable3.get()
         index = get_index(patient_info["datetimes"], selected_image)
-        resized_ecg_nd = process_b64(patient_info["ecg_images_b64"][index])
-        tk_ecg_image = ImageTk.\
-            PhotoImage(image=Image.fromarray(resized_ecg_nd))
-        ecg_image_label.configure(image=tk_ecg_image)
-        ecg_image_label.image = tk_ecg_image
+        b64_string = get_image_b64(patient_id, "ecg", index)
+        display_image(ecg_image_label, b64_string)
 
     def save_latest_ecg():
         """
@@ -185,15 +198,23 @@ def design_window():
         location and name of their choice. First, the filedialogue
         module asksaveasfile is used to allow users to specify a
         name and location for the image. Then, if they provide
-        these, the b64 string is retrieved and written into a file.
+        these, the b64 string is retrieved from the server and written
+        into a file. If the server cannot return the image,
+        an error message is shown instead.
         """
         patient_info = update_patient_info()
+        patient_id = patient_info["medical_record_number"]
         filename = filedialog.asksaveasfile(defaultextension=".jpg",
                                             initialfile="Latest_ECG.jpg",
                                             mode='wb')
         if not filename:
             return
-        latest_ecg_b64 = patient_info["ecg_images_b64"][-1]
+        latest_ecg_b64 = get_image_b64(patient_id, "ecg", -1)
+        if latest_ecg_b64 is None:
+            filename.close()
+            messagebox.showerror("Image Not Found",
+                                 "The server could not return this image.")
+            return
         b64_string_to_file(latest_ecg_b64, filename)
 
     def save_ecg():
@@ -203,9 +224,12 @@ def design_window():
         location and name of their choice. First, the filedialogue
         module asksaveasfile is used to allow users to specify a
         name and location for the image. Then, if they provide
-        these, the b64 string is retrieved and written into a file.
+        these, the b64 string is retrieved from the server and written
+        into a file. If the server cannot return the image,
+        an error message is shown instead.
         """
         patient_info = update_patient_info()
+        patient_id = patient_info["medical_record_number"]
         filename = filedialog.asksaveasfile(defaultextension=".jpg",
                                             initialfile="ECG.jpg",
                                             mode='wb')
@@ -213,7 +237,12 @@ def design_window():
             return
         selected_image = variable3.get()
         index = get_index(patient_info["datetimes"], selected_image)
-        ecg_b64 = patient_info["ecg_images_b64"][index]
+        ecg_b64 = get_image_b64(patient_id, "ecg", index)
+        if ecg_b64 is None:
+            filename.close()
+            messagebox.showerror("Image Not Found",
+                                 "The server could not return this image.")
+            return
         b64_string_to_file(ecg_b64, filename)
 
     def save_medical_image():
@@ -223,9 +252,12 @@ def design_window():
         location and name of their choice. First, the filedialogue
         module asksaveasfile is used to allow users to specify a
         name and location for the image. Then, if they provide
-        these, the b64 string is retrieved and written into a file.
+        these, the b64 string is retrieved from the server and written
+        into a file. If the server cannot return the image,
+        an error message is shown instead.
         """
         patient_info = update_patient_info()
+        patient_id = patient_info["medical_record_number"]
         filename = filedialog.asksaveasfile(defaultextension=".jpg",
                                             initialfile="Medical_Image.jpg",
                                             mode='wb')
@@ -233,7 +265,12 @@ def design_window():
             return
         selected_image = variable2.get()
         index = get_index(patient_info["medical_images"], selected_image)
-        medical_b64 = patient_info["medical_images_b64"][index]
+        medical_b64 = get_image_b64(patient_id, "medical", index)
+        if medical_b64 is None:
+            filename.close()
+            messagebox.showerror("Image Not Found",
+                                 "The server could not return this image.")
+            return
         b64_string_to_file(medical_b64, filename)
 
     root = tk.Tk()
@@ -257,6 +294,7 @@ def design_window():
 
     # Updates patient_info dictionary to contain all relevant info
     patient_info = update_patient_info()
+    patient_id = patient_info["medical_record_number"]
 
     # Display the name of the patient selected
     ttk.Label(root, text="Patient Name") \
@@ -321,30 +359,21 @@ def design_window():
     ecg_selector.bind('<<ComboboxSelected>>', update_ecg_image)
 
     # Display the selected medical image
-    resized_medical_nd = process_b64(patient_info["medical_images_b64"][0])
-    tk_medical_image = ImageTk.\
-        PhotoImage(image=Image.fromarray(resized_medical_nd))
-    medical_image_label = ttk.Label(root, image=tk_medical_image)
     medical_image_label = ttk.Label(root, image="")
-    medical_image_label.configure(image=tk_medical_image)
+    b64_string = get_image_b64(patient_id, "medical", 0)
+    display_image(medical_image_label, b64_string)
     medical_image_label.grid(column=3, row=1, rowspan=4, columnspan=2)
 
     # Display the latest ECG trace for the patient
-    resized_ecg_nd = process_b64(patient_info["ecg_images_b64"][-1])
-    tk_latest_ecg = ImageTk.\
-        PhotoImage(image=Image.fromarray(resized_ecg_nd))
-    latest_ecg_image_label = ttk.Label(root, image=tk_latest_ecg)
     latest_ecg_image_label = ttk.Label(root, image="")
-    latest_ecg_image_label.configure(image=tk_latest_ecg)
+    b64_string = get_image_b64(patient_id, "ecg", -1)
+    display_image(latest_ecg_image_label, b64_string)
     latest_ecg_image_label.grid(column=0, row=7, columnspan=2)
 
     # Display the selected ECG trace from the combobox
-    resized_ecg_nd = process_b64(patient_info["ecg_images_b64"][0])
-    tk_ecg_image = ImageTk.\
-        PhotoImage(image=Image.fromarray(resized_ecg_nd))
-    ecg_image_label = ttk.Label(root, image=tk_ecg_image)
     ecg_image_label = ttk.Label(root, image="")
-    ecg_image_label.configure(image=tk_ecg_image)
+    b64_string = get_image_b64(patient_id, "ecg", 0)
+    display_image(ecg_image_label, b64_string)
     ecg_image_label.grid(column=3, row=7, columnspan=2)
 
     # Save buttons to allow users to save any image they like locally
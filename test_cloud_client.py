@@ -89,3 +89,20 @@ def test_process_b64():
                 [68, 115, 197],
                 [68, 115, 197]]
     assert (answer == expected).all
+
+
+@pytest.mark.parametrize("status_code, content, expected",
+                         [(200, b"abc", "YWJj"),
+                          (404, b"Image not found", None)])
+def test_get_image_b64(monkeypatch, status_code, content, expected):
+    import requests
+    from cloud_client import get_image_b64
+
+    class FakeResponse:
+        def __init__(self):
+            self.status_code = status_code
+            self.content = content
+
+    monkeypatch.setattr(requests, "get", lambda url: FakeResponse())
+    answer = get_image_b64(16, "ecg", -1)
+    assert answer == expected
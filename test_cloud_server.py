@@ -4,7 +4,8 @@ import pytest
 from datetime import datetime
 from testfixtures import LogCapture
 from cloud_server import initialize_server, add_database_entry
-from database_definitions import Patient
+from database_definitions import Patient, Image
+import base64
 import io
 import os
 
@@ -19,43 +20,43 @@ err_str_1 = "The value corresponding to the key record_number " \
                          [({"patient_name": "Yume Choi",
                             "record_number": 3,
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": 90,
                             "datetimes": "2021-10-06 11:11:40"},
                            "record_number",
                            {"patient_name": "Yume Choi",
                             "record_number": 3,
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": 90,
                             "datetimes": "2021-10-06 11:11:40"}),
                           ({"patient_name": "David Tan",
                             "record_number": "3",
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": 90,
                             "datetimes": "2021-10-06 11:11:40"},
                            "record_number",
                            {"patient_name": "David Tan",
                             "record_number": 3,
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": 90,
                             "datetimes": "2021-10-06 11:11:40"}),
                           ({"patient_name": "Matthew Weintraub",
                             "record_number": "a",
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": 90,
                             "datetimes": "2021-10-06 11:11:40"},
                            "record_number", err_str_1)])
@@ -82,27 +83,27 @@ expected_patient_input = {"patient_name": str,
                          [({"patient_name": "Yume Choi",
                             "record_number": 3,
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": 90,
                             "datetimes": "2021-10-06 11:11:40"},
                            expected_patient_input, True, 200),
                           ({"patient_name": "Yume Choi",
                             "record_number": "3",
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": "90",
                             "datetimes": "2021-10-06 11:11:40"},
                            expected_patient_input, True, 200),
                           ({"patient_name": "Yume Choi",
                             "record_number": "",
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": 90,
                             "datetimes": "2021-10-06 11:11:40"},
                            expected_patient_input, err_str_4, 400),
@@ -113,21 +114,42 @@ def test_validate_input(in_data, expected_input, expected_val, expected_code):
     assert result == (expected_val, expected_code)
 
 
+@pytest.mark.parametrize("hrv, expected",
+                         [(None, (True, 200)),
+                          ({"sdnn": 41.2, "rr": "IAPoAw=="}, (True, 200)),
+                          ("41.2", ("The key hrv has the wrong data type",
+                                    400))])
+def test_validate_optional_input(hrv, expected):
+    from cloud_server import validate_input, expected_input, optional_input
+    in_data = {"patient_name": "Yume Choi",
+               "record_number": 3,
+               "medical_image_files": "y1.png",
+               "medical_images_b64": "abc12345",
+               "ECG_image_files": "y2.png",
+               "ECG_images_b64": "def45678",
+               "heartrates": 90,
+               "datetimes": "2021-10-06 11:11:40"}
+    if hrv is not None:
+        in_data["hrv"] = hrv
+    result = validate_input(in_data, expected_input, optional_input)
+    assert result == expected
+
+
 @pytest.mark.parametrize("in_data, expected",
                          [({"patient_name": "Yume Choi",
                             "record_number": 5,
                             "medical_image_files": "y1.png",
-                            "medical_images_b64": "abc123",
+                            "medical_images_b64": "abc12345",
                             "ECG_image_files": "y2.png",
-                            "ECG_images_b64": "def456",
+                            "ECG_images_b64": "def45678",
                             "heartrates": 90,
                             "datetimes": "2021-10-06 11:11:40"},
                           "Updated patient 5")])
 def test_new_or_old(in_data, expected):
     from cloud_server import new_or_old
     from cloud_server import add_database_entry
-    patient = add_database_entry("Yume Choi", 5, "1.png", "abc123", "2.png",
-                                 "def456", 86, "2020-03-09 11:00:36")
+    patient = add_database_entry("Yume Choi", 5, "1.png", "abc12345", "2.png",
+                                 "def45678", 86, "2020-03-09 11:00:36")
     answer = new_or_old(in_data)
     patient.delete()
     assert answer == expected
@@ -136,8 +158,8 @@ def test_new_or_old(in_data, expected):
 def test_add_database_entry():
     from cloud_server import add_database_entry
     expected_name = "Yume Choi"
-    answer = add_database_entry(expected_name, 5, "1.png", "abc123", "2.png",
-                                "def456", 86, "2020-03-09 11:00:36")
+    answer = add_database_entry(expected_name, 5, "1.png", "abc12345", "2.png",
+                                "def45678", 86, "2020-03-09 11:00:36")
     answer.delete()
     assert answer.name == expected_name
 
@@ -148,7 +170,7 @@ def test_find_patient():
     expected_name = "Yume Choi"
     expected_id = 5
     entry_to_delete = add_database_entry(expected_name, expected_id, "1.png",
-                                         "abc123", "2.png", "def456", 86,
+                                         "abc12345", "2.png", "def45678", 86,
                                          "2020-03-09 11:00:36")
     answer = find_patient(expected_id)
     entry_to_delete.delete()
@@ -160,8 +182,8 @@ def test_add_database_entry_is_made():
     from cloud_server import add_database_entry
     with LogCapture() as log_c:
         entry_to_delete = add_database_entry("Yume Choi", 5, "1.png",
-                                             "abc123", "2.png", "def456", 86,
-                                             "2020-03-09 11:00:36")
+                                             "abc12345", "2.png", "def45678",
+                                             86, "2020-03-09 11:00:36")
         entry_to_delete.delete()
     log_c.check(("root", "INFO", "Added new patient into database with id: 5"))
 
@@ -170,74 +192,87 @@ def test_add_patient_file_is_made():
     from cloud_server import add_patient_file
     with LogCapture() as log_c:
         entry_to_delete = add_database_entry("Yume Choi", 5, "1.png",
-                                             "abc123", "2.png", "def456", 86,
-                                             "2020-03-09 11:00:36")
-        add_patient_file("Yume Choi", 5, "3.png", "abc123", "4.png",
-                         "def456", 90, "2021-04-10 12:11:59")
+                                             "abc12345", "2.png", "def45678",
+                                             86, "2020-03-09 11:00:36")
+        add_patient_file("Yume Choi", 5, "3.png", "abc12345", "4.png",
+                         "def45678", 90, "2021-04-10 12:11:59")
         entry_to_delete.delete()
     log_c.check(("root", "INFO", "Added new patient into database with id: 5"),
                 ("root", "INFO", "Updated patient with id: 5"))
 
 
-entry_to_delete1 = add_database_entry("Max Silver", 9, "1.png", "m1", "2.png",
-                                      "e2", 86, "2020-03-09 11:00:36")
-expected_vals1 = ("Max Silver", 9, ["1.png", "3.png"], ["m1", "m3"],
-                  ["2.png", "4.png"], ["e2", "e4"], [86, 90],
+entry_to_delete1 = add_database_entry("Max Silver", 9, "1.png", "m1m1",
+                                      "2.png", "e2e2", 86,
+                                      "2020-03-09 11:00:36")
+expected_vals1 = ("Max Silver", 9, ["1.png", "3.png"], ["m1m1", "m3m3"],
+                  ["2.png", "4.png"], ["e2e2", "e4e4"], [86, 90],
                   ["2020-03-09 11:00:36", "2021-04-10 12:11:59"])
-entry_to_delete2 = add_database_entry("", 10, "1.png", "m1", "2.png", "e2",
+entry_to_delete2 = add_database_entry("", 10, "1.png", "m1m1", "2.png", "e2e2",
                                       86, "2020-03-09 11:00:36")
-expected_vals2 = ("Maria Lopez", 10, ["1.png", "3.png"], ["m1", "m3"],
-                  ["2.png", "4.png"], ["e2", "e4"], [86, 90],
+expected_vals2 = ("Maria Lopez", 10, ["1.png", "3.png"], ["m1m1", "m3m3"],
+                  ["2.png", "4.png"], ["e2e2", "e4e4"], [86, 90],
                   ["2020-03-09 11:00:36", "2021-04-10 12:11:59"])
-entry_to_delete3 = add_database_entry("Martha Ball", 11, "1.png", "m1",
-                                      "2.png", "e2", 86, "2020-03-09 11:00:36")
-expected_vals3 = ("Martha Ball", 11, ["1.png"], ["m1"], ["2.png", "4.png"],
-                  ["e2", "e4"], [86, 90],
+entry_to_delete3 = add_database_entry("Martha Ball", 11, "1.png", "m1m1",
+                                      "2.png", "e2e2", 86,
+                                      "2020-03-09 11:00:36")
+expected_vals3 = ("Martha Ball", 11, ["1.png"], ["m1m1"], ["2.png", "4.png"],
+                  ["e2e2", "e4e4"], [86, 90],
                   ["2020-03-09 11:00:36", "2021-04-10 12:11:59"])
-entry_to_delete4 = add_database_entry("Martin Zoom", 12, "1.png", "m1",
-                                      "2.png", "e2", 86,
+entry_to_delete4 = add_database_entry("Martin Zoom", 12, "1.png", "m1m1",
+                                      "2.png", "e2e2", 86,
                                       "2020-03-09 11:00:36")
-expected_vals4 = ("Martin Zoom", 12, ["1.png", "3.png"], ["m1", "m3"],
-                  ["2.png"], ["e2"], [86], ["2020-03-09 11:00:36"])
+expected_vals4 = ("Martin Zoom", 12, ["1.png", "3.png"], ["m1m1", "m3m3"],
+                  ["2.png"], ["e2e2"], [86], ["2020-03-09 11:00:36"])
 
 
 @pytest.mark.parametrize("entry, patient_name, id_no, medical_file,"
                          "medical_b64, ecg_file, ecg_b64, bpm, timestamp,"
                          "expected",
                          [(entry_to_delete1, "Max Silver", 9,
-                           "3.png", "m3", "4.png", "e4", 90,
+                           "3.png", "m3m3", "4.png", "e4e4", 90,
                            "2021-04-10 12:11:59", expected_vals1),
                           (entry_to_delete2, "Maria Lopez", 10,
-                           "3.png", "m3", "4.png", "e4", 90,
+                           "3.png", "m3m3", "4.png", "e4e4", 90,
                            "2021-04-10 12:11:59", expected_vals2),
                           (entry_to_delete3, "Martha Ball", 11,
-                           "", "", "4.png", "e4", 90, "2021-04-10 12:11:59",
+                           "", "", "4.png", "e4e4", 90, "2021-04-10 12:11:59",
                            expected_vals3),
                           (entry_to_delete4, "Martin Zoom", 12,
-                           "3.png", "m3", "", "", "",  "",
+                           "3.png", "m3m3", "", "", "",  "",
                            expected_vals4)])
 def test_add_patient_file(entry, patient_name, id_no, medical_file,
                           medical_b64, ecg_file, ecg_b64, bpm,
                           timestamp, expected):
-    from cloud_server import add_patient_file
+    from cloud_server import add_patient_file, load_images_b64
     answer = add_patient_file(str(patient_name), id_no, medical_file,
                               medical_b64, ecg_file, ecg_b64, bpm, timestamp)
     entry.delete()
     assert (answer.name, answer.medical_record_number,
-            answer.medical_images, answer.medical_images_b64,
-            answer.ecg_images, answer.ecg_images_b64,
+            answer.medical_images, load_images_b64(answer.medical_image_ids),
+            answer.ecg_images, load_images_b64(answer.ecg_image_ids),
             answer.heart_rates, answer.datetimes) == expected
 
 
+def test_add_hrv():
+    from cloud_server import add_patient_file
+    hrv = {"sdnn": 41.2, "rmssd": 30.5, "rr": "IAPoAw=="}
+    entry = add_database_entry("Yume Choi", 5, "1.png", "abc12345", "2.png",
+                               "def45678", 86, "2020-03-09 11:00:36")
+    answer = add_patient_file("", 5, "", "", "4.png", "def45678", 90,
+                              "2021-04-10 12:11:59", hrv)
+    entry.delete()
+    assert answer.hrv == [{}, hrv]
+
+
 def test_patient_name_change():
     from cloud_server import add_database_entry
     from cloud_server import add_patient_file
     with LogCapture() as log_c:
-        entry_to_delete = add_database_entry("Yume Choi", 3, "1.png", "abc123",
-                                             "2.png", "def456", 86,
-                                             "2020-03-09 11:00:36")
-        add_patient_file("Youme Choi", 3, "3.png", "abc123", "4.png", "abc123",
-                         90, "2021-04-10 12:11:59")
+        entry_to_delete = add_database_entry("Yume Choi", 3, "1.png",
+                                             "abc12345", "2.png", "def45678",
+                                             86, "2020-03-09 11:00:36")
+        add_patient_file("Youme Choi", 3, "3.png", "abc12345", "4.png",
+                         "abc12345", 90, "2021-04-10 12:11:59")
         entry_to_delete.delete()
     log_c.check(('root', 'INFO', 'Added new patient into database with id: 3'),
                 ('root', 'WARNING', 'Entered patient name does not match '
@@ -248,12 +283,12 @@ def test_patient_name_change():
 def test_list_record_numbers():
     from cloud_server import list_record_numbers
     from cloud_server import add_database_entry
-    entry = add_database_entry("Yume Choi", 3, "1.png", "m1", "2.png", "e2",
-                               86, "2020-03-09 11:00:36")
-    entry_2 = add_database_entry("Michael Tian", 5, "1.png", "m1", "2.png",
-                                 "e2", 86, "2020-03-09 11:00:36")
-    entry_3 = add_database_entry("Phoebe Dij", 11, "1.png", "m1", "2.png",
-                                 "e2", 86, "2020-03-09 11:00:36")
+    entry = add_database_entry("Yume Choi", 3, "1.png", "m1m1", "2.png",
+                               "e2e2", 86, "2020-03-09 11:00:36")
+    entry_2 = add_database_entry("Michael Tian", 5, "1.png", "m1m1", "2.png",
+                                 "e2e2", 86, "2020-03-09 11:00:36")
+    entry_3 = add_database_entry("Phoebe Dij", 11, "1.png", "m1m1", "2.png",
+                                 "e2e2", 86, "2020-03-09 11:00:36")
     answer = list_record_numbers()
     entry.delete()
     entry_2.delete()
@@ -262,24 +297,248 @@ def test_list_record_numbers():
     assert answer == expected
 
 
+def test_record_numbers_cached(monkeypatch):
+    import cloud_server
+    from cloud_server import list_record_numbers, invalidate_record_numbers
+    collection = Patient._mongometa.collection
+    entry = add_database_entry("Yume Choi", 3, "1.png", "m1m1", "2.png",
+                               "e2e2", 86, "2020-03-09 11:00:36")
+    first = list_record_numbers()
+    collection.insert_one({"_id": 14, "name": "Max Silver"})
+    cached = list_record_numbers()
+    invalidate_record_numbers()
+    fresh = list_record_numbers()
+    collection.delete_one({"_id": 14})
+    monkeypatch.setattr(cloud_server, "RECORD_NUMBER_TTL", 0)
+    expired = list_record_numbers()
+    entry.delete()
+    invalidate_record_numbers()
+    assert 3 in first
+    assert cached == first
+    assert 14 in fresh
+    assert 14 not in expired
+
+
 expected_info = {"name": "Yume Choi",
                  "medical_record_number": 3,
-                 "medical_images": "acl1.png",
-                 "medical_images_b64": "123",
-                 "ecg_images": "ecg1.png",
-                 "ecg_images_b64": "456",
-                 "heart_rates": 85,
-                 "datetimes": "2020-03-00 11:00:36"}
+                 "medical_images": ["acl1.png"],
+                 "medical_images_b64": ["1234"],
+                 "ecg_images": ["ecg1.png"],
+                 "ecg_images_b64": ["4567"],
+                 "heart_rates": [85],
+                 "datetimes": ["2020-03-00 11:00:36"],
+                 "hrv": [{}]}
 
 
 def test_retrieve_all_info():
     from cloud_server import retrieve_all_info
-    b64_images = ["123", "456", "789"]
-    patient1 = Patient("Yume Choi", 3, "acl1.png", b64_images[0], "ecg1.png",
-                       b64_images[1], 85, "2020-03-00 11:00:36")
-    patient1.save()
+    b64_images = ["1234", "4567", "7890"]
+    patient1 = add_database_entry("Yume Choi", 3, "acl1.png", b64_images[0],
+                                  "ecg1.png", b64_images[1], 85,
+                                  "2020-03-00 11:00:36")
 
     answer = retrieve_all_info(3)
     patient1.delete()
+    image_ids = answer.pop("medical_image_ids") + \
+        answer.pop("ecg_image_ids")
     expected = expected_info
     assert answer == expected
+    assert [len(image_id) for image_id in image_ids] == [24, 24]
+
+
+def test_get_image():
+    from cloud_server import app, store_image
+    with open("images/acl1.jpg", "rb") as f:
+        data = f.read()
+    image_id = store_image(4, "medical", "acl1.jpg", data)
+    client = app.test_client()
+    answer = client.get("/api/images/{}".format(image_id))
+    missing = client.get("/api/images/{}".format("0" * 24))
+    invalid = client.get("/api/images/abc")
+    Image.objects.raw({"_id": image_id}).delete()
+    assert answer.status_code == 200
+    assert answer.mimetype == "image/jpeg"
+    assert answer.data == data
+    assert missing.status_code == invalid.status_code == 404
+
+
+def test_get_summary():
+    from cloud_server import app, add_patient_file, retrieve_all_info
+    entry = add_database_entry("Yume Choi", 5, "1.png", "abc12345", "2.png",
+                               "def45678", 86, "2020-03-09 11:00:36")
+    add_patient_file("", 5, "", "", "4.png", "ghi78901", 90,
+                     "2021-04-10 12:11:59")
+    client = app.test_client()
+    answer = client.get("/api/summary/5")
+    info = retrieve_all_info(5)
+    missing = client.get("/api/summary/404")
+    entry.delete()
+    Image.objects.raw({"medical_record_number": 5}).delete()
+    summary = answer.get_json()
+    assert summary["num_medical_images"] == 1
+    assert summary["num_ecg_images"] == 2
+    assert "ecg_images_b64" not in summary
+    for key in ["name", "medical_images", "medical_image_ids", "ecg_images",
+                "ecg_image_ids", "heart_rates", "datetimes", "hrv"]:
+        assert summary[key] == info[key]
+    assert missing.status_code == 404
+
+
+@pytest.mark.parametrize("kind, index, expected",
+                         [("ecg", 0, "def45678"),
+                          ("ecg", 1, "ghi78901"),
+                          ("ecg", -1, "ghi78901"),
+                          ("ecg", -2, "def45678"),
+                          ("medical", 0, "abc12345"),
+                          ("medical", -1, "abc12345"),
+                          ("ecg", 2, None),
+                          ("ecg", -3, None),
+                          ("medical", 1, None),
+                          ("xray", 0, None)])
+def test_get_patient_image(kind, index, expected):
+    from cloud_server import app, add_patient_file
+    entry = add_database_entry("Yume Choi", 5, "1.png", "abc12345", "2.png",
+                               "def45678", 86, "2020-03-09 11:00:36")
+    add_patient_file("", 5, "", "", "4.png", "ghi78901", 90,
+                     "2021-04-10 12:11:59")
+    client = app.test_client()
+    answer = client.get("/api/images/5/{}/{}".format(kind, index))
+    entry.delete()
+    Image.objects.raw({"medical_record_number": 5}).delete()
+    if expected is None:
+        assert answer.status_code == 404
+    else:
+        assert answer.status_code == 200
+        assert answer.data == base64.b64decode(expected)
+
+
+def test_images_stored_separately():
+    from cloud_server import add_patient_file
+    entry = add_database_entry("Yume Choi", 5, "1.png", "abc12345", "2.png",
+                               "def45678", 86, "2020-03-09 11:00:36")
+    add_patient_file("", 5, "3.png", "ghi78901", "", "", "", "")
+    document = Patient._mongometa.collection.find_one({"_id": 5})
+    images = list(Image.objects.raw({"medical_record_number": 5}))
+    entry.delete()
+    for image in images:
+        image.delete()
+    assert "abc12345" not in str(document)
+    assert len(document["medical_image_ids"]) == 2
+    assert sorted(bytes(image.data) for image in images) == [
+        base64.b64decode(b64) for b64 in ["abc12345", "def45678",
+                                          "ghi78901"]]
+    assert [image.size for image in images] == [6, 6, 6]
+
+
+def test_store_image_as_bytes():
+    from cloud_server import store_image, load_images, load_images_b64
+    with open("images/acl1.jpg", "rb") as f:
+        data = f.read()
+    b64 = base64.b64encode(data).decode("utf-8")
+    image_id = store_image(4, "medical", "acl1.jpg", b64)
+    document = Image._mongometa.collection.find_one({"_id": image_id})
+    images = load_images([image_id])
+    images_b64 = load_images_b64([image_id])
+    Image.objects.raw({"_id": image_id}).delete()
+    assert bytes(document["data"]) == data
+    assert document["content_type"] == "image/jpeg"
+    assert document["size"] == len(data)
+    assert "b64" not in document
+    assert images == [data]
+    assert images_b64 == [b64]
+
+
+def test_new_or_old_rejects_bad_b64():
+    from cloud_server import new_or_old
+    in_data = {"patient_name": "Yume Choi",
+               "record_number": 6,
+               "medical_image_files": "y1.png",
+               "medical_images_b64": "not b64!",
+               "ECG_image_files": "",
+               "ECG_images_b64": "",
+               "heartrates": "",
+               "datetimes": ""}
+    answer = new_or_old(in_data)
+    assert answer == ("The value corresponding to the key medical_images_b64"
+                      " is not a valid b64 string.", 400)
+
+
+def test_migrate_images():
+    from cloud_server import migrate_images, retrieve_all_info
+    collection = Patient._mongometa.collection
+    collection.insert_one({"_id": 8, "_cls": "database_definitions.Patient",
+                           "name": "Max Silver",
+                           "medical_images": ["1.png"],
+                           "medical_images_b64": ["m1m1"],
+                           "ecg_images": ["2.png", "4.png"],
+                           "ecg_images_b64": ["e2e2", "e4e4"],
+                           "heart_rates": [86, 90],
+                           "datetimes": ["2020-03-09 11:00:36",
+                                         "2021-04-10 12:11:59"]})
+    collection.insert_one({"_id": 7, "name": "Ann Lee",
+                           "ecg_images": ["3.png"],
+                           "ecg_images_b64": ["e3e3"],
+                           "heart_rates": [70],
+                           "datetimes": ["2020-03-09 11:00:36"]})
+    old_image = Image._mongometa.collection.insert_one(
+        {"medical_record_number": 8, "kind": "ecg", "filename": "6.png",
+         "b64": "e6e6"}).inserted_id
+    migrated = migrate_images()
+    document = collection.find_one({"_id": 8})
+    image = Image._mongometa.collection.find_one({"_id": old_image})
+    answer = retrieve_all_info(8)
+    answer_without_cls = retrieve_all_info(7)
+    again = migrate_images()
+    collection.delete_many({"_id": {"$in": [7, 8]}})
+    Image.objects.raw({"medical_record_number": {"$in": [7, 8]}}).delete()
+    assert migrated >= 3
+    assert again == 0
+    assert "b64" not in image
+    assert image["data"] == base64.b64decode("e6e6")
+    assert image["size"] == 3
+    assert "medical_images_b64" not in document
+    assert "ecg_images_b64" not in document
+    assert answer["medical_images_b64"] == ["m1m1"]
+    assert answer["ecg_images_b64"] == ["e2e2", "e4e4"]
+    assert answer_without_cls["ecg_images_b64"] == ["e3e3"]
+
+
+def test_new_or_old_parallel_uploads():
+    from cloud_server import new_or_old, find_patient
+    from concurrent.futures import ThreadPoolExecutor
+    uploads = [{"patient_name": "Yume Choi",
+                "record_number": 15,
+                "medical_image_files": "",
+                "medical_images_b64": "",
+                "ECG_image_files": "{}.png".format(i),
+                "ECG_images_b64": "def45678",
+                "heartrates": 60 + i,
+                "datetimes": "2021-10-06 11:11:40"} for i in range(20)]
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        answers = list(pool.map(new_or_old, uploads))
+    patient = find_patient(15)
+    patient.delete()
+    Image.objects.raw({"medical_record_number": 15}).delete()
+    assert answers.count("Added patient 15") == 1
+    assert answers.count("Updated patient 15") == 19
+    assert sorted(patient.heart_rates) == list(range(60, 80))
+    assert sorted(patient.ecg_images) == sorted(u["ECG_image_files"]
+                                                for u in uploads)
+    assert len(patient.ecg_image_ids) == 20
+    assert len(patient.hrv) == 20
+
+
+def test_upsert_patient_failure_removes_images(monkeypatch):
+    from cloud_server import upsert_patient
+    from pymongo.errors import ConnectionFailure
+
+    def fail(*args, **kwargs):
+        raise ConnectionFailure("Lost connection")
+    monkeypatch.setattr(type(Patient._mongometa.collection),
+                        "find_one_and_update", fail)
+    with pytest.raises(ConnectionFailure):
+        upsert_patient("Yume Choi", 16, "1.png", "abc12345", "2.png",
+                       "def45678", 86, "2020-03-09 11:00:36")
+    monkeypatch.undo()
+    images = Image._mongometa.collection
+    assert images.count_documents({"medical_record_number": 16}) == 0
@@ -59,6 +59,37 @@ def test_read(filename):
     log_c.check()
 
 
+@pytest.mark.parametrize("filename, expected", [
+                         ("test_data/test_normal.csv", (t_normal, v_normal)),
+                         ("test_data/test_missingt.csv",
+                          (t_missingt, v_missingt)),
+                         ("test_data/test_nant.csv", (t_nant, v_nant)),
+                         ("test_data/test_missingv.csv",
+                          (t_missingv, v_missingv)),
+                         ("test_data/test_nanv.csv", (t_nanv, v_nanv))
+                         ])
+def test_read_arrays(filename, expected):
+    from ecg_analysis import read
+    time, voltage = read(filename)
+    assert time.flags["C_CONTIGUOUS"] and voltage.flags["C_CONTIGUOUS"]
+    assert (time.tolist(), voltage.tolist()) == expected
+
+
+@pytest.mark.parametrize("filename, expected", [
+                         ("test_data/test_nanv.csv",
+                          "Missing data in 1 of 6 rows"),
+                         ("test_data/test_data11.csv",
+                          "Missing data in 2 of 10000 rows"),
+                         ("test_data/test_data31.csv",
+                          "Missing data in 4 of 10000 rows")
+                         ])
+def test_read_bad_row_count(filename, expected):
+    from ecg_analysis import read
+    with LogCapture() as log_c:
+        read(filename)
+    log_c.check(("root", "ERROR", expected))
+
+
 time_clean, voltage_clean = read("test_data/raw_data1.csv")
 time_noise, voltage_noise = read("test_data/test_data1.csv")
 
@@ -167,3 +198,344 @@ def test_bpm_calc(duration, num_beats, expected):
     from ecg_analysis import bpm_calc
     answer = bpm_calc(duration, num_beats)
     assert answer == expected
+
+
+@pytest.mark.parametrize("voltage, expected", [
+                         (v_300, True), (v_normal, False)
+                         ])
+def test_exceptions_flag(voltage, expected):
+    from ecg_analysis import exceptions
+    answer = exceptions(voltage)
+    assert answer == expected
+
+
+def test_analyze():
+    from ecg_analysis import analyze
+    answer = analyze("test_data/test_data1.csv")
+    assert answer.time_peaks == time_peaks
+    assert answer.duration == 27.775
+    assert answer.bpm == 73
+    assert answer.heart_rate() == "73"
+    assert answer.out_of_range is False
+    assert len(answer.time) == len(answer.voltage) == 10000
+
+
+@pytest.mark.parametrize("filename, expected", [
+                         ("test_data/test_data1.csv", "73"),
+                         ("test_data/test_data32.csv", "82")
+                         ])
+def test_overall_rate(filename, expected):
+    from ecg_analysis import overall_rate
+    answer = overall_rate(filename)
+    assert answer == expected
+
+
+def test_signal_stats():
+    import numpy as np
+    from ecg_analysis import signal_stats
+    voltage = np.array([0, 1, 400, 500, 2, 2, 2, 2, -350, 3], dtype=float)
+    answer = signal_stats(voltage, min_flat_run=3, min_saturation_run=1)
+    assert answer["min"] == -350
+    assert answer["max"] == 500
+    assert answer["mean"] == pytest.approx(56.2)
+    assert answer["rms"] == pytest.approx(np.sqrt(np.mean(voltage ** 2)))
+    assert answer["out_of_range_count"] == 3
+    assert answer["out_of_range_fraction"] == pytest.approx(0.3)
+    assert answer["out_of_range_ranges"] == [[2, 4], [8, 9]]
+    assert answer["flat_runs"] == [[4, 8]]
+    assert answer["saturation_runs"] == [[3, 4], [8, 9]]
+
+
+def test_analyze_stats():
+    from ecg_analysis import analyze
+    answer = analyze("test_data/test_data32.csv")
+    assert answer.out_of_range is True
+    assert answer.extremes == (answer.stats["min"], answer.stats["max"])
+    assert answer.stats["out_of_range_count"] == 494
+    assert answer.stats["out_of_range_ranges"][0][0] > 0
+
+
+def test_summarize():
+    from ecg_analysis import summarize
+    answer = summarize("test_data/test_data11.csv")
+    assert answer["bpm"] == 69
+    assert answer["warnings"] == "Missing data in 2 of 10000 rows"
+    assert answer["error"] == ""
+
+
+def test_summarize_records_error():
+    from ecg_analysis import summarize
+    answer = summarize("test_data/test_normal.csv")
+    assert answer["bpm"] == ""
+    assert answer["error"].startswith("ValueError")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_analyze(workers):
+    from ecg_analysis import batch_analyze
+    filenames = ["test_data/test_data1.csv", "test_data/test_data32.csv",
+                 "test_data/test_data11.csv"]
+    answer = batch_analyze(filenames, workers=workers)
+    assert [row["filename"] for row in answer] == filenames
+    assert [row["bpm"] for row in answer] == [73, 82, 69]
+    assert answer[1]["warnings"] == ("Voltage exceeded normal range in 494 "
+                                     "samples (4.9%) from 0.029 s to "
+                                     "13.596 s")
+    assert answer[1]["out_of_range_fraction"] == pytest.approx(0.0494)
+
+
+@pytest.mark.parametrize("output", ["summary.csv", "summary.jsonl"])
+def test_main_batch(tmp_path, output):
+    import json
+    import csv
+    from ecg_analysis import main
+    out_file = str(tmp_path / output)
+    main(["batch", "test_data", "--workers", "2", "--output", out_file])
+    with open(out_file) as f:
+        if output.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f]
+        else:
+            rows = list(csv.DictReader(f))
+    assert len(rows) == 22
+    assert str(rows[1]["bpm"]) == "73"
+
+
+@pytest.mark.parametrize("filename", [
+                         ("test_data/test_data1.csv"),
+                         ("test_data/test_data31.csv"),
+                         ("test_data/raw_data1.csv")
+                         ])
+def test_read_chunks(filename):
+    import numpy as np
+    from ecg_analysis import read, read_chunks
+    time, voltage = read(filename)
+    chunks = list(read_chunks(filename, chunk_size=999))
+    assert np.concatenate([t for t, v in chunks]).tolist() == time.tolist()
+    assert np.concatenate([v for t, v in chunks]).tolist() == voltage.tolist()
+
+
+def test_analyze_windows():
+    from ecg_analysis import analyze_windows
+    answer = analyze_windows("test_data/test_data1.csv", window=10,
+                             chunk_size=1000)
+    assert answer["start"].tolist() == [0, 10, 20]
+    assert answer["end"].tolist() == [10, 20, 27.775]
+    assert answer["num_beats"].sum() == 34
+    assert answer["bpm"].tolist() == [78, 72, 69]
+    assert not answer["out_of_range"].any()
+
+
+def test_analyze_windows_overlap():
+    from ecg_analysis import analyze_windows
+    answer = analyze_windows("test_data/test_data32.csv", window=6, step=3)
+    assert answer["start"].tolist() == [0, 3, 6, 9]
+    assert answer["out_of_range"].any()
+    assert (answer["max_voltage"] > 300).tolist() == \
+        answer["out_of_range"].tolist()
+
+
+def test_analyze_windows_bounded_memory(tmp_path):
+    import tracemalloc
+    from ecg_analysis import analyze_windows
+    from ecg_benchmark import write_synthetic_csv
+    peaks = []
+    for minutes in [2, 20]:
+        filename = str(tmp_path / "{}.csv".format(minutes))
+        write_synthetic_csv(filename, minutes * 60)
+        tracemalloc.start()
+        answer = analyze_windows(filename, window=30, chunk_size=2000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert set(answer["bpm"].tolist()) == {72}
+    assert peaks[1] < peaks[0] * 1.5
+
+
+def _write_gap(filename, gap_start, gap_end, duration=600):
+    from ecg_synth import write_csv
+    write_csv(filename, duration, hrv=0)
+    with open(filename) as f:
+        lines = [line for line in f
+                 if not gap_start <= float(line.split(",")[0]) < gap_end]
+    with open(filename, "w") as f:
+        f.writelines(lines)
+
+
+@pytest.mark.parametrize("window", [60, 45, 37])
+def test_analyze_windows_long_gap(tmp_path, window):
+    import numpy as np
+    from ecg_analysis import analyze_windows
+    filename = str(tmp_path / "gap.csv")
+    _write_gap(filename, 200, 300)
+    answer = analyze_windows(filename, window=window)
+    empty = (answer["start"] >= 200) & (answer["end"] <= 300)
+    assert empty.any()
+    assert np.isnan(answer["bpm"][empty]).all()
+    assert (answer["num_beats"][empty] == 0).all()
+    assert answer["end"][-1] > 600 - window
+
+
+@pytest.mark.parametrize("gap_start, gap_end", [(130, 175), (90, 152)])
+def test_analyze_windows_gap_heart_rate(tmp_path, gap_start, gap_end):
+    from ecg_analysis import analyze_windows
+    filename = str(tmp_path / "gap.csv")
+    _write_gap(filename, gap_start, gap_end)
+    answer = analyze_windows(filename, window=60)
+    assert set(answer["bpm"].tolist()) <= {71, 72, 73}
+    assert answer["gap"].tolist() == [
+        start < gap_end and end > gap_start
+        for start, end in zip(answer["start"], answer["end"])]
+    missing = answer["end"] - answer["start"] - answer["covered"]
+    assert missing[answer["gap"]].sum() == pytest.approx(
+        gap_end - gap_start, abs=0.1)
+
+
+def _write_leads(filename, header):
+    import numpy as np
+    from ecg_analysis import read
+    time, voltage = read("test_data/test_data1.csv")
+    leads = np.column_stack((time, voltage, -0.5 * voltage, 2 * voltage))
+    leads[10, 2] = np.nan
+    np.savetxt(filename, leads, delimiter=",", fmt="%.5f", header=header,
+               comments="")
+
+
+@pytest.mark.parametrize("header, expected", [
+                         ("time,I,II,III", ["I", "II", "III"]),
+                         ("", ["lead 1", "lead 2", "lead 3"])
+                         ])
+def test_read_leads(tmp_path, header, expected):
+    from ecg_analysis import read_leads
+    filename = str(tmp_path / "leads.csv")
+    _write_leads(filename, header)
+    with LogCapture() as log_c:
+        time, voltage, names = read_leads(filename)
+    log_c.check(("root", "ERROR", "Missing data in 1 of 10000 rows"))
+    assert voltage.shape == (9999, 3)
+    assert names == expected
+
+
+def test_analyze_leads(tmp_path):
+    from ecg_analysis import analyze_leads
+    filename = str(tmp_path / "leads.csv")
+    _write_leads(filename, "time,I,II,III")
+    answer = analyze_leads(filename)
+    assert answer.voltage.shape == (10000, 3)
+    assert len(answer.leads[0].sampling["gaps"]) == 1
+    assert answer.heart_rates() == {"I": 73, "II": 73, "III": 73}
+    assert answer.combined.bpm == 73
+    assert answer.leads[2].extremes == (-4.16, 4.616)
+    assert answer.leads[1].extremes[1] == 1.04
+
+
+def test_filter_leads_in_one_call():
+    import numpy as np
+    from ecg_analysis import filter
+    time = time_data1
+    stacked = np.column_stack((voltage_data1, 3 * np.asarray(voltage_data1)))
+    answer = filter(time, stacked)
+    assert np.allclose(answer[:, 0], filter(time, voltage_data1))
+    assert np.allclose(answer[:, 1], 3 * answer[:, 0])
+
+
+def test_analyze_pan_tompkins():
+    from ecg_analysis import analyze
+    answer = analyze("test_data/test_data1.csv", detector="pan_tompkins")
+    assert answer.bpm == 73
+
+
+def test_analyze_fills_dropped_rows():
+    from ecg_analysis import analyze
+    answer = analyze("test_data/test_data11.csv")
+    assert answer.sampling["rate"] == pytest.approx(360, abs=0.01)
+    assert len(answer.time) == 10000
+    assert [gap[2] for gap in answer.sampling["gaps"]] == [True, True]
+    assert answer.bpm == 69
+
+
+def test_warm_up():
+    import sys
+    from ecg_analysis import start_warm_up, HEAVY_MODULES
+    thread = start_warm_up()
+    thread.join(timeout=60)
+    assert not thread.is_alive()
+    assert all(name in sys.modules for name in HEAVY_MODULES)
+
+
+def test_preview():
+    from ecg_analysis import preview
+    answer = preview("test_data/test_data1.csv", seconds=10,
+                     chunk_size=1000)
+    assert answer.provisional is True
+    assert answer.time[-1] - answer.time[0] == pytest.approx(10, abs=0.01)
+    assert 60 < answer.bpm < 90
+    whole = preview("test_data/test_data1.csv", seconds=60)
+    assert whole.provisional is False
+    assert whole.bpm == 73
+
+
+def test_analyze_target_rate(tmp_path):
+    from ecg_analysis import analyze
+    from ecg_benchmark import write_synthetic_csv
+    filename = str(tmp_path / "fast.csv")
+    write_synthetic_csv(filename, 30, sampling_rate=1000, bpm=72)
+    full = analyze(filename)
+    answer = analyze(filename, target_rate=250)
+    assert answer.sampling["rate"] == pytest.approx(250)
+    assert answer.sampling["decimation"] == 4
+    assert answer.sampling["original_rate"] == pytest.approx(1000)
+    assert len(answer.time) == 7500
+    assert answer.bpm == full.bpm == 72
+    import numpy as np
+    assert np.allclose(answer.time_peaks, full.time_peaks, atol=1e-3)
+
+
+def test_rr_intervals_skip_split_gaps():
+    from ecg_analysis import rr_intervals
+    import numpy as np
+    sampling = {"gaps": [[2.1, 2.3, True], [4.2, 9.0, False]]}
+    answer = rr_intervals([1.0, 2.0, 3.0, 4.0, 9.5, 10.5], sampling)
+    assert np.allclose(answer, [1.0, 1.0, 1.0, 1.0])
+    assert np.allclose(rr_intervals([1.0, 2.0, 3.5]), [1.0, 1.5])
+
+
+@pytest.mark.parametrize("rr, expected", [
+    ([0.8, 0.9, 0.8, 1.0],
+     {"mean_hr": 68.571, "min_hr": 60, "max_hr": 75, "sdnn": 95.743,
+      "rmssd": 141.421, "pnn50": 100, "num_intervals": 4}),
+    ([1.0, 1.02, 1.0],
+     {"mean_hr": 59.603, "min_hr": 58.824, "max_hr": 60, "sdnn": 11.547,
+      "rmssd": 20, "pnn50": 0, "num_intervals": 3}),
+    ([0.5],
+     {"mean_hr": 120, "min_hr": 120, "max_hr": 120, "sdnn": None,
+      "rmssd": None, "pnn50": None, "num_intervals": 1}),
+])
+def test_hrv_metrics(rr, expected):
+    from ecg_analysis import hrv_metrics
+    answer = hrv_metrics(rr)
+    assert answer == pytest.approx(expected, abs=1e-3)
+
+
+def test_encode_rr():
+    from ecg_analysis import encode_rr, decode_rr
+    import numpy as np
+    rr = np.array([0.8123, 1.2, 0.45])
+    encoded = encode_rr(rr)
+    assert len(encoded) == 8
+    assert np.allclose(decode_rr(encoded), [0.812, 1.2, 0.45])
+
+
+def test_analyze_hrv(tmp_path):
+    from ecg_analysis import analyze, hrv_metrics
+    from ecg_synth import write_csv, read_beats
+    import numpy as np
+    filename = str(tmp_path / "variable.csv")
+    beats_filename = str(tmp_path / "beats.txt")
+    write_csv(filename, 120, beats_filename=beats_filename, bpm=70,
+              hrv=0.08, seed=5)
+    expected = hrv_metrics(np.diff(read_beats(beats_filename)))
+    answer = analyze(filename)
+    assert np.allclose(answer.instant_hr, 60 / answer.rr)
+    assert answer.hrv["num_intervals"] == expected["num_intervals"]
+    for field in ("mean_hr", "min_hr", "max_hr", "sdnn"):
+        assert answer.hrv[field] == pytest.approx(expected[field], rel=0.02)
+    assert answer.hrv["rmssd"] == pytest.approx(expected["rmssd"], rel=0.1)
@@ -0,0 +1,128 @@
+# test_ecg_benchmark.py
+
+import pytest
+
+
+@pytest.mark.parametrize("filename", [
+                         ("test_data/test_data1.csv"),
+                         ("test_data/test_data31.csv")
+                         ])
+def test_read_throughput(filename):
+    from ecg_benchmark import read_throughput
+    answer = read_throughput(filename, repeats=2)
+    assert answer > 0
+
+
+def test_filter_benchmark():
+    from ecg_benchmark import filter_benchmark
+    answer = filter_benchmark(["test_data/test_data1.csv"], repeats=1)
+    assert answer[0]["max_difference"] < 1e-3
+    assert answer[-1]["filename"] == "1 strips at 360.0 Hz"
+
+
+def test_write_synthetic_csv(tmp_path):
+    from ecg_benchmark import write_synthetic_csv
+    from ecg_analysis import overall_rate, read
+    filename = str(tmp_path / "synthetic.csv")
+    write_synthetic_csv(filename, 60, sampling_rate=250, bpm=72,
+                        chunk_seconds=7)
+    time, voltage = read(filename)
+    assert len(time) == 15000
+    assert overall_rate(filename) == "72"
+
+
+def test_run_suite_and_compare(tmp_path):
+    import copy
+    from ecg_benchmark import run_suite, compare, STAGES
+    report = run_suite(["test_data/test_data1.csv"], repeats=1)
+    assert [r["stage"] for r in report["results"]] == STAGES
+    assert all(r["peak_bytes"] > 0 for r in report["results"]
+               if r["stage"] != "bpm_calc")
+    assert compare(report, report) == []
+    faster = copy.deepcopy(report)
+    faster["results"][0]["seconds"] /= 10
+    answer = compare(report, faster)
+    assert len(answer) == 1
+    assert answer[0].startswith("test_data1.csv read")
+
+
+def test_main_fails_on_regression(tmp_path):
+    import json
+    from ecg_benchmark import main
+    output = str(tmp_path / "results.json")
+    args = ["suite", "--lengths", "", "--repeats", "1", "--output", output]
+    assert main(args) == 0
+    with open(output) as f:
+        baseline = json.load(f)
+    for result in baseline["results"]:
+        result["seconds"] = 1e-9
+    with open(output, "w") as f:
+        json.dump(baseline, f)
+    assert main(["suite", "--lengths", "", "--repeats", "1",
+                 "--baseline", output]) == 1
+
+
+def test_detector_benchmark():
+    from ecg_benchmark import detector_benchmark
+    answer = detector_benchmark(["test_data/test_data1.csv"], repeats=1)
+    detectors = [row["detector"] for row in answer]
+    assert detectors == ["find_peaks", "pan_tompkins"]
+    assert answer[0]["agreement"] == 1.0
+    assert answer[1]["agreement"] > 0.95
+
+
+def test_matched_beats():
+    from ecg_benchmark import matched_beats
+    answer = matched_beats([1.0, 2.0, 3.0], [1.05, 2.5, 2.95, 3.0], 0.1)
+    assert answer == 2
+
+
+def test_import_costs():
+    from ecg_benchmark import import_costs
+    answer = import_costs(["ecg_analysis", "scipy.signal", "patient_GUI"],
+                          repeats=1)
+    assert [row["module"] for row in answer] == ["ecg_analysis",
+                                                 "scipy.signal",
+                                                 "patient_GUI"]
+    assert answer[0]["loads_scipy"] is False
+    assert answer[0]["loads_matplotlib"] is False
+    assert answer[0]["loads_pil"] is False
+    assert answer[1]["loads_scipy"] is True
+    assert not any(answer[2][key] for key in ["loads_scipy",
+                                              "loads_matplotlib",
+                                              "loads_pil", "loads_requests"])
+    assert all(row["seconds"] > 0 for row in answer)
+
+
+def test_decimation_benchmark(tmp_path):
+    from ecg_benchmark import decimation_benchmark, write_synthetic_csv
+    filename = str(tmp_path / "fast.csv")
+    write_synthetic_csv(filename, 20, sampling_rate=2000)
+    answer = decimation_benchmark([filename], 250, repeats=1)
+    assert answer[0]["decimated_rate"] == pytest.approx(250)
+    assert answer[0]["full_bpm"] == answer[0]["decimated_bpm"]
+    assert answer[0]["matched"] == 24
+    assert answer[0]["max_shift"] < 1e-3
+
+
+def test_image_storage_benchmark():
+    pytest.importorskip("mongomock")
+    from ecg_benchmark import patient_images, image_storage_benchmark
+    images = patient_images(["images/acl1.jpg"],
+                            ["test_data/test_data1.csv"], uploads=3)
+    assert [kind for kind, _, _ in images] == ["medical", "ecg"] * 3
+    answer = image_storage_benchmark(images, repeats=1)
+    assert answer["images"] == 6
+    assert answer["binary_bytes"] < answer["raw_bytes"] * 1.01
+    assert answer["b64_bytes"] > answer["raw_bytes"] * 4 / 3
+
+
+def test_patient_view_benchmark():
+    pytest.importorskip("mongomock")
+    from ecg_benchmark import patient_images, patient_view_benchmark
+    images = patient_images(["images/acl1.jpg"],
+                            ["test_data/test_data1.csv"], uploads=4)
+    answer = patient_view_benchmark(images, [{"sdnn": 41.2}], repeats=1)
+    assert answer["uploads"] == 4
+    assert answer["summary_bytes"] < answer["image_bytes"]
+    assert answer["get_info_bytes"] > 8 * answer["image_bytes"]
@@ -0,0 +1,106 @@
+# test_ecg_binary.py
+
+import pytest
+import numpy as np
+
+rate = 360.0
+time = np.arange(2000) / rate
+voltage = np.sin(2 * np.pi * 1.2 * time)
+
+
+@pytest.mark.parametrize("keep, layout", [
+    (slice(None), "uniform"),
+    (np.arange(2000) % 100 != 7, "slots"),
+])
+def test_write_load_grid(tmp_path, keep, layout):
+    from ecg_binary import write, load
+    filename = str(tmp_path / "strip.ecgb")
+    header = write(filename, np.round(time[keep], 3), voltage[keep])
+    assert header["layout"] == layout
+    assert header["sampling_rate"] == pytest.approx(rate, rel=1e-3)
+    answer_time, answer_voltage, header = load(filename)
+    assert isinstance(answer_voltage, np.memmap)
+    assert answer_voltage.dtype == np.float32
+    assert answer_voltage.shape == (len(time[keep]), 1)
+    assert np.allclose(answer_time, time[keep], atol=1e-3)
+    assert np.allclose(answer_voltage[:, 0], voltage[keep], atol=1e-6)
+
+
+@pytest.mark.parametrize("keep", [slice(None), np.arange(2000) % 100 != 7])
+def test_time_axis_is_lazy(tmp_path, keep):
+    import tracemalloc
+    from ecg_binary import write, load, TimeAxis
+    filename = str(tmp_path / "strip.ecgb")
+    write(filename, time[keep], voltage[keep])
+    tracemalloc.start()
+    answer_time, answer_voltage, header = load(filename)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert isinstance(answer_time, TimeAxis)
+    assert peak < 8 * len(answer_time)
+    expected = time[keep]
+    assert len(answer_time) == len(expected)
+    assert answer_time[-1] == pytest.approx(expected[-1])
+    for index in [slice(10, 500, 7), slice(None, None, -3), [0, 5, -1],
+                  expected > 3]:
+        assert np.allclose(answer_time[index], expected[index])
+    assert np.allclose(answer_time - expected, 0)
+
+
+def test_write_load_explicit(tmp_path):
+    from ecg_binary import write, load
+    filename = str(tmp_path / "strip.ecgb")
+    jittered = time + np.random.default_rng(0).uniform(0, 0.5, 2000) / rate
+    header = write(filename, jittered, voltage)
+    assert header["layout"] == "explicit"
+    answer_time, answer_voltage, header = load(filename)
+    assert np.array_equal(answer_time, jittered)
+
+
+def test_write_leads(tmp_path):
+    from ecg_binary import write, read_header
+    filename = str(tmp_path / "leads.ecgb")
+    write(filename, time, np.column_stack((voltage, -voltage)), units="uV",
+          names=["I", "II"])
+    header = read_header(filename)
+    assert header["num_leads"] == 2
+    assert header["names"] == ["I", "II"]
+    assert header["units"] == "uV"
+    with pytest.raises(ValueError):
+        write(filename, time, voltage, names=["I", "II"])
+
+
+def test_read_header_not_binary():
+    from ecg_binary import read_header, is_binary
+    assert is_binary("test_data/test_data1.csv") is False
+    with pytest.raises(ValueError):
+        read_header("test_data/test_data1.csv")
+
+
+def test_convert_analyze(tmp_path):
+    from ecg_binary import convert, is_binary
+    from ecg_analysis import analyze, read, read_chunks
+    output = convert("test_data/test_data11.csv",
+                     str(tmp_path / "test_data11.ecgb"))
+    assert is_binary(output)
+    csv_time, csv_voltage = read("test_data/test_data11.csv")
+    bin_time, bin_voltage = read(output)
+    assert np.allclose(bin_time, csv_time, atol=1e-3)
+    assert np.allclose(bin_voltage, csv_voltage, atol=1e-6)
+    chunks = list(read_chunks(output, 4096))
+    assert [len(chunk[0]) for chunk in chunks] == [4096, 4096, 1806]
+    assert analyze(output).bpm == analyze("test_data/test_data11.csv").bpm
+
+
+def test_convert_leads(tmp_path):
+    from ecg_binary import convert
+    from ecg_analysis import read_leads
+    filename = tmp_path / "leads.csv"
+    rows = ["time,I,II"] + ["{:.3f},{:.4f},{:.4f}".format(t, v, -v)
+                            for t, v in zip(time, voltage)]
+    filename.write_text("\n".join(rows))
+    output = convert(str(filename))
+    assert output == str(tmp_path / "leads.ecgb")
+    answer_time, answer_voltage, names = read_leads(output)
+    assert names == ["I", "II"]
+    assert answer_voltage.shape == (2000, 2)
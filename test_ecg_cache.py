@@ -0,0 +1,87 @@
+# test_ecg_cache.py
+
+import pytest
+import shutil
+
+
+def test_cached_analysis_hit(tmp_path, monkeypatch):
+    import ecg_cache
+    cache = ecg_cache.AnalysisCache(str(tmp_path / "cache"))
+    first = ecg_cache.cached_analysis("test_data/test_data1.csv", cache)
+
+    def fail(*args):
+        raise AssertionError("analyze should not run on a cache hit")
+    monkeypatch.setattr(ecg_cache, "analyze", fail)
+    copy = str(tmp_path / "renamed.csv")
+    shutil.copy("test_data/test_data1.csv", copy)
+    second = ecg_cache.cached_analysis(copy, cache)
+    assert first["bpm"] == second["bpm"] == 73
+    assert second["time_peaks"] == first["time_peaks"]
+    assert second["image"] == first["image"]
+    assert second["hrv"] == first["hrv"]
+    assert second["hrv"]["num_intervals"] == len(first["time_peaks"]) - 1
+    assert second["rr"] == first["rr"]
+
+
+def test_parameters_change_key(tmp_path):
+    from ecg_cache import AnalysisCache
+    cache = AnalysisCache(str(tmp_path))
+    answer = cache.key("test_data/test_data1.csv", band=[1, 50], notch=None)
+    assert answer != cache.key("test_data/test_data1.csv", band=[1, 50],
+                               notch=60)
+
+
+def test_version_invalidates(tmp_path, monkeypatch):
+    import ecg_cache
+    from ecg_analysis import analyze
+    cache = ecg_cache.AnalysisCache(str(tmp_path))
+    key = "entry"
+    cache.put(key, analyze("test_data/test_data1.csv"))
+    assert cache.get(key)["bpm"] == 73
+    monkeypatch.setattr(ecg_cache, "ANALYSIS_VERSION", -1)
+    assert cache.get(key) is None
+    assert cache.size() == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    import os
+    from ecg_cache import AnalysisCache
+    from ecg_analysis import analyze
+    analysis = analyze("test_data/test_data1.csv")
+    cache = AnalysisCache(str(tmp_path))
+    cache.put("a", analysis)
+    entry_size = cache.size()
+    cache.max_bytes = int(entry_size * 2.5)
+    cache.put("b", analysis)
+    os.utime(cache.paths("a")[0], (1, 1))
+    os.utime(cache.paths("b")[0], (2, 2))
+    cache.get("a")
+    cache.put("c", analysis)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_progressive_analysis(tmp_path):
+    from ecg_cache import AnalysisCache, progressive_analysis
+    cache = AnalysisCache(str(tmp_path))
+    results = list(progressive_analysis("test_data/test_data1.csv", cache,
+                                        seconds=10))
+    assert [r["provisional"] for r in results] == [True, False]
+    assert results[0]["image"] is None
+    assert results[0]["duration"] == pytest.approx(10, abs=0.01)
+    assert results[0]["png"].startswith(b"\x89PNG")
+    assert results[1]["bpm"] == 73
+    again = list(progressive_analysis("test_data/test_data1.csv", cache,
+                                      seconds=10))
+    assert [r["provisional"] for r in again] == [False]
+    assert again[0]["bpm"] == 73
+
+
+def test_progressive_analysis_short_file(tmp_path):
+    from ecg_cache import AnalysisCache, progressive_analysis
+    cache = AnalysisCache(str(tmp_path))
+    results = list(progressive_analysis("test_data/test_data1.csv", cache,
+                                        seconds=60))
+    assert [r["provisional"] for r in results] == [False]
+    assert results[0]["bpm"] == 73
@@ -0,0 +1,58 @@
+# test_ecg_detectors.py
+
+import pytest
+import numpy as np
+from ecg_analysis import read, filter, duration_calc
+
+
+def filtered_strip(filename):
+    time, voltage = read(filename)
+    rate = len(voltage) / duration_calc(time)
+    return filter(time, voltage), rate
+
+
+@pytest.mark.parametrize("filename, expected", [
+                         ("test_data/test_data1.csv", 34),
+                         ("test_data/test_data16.csv", 19),
+                         ("test_data/test_data22.csv", 37),
+                         ("test_data/test_data23.csv", 75)
+                         ])
+def test_pan_tompkins_beats(filename, expected):
+    from ecg_detectors import pan_tompkins
+    voltage, rate = filtered_strip(filename)
+    answer = pan_tompkins(voltage, rate)
+    assert len(answer) == expected
+
+
+def test_pan_tompkins_independent_of_chunks():
+    from ecg_detectors import pan_tompkins, PanTompkins
+    voltage, rate = filtered_strip("test_data/test_data5.csv")
+    detector = PanTompkins(rate)
+    chunks = [detector.process(voltage[i:i + 7])
+              for i in range(0, len(voltage), 7)]
+    answer = np.concatenate(chunks + [detector.finish()])
+    assert answer.tolist() == pan_tompkins(voltage, rate).tolist()
+
+
+def test_pan_tompkins_ignores_artifact():
+    from ecg_detectors import pan_tompkins, find_peaks_detector
+    voltage, rate = filtered_strip("test_data/test_data1.csv")
+    voltage = voltage.copy()
+    voltage[5000:5010] += 50
+    assert len(find_peaks_detector(voltage)) < 5
+    assert len(pan_tompkins(voltage, rate)) >= 33
+
+
+def test_detect_unknown():
+    from ecg_detectors import detect
+    with pytest.raises(ValueError):
+        detect([0.0, 1.0], 360, "unknown")
+
+
+def test_streaming_detector():
+    from ecg_stream import StreamingHeartRate, chunk_array
+    time, voltage = read("test_data/test_data1.csv")
+    rate = len(voltage) / duration_calc(time)
+    engine = StreamingHeartRate(rate, window=60, detector="pan_tompkins")
+    list(engine.stream(chunk_array(voltage, 256)))
+    assert abs(engine.bpm() - 73) < 3
@@ -0,0 +1,72 @@
+# test_ecg_filters.py
+
+import pytest
+import numpy as np
+
+
+def test_design_is_cached():
+    from ecg_filters import design_bandpass, cache_info
+    design_bandpass(360.0, (1, 50), 3)
+    hits = cache_info()["bandpass"].hits
+    answer = design_bandpass(360.0 + 1e-9, [1, 50], 3)
+    assert cache_info()["bandpass"].hits == hits + 1
+    assert answer.shape == (3, 6)
+
+
+def test_design_copy_protects_cache():
+    from ecg_filters import design_bandpass
+    sos = design_bandpass(500.0)
+    sos[:] = 0
+    assert design_bandpass(500.0).any()
+
+
+@pytest.mark.parametrize("notch, expected", [(None, False), (60, True)])
+def test_notch_removes_mains(notch, expected):
+    from ecg_filters import bandpass
+    rate = 500.0
+    t = np.arange(0, 10, 1 / rate)
+    hum = np.sin(2 * np.pi * 60 * t)
+    answer = bandpass(hum, rate, band=(1, 100), notch=notch)
+    removed = np.sqrt(np.mean(answer[500:-500] ** 2)) < 0.05
+    assert removed == expected
+
+
+def test_bandpass_many_matches_bandpass():
+    from ecg_filters import bandpass, bandpass_many
+    rng = np.random.default_rng(0)
+    strips = [rng.normal(size=2000) for _ in range(3)]
+    answer = bandpass_many(strips, 360.0)
+    for strip, filtered in zip(strips, answer):
+        assert np.allclose(filtered, bandpass(strip, 360.0))
+    uneven = bandpass_many([strips[0], strips[1][:1500]], 360.0)
+    assert np.allclose(uneven[1], bandpass(strips[1][:1500], 360.0))
+
+
+@pytest.mark.parametrize("rate, target, expected", [
+    (1000.0, 250, 4), (2000.0, 250, 8), (360.0, 250, 1), (1000.0, None, 1)])
+def test_decimation_factor(rate, target, expected):
+    from ecg_filters import decimation_factor
+    assert decimation_factor(rate, target) == expected
+
+
+def test_decimate_removes_aliases():
+    from ecg_filters import decimate
+    rate = 1000.0
+    t = np.arange(0, 4, 1 / rate)
+    ecg_band = np.sin(2 * np.pi * 10 * t)
+    alias = np.sin(2 * np.pi * 240 * t)
+    answer = decimate(ecg_band + alias, 4)
+    assert answer.shape == (1000,)
+    expected = ecg_band[::4]
+    assert np.abs(answer - expected)[50:-50].max() < 0.01
+    assert decimate(np.column_stack((t, t)), 4).shape == (1000, 2)
+
+
+def test_refine_peaks():
+    from ecg_filters import refine_peaks
+    x = np.arange(20, dtype=float)
+    voltage = -(x - 7.3) ** 2
+    voltage[15] = 100
+    answer = refine_peaks(voltage, [7, 19, 0])
+    assert answer[0] == pytest.approx(7.3)
+    assert list(answer[1:]) == [19, 0]
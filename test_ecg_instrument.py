@@ -0,0 +1,71 @@
+# test_ecg_instrument.py
+
+import json
+import pytest
+
+
+@pytest.fixture
+def recording():
+    import ecg_instrument
+    ecg_instrument.reset()
+    yield ecg_instrument
+    ecg_instrument.disable()
+    ecg_instrument.reset()
+
+
+def test_disabled_records_nothing(recording):
+    from ecg_analysis import analyze
+    analyze("test_data/test_data1.csv")
+    assert recording.stage_stats() == {}
+    assert recording.stage("read") is recording.stage("filter")
+
+
+def test_analyze_stages(recording):
+    from ecg_analysis import analyze
+    recording.enable(log=False)
+    analysis = analyze("test_data/test_data1.csv")
+    analysis.render()
+    stats = recording.stage_stats()
+    assert {"read", "preprocess", "filter", "peaks", "bpm", "plot",
+            "analyze"} <= set(stats)
+    assert stats["read"]["calls"] == 1
+    assert stats["read"]["samples"] == 10000
+    assert stats["plot"]["samples"] == 10000
+    assert stats["analyze"]["total_seconds"] >= \
+        stats["filter"]["total_seconds"]
+    assert stats["filter"]["samples_per_second"] > 0
+    assert stats["filter"]["peak_bytes"] is None
+
+
+def test_memory(recording):
+    import numpy as np
+    recording.enable(log=False, memory=True)
+    with recording.stage("outer", 1000):
+        with recording.stage("inner"):
+            np.ones(1000000)
+    stats = recording.stage_stats()
+    assert stats["inner"]["peak_bytes"] >= 8000000
+    assert stats["outer"]["peak_bytes"] >= 8000000
+    assert stats["outer"]["samples"] == 1000
+
+
+def test_json_sink(recording, tmp_path):
+    from ecg_analysis import read
+    sink = str(tmp_path / "stages.jsonl")
+    recording.enable(sink=sink, log=False)
+    read("test_data/test_data1.csv")
+    read("test_data/test_data2.csv")
+    with open(sink) as f:
+        records = [json.loads(line) for line in f]
+    assert [r["stage"] for r in records] == ["read", "read"]
+    assert records[0]["samples"] == 10000
+    assert records[0]["seconds"] > 0
+
+
+def test_log(recording, caplog):
+    import logging
+    from ecg_analysis import bpm_calc
+    recording.enable()
+    with caplog.at_level(logging.INFO):
+        assert bpm_calc(60, 70) == 70
+    assert "Stage bpm took" in caplog.text
@@ -0,0 +1,86 @@
+# test_ecg_preprocess.py
+
+import pytest
+import numpy as np
+
+rate = 250.0
+time = np.arange(5000) / rate
+voltage = np.sin(2 * np.pi * 1.2 * time)
+
+
+def test_effective_rate_ignores_rounding_and_gaps():
+    from ecg_preprocess import effective_rate
+    keep = np.ones(time.size, dtype=bool)
+    keep[1000:1003] = False
+    keep[3000:3500] = False
+    answer = effective_rate(np.round(time[keep] * 250 / 360, 3))
+    assert answer == pytest.approx(360, rel=1e-5)
+
+
+def test_uniform_leaves_regular_strip_alone():
+    from ecg_preprocess import uniform
+    rounded = np.round(time, 3)
+    answer_time, answer_voltage, sampling = uniform(rounded, voltage)
+    assert answer_time is rounded
+    assert answer_voltage is voltage
+    assert sampling["resampled"] is False
+    assert sampling["gaps"] == []
+    assert sampling["segments"] == [[0, 5000]]
+
+
+def test_uniform_fills_short_gap():
+    from ecg_preprocess import uniform
+    keep = np.ones(time.size, dtype=bool)
+    keep[1000:1003] = False
+    answer_time, answer_voltage, sampling = uniform(time[keep],
+                                                    voltage[keep])
+    assert answer_time.size == 5000
+    assert np.allclose(answer_time, time)
+    assert np.allclose(answer_voltage[keep], voltage[keep])
+    assert np.abs(answer_voltage - voltage).max() < 5e-3
+    assert sampling["gaps"] == [[time[999], time[1003], True]]
+    assert sampling["duration"] == pytest.approx(time[-1])
+
+
+def test_uniform_splits_long_gap():
+    from ecg_preprocess import uniform
+    keep = np.ones(time.size, dtype=bool)
+    keep[2000:2500] = False
+    answer_time, answer_voltage, sampling = uniform(time[keep],
+                                                    voltage[keep])
+    assert sampling["segments"] == [[0, 2000], [2000, 4500]]
+    assert sampling["gaps"][0][2] is False
+    assert sampling["duration"] == pytest.approx(4498 / rate)
+    assert np.allclose(answer_voltage, voltage[keep])
+
+
+def test_uniform_resamples_jitter():
+    from ecg_preprocess import uniform
+    rng = np.random.default_rng(0)
+    jittered = time + rng.uniform(-0.3, 0.3, time.size) / rate
+    measured = np.sin(2 * np.pi * 1.2 * jittered)
+    answer_time, answer_voltage, sampling = uniform(jittered, measured)
+    assert sampling["resampled"] is True
+    assert sampling["rate"] == pytest.approx(rate, rel=1e-3)
+    expected = np.sin(2 * np.pi * 1.2 * answer_time)
+    assert np.abs(answer_voltage - expected).max() < 1e-3
+    assert np.allclose(np.diff(answer_time), 1 / sampling["rate"])
+
+
+def test_uniform_drops_out_of_order_samples():
+    from ecg_preprocess import uniform
+    shuffled = time.copy()
+    shuffled[100] = shuffled[98]
+    answer_time, answer_voltage, sampling = uniform(shuffled, voltage)
+    assert answer_time.size == 5000
+    assert np.all(np.diff(answer_time) > 0)
+
+
+def test_uniform_leads():
+    from ecg_preprocess import uniform
+    keep = np.ones(time.size, dtype=bool)
+    keep[10] = False
+    leads = np.column_stack((voltage, -voltage))[keep]
+    answer_time, answer_voltage, sampling = uniform(time[keep], leads)
+    assert answer_voltage.shape == (5000, 2)
+    assert np.allclose(answer_voltage[:, 1], -answer_voltage[:, 0])
@@ -0,0 +1,60 @@
+# test_ecg_render.py
+
+import pytest
+import io
+import numpy as np
+from PIL import Image
+
+
+def test_minmax_decimate():
+    from ecg_render import minmax_decimate
+    time = np.arange(1000, dtype=float)
+    voltage = np.sin(time / 10)
+    voltage[503] = 5
+    t, v = minmax_decimate(time, voltage, 100)
+    assert len(t) == len(v) == 200
+    assert v.max() == 5
+    assert v.min() == voltage.min()
+
+
+def test_minmax_decimate_short_trace():
+    from ecg_render import minmax_decimate
+    t, v = minmax_decimate([0, 1, 2], [3, 4, 5], 100)
+    assert t.tolist() == [0, 1, 2]
+    assert v.tolist() == [3, 4, 5]
+
+
+@pytest.mark.parametrize("format, expected", [("png", "PNG"),
+                                              ("jpg", "JPEG"),
+                                              ("jpeg", "JPEG")])
+def test_render_trace(format, expected):
+    from ecg_render import render_trace
+    time = np.linspace(0, 10, 5000)
+    voltage = np.sin(time)
+    answer = render_trace(time, voltage, peaks=[100, 2000], width=320,
+                          height=240, format=format)
+    image = Image.open(io.BytesIO(answer))
+    assert image.format == expected
+    assert image.size == (320, 240)
+
+
+def test_render_reuses_figure():
+    import ecg_render
+    time = np.linspace(0, 10, 1000)
+    ecg_render.render_image(time, np.sin(time), width=200, height=100)
+    count = len(ecg_render._figures)
+    image = ecg_render.render_image(time, np.cos(time), width=200,
+                                    height=100)
+    assert len(ecg_render._figures) == count
+    assert image.size == (200, 100)
+
+
+@pytest.mark.parametrize("filename, expected", [
+                         ("test_data/test_data1.csv",
+                          "test_data/test_data1.png"),
+                         ("data/scv.csv", "data/scv.png"),
+                         ("ecg.v2.csv", "ecg.v2.png")
+                         ])
+def test_png_name(filename, expected):
+    from ecg_analysis import png_name
+    assert png_name(filename) == expected
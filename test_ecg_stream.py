@@ -0,0 +1,50 @@
+# test_ecg_stream.py
+
+import pytest
+import socket
+import numpy as np
+from ecg_analysis import read, duration_calc
+
+time_data1, voltage_data1 = read("test_data/test_data1.csv")
+rate_data1 = len(voltage_data1) / duration_calc(time_data1)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 256, 4096])
+def test_chunk_size_does_not_change_beats(chunk_size):
+    from ecg_stream import StreamingHeartRate, chunk_array
+    whole = StreamingHeartRate(rate_data1, window=60)
+    whole.process(voltage_data1)
+    chunked = StreamingHeartRate(rate_data1, window=60)
+    list(chunked.stream(chunk_array(voltage_data1, chunk_size)))
+    assert list(chunked.beats) == list(whole.beats)
+
+
+def test_streaming_bpm():
+    from ecg_stream import StreamingHeartRate, chunk_array
+    engine = StreamingHeartRate(rate_data1, report_interval=2.0)
+    reports = list(engine.stream(chunk_array(voltage_data1, 256)))
+    times = [t for t, bpm in reports]
+    assert times == sorted(times)
+    assert times[1] - times[0] == 2.0
+    assert abs(reports[-1][1] - 73) < 3
+
+
+def test_beats_are_bounded():
+    from ecg_stream import StreamingHeartRate, chunk_array
+    engine = StreamingHeartRate(rate_data1, window=5.0)
+    for _ in range(5):
+        list(engine.stream(chunk_array(voltage_data1, 512)))
+    assert len(engine.beats) <= engine.beats.maxlen
+
+
+def test_read_socket():
+    from ecg_stream import read_socket
+    sender, receiver = socket.socketpair()
+    samples = np.arange(10, dtype="<f4")
+    payload = samples.tobytes()
+    sender.sendall(payload[:7])
+    sender.sendall(payload[7:])
+    sender.close()
+    answer = np.concatenate(list(read_socket(receiver, chunk_size=3)))
+    receiver.close()
+    assert answer.tolist() == samples.tolist()
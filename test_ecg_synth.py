@@ -0,0 +1,87 @@
+# test_ecg_synth.py
+
+import pytest
+import numpy as np
+
+
+def test_chunks_do_not_change_recording():
+    from ecg_synth import SyntheticECG
+    generator = SyntheticECG(sampling_rate=500, num_leads=2, mains=0.05,
+                             artifact_rate=6, bad_rate=0.01,
+                             missing_rate=0.01, seed=3)
+    parts = [list(generator.chunks(40, chunk_seconds))
+             for chunk_seconds in (40, 7, 0.9)]
+    for part in parts[1:]:
+        for expected, answer in zip(parts[0][0], zip(*part)):
+            assert np.allclose(expected, np.concatenate(answer),
+                               equal_nan=True)
+
+
+def test_beats_follow_heart_rate():
+    from ecg_synth import SyntheticECG
+    generator = SyntheticECG(bpm=60, hrv=0.05)
+    beats = np.concatenate([b for t, v, b in generator.chunks(600)])
+    rr = np.diff(beats)
+    assert 60 / rr.mean() == pytest.approx(60, rel=0.03)
+    assert rr.std() / rr.mean() == pytest.approx(0.05, rel=0.4)
+    fixed = SyntheticECG(bpm=60, hrv=0)
+    beats = np.concatenate([b for t, v, b in fixed.chunks(10)])
+    assert np.allclose(beats, np.arange(10) + 0.5)
+
+
+def test_bad_and_missing_rows():
+    from ecg_synth import SyntheticECG
+    generator = SyntheticECG(bad_rate=0.02, missing_rate=0.05)
+    time, voltage, beats = next(generator.chunks(60))
+    assert 0.93 * 15000 < time.size < 0.97 * 15000
+    bad = np.isnan(time) | np.isnan(voltage)
+    assert 0.01 * time.size < np.count_nonzero(bad) < 0.03 * time.size
+    assert np.isnan(time).any() and np.isnan(voltage).any()
+
+
+def test_write_csv_matches_analysis(tmp_path):
+    from ecg_synth import write_csv, read_beats
+    from ecg_analysis import analyze
+    filename = str(tmp_path / "synthetic.csv")
+    beats_filename = str(tmp_path / "beats.txt")
+    num_beats = write_csv(filename, 60, chunk_seconds=13,
+                          beats_filename=beats_filename, sampling_rate=360,
+                          bpm=80, bad_rate=0.001)
+    beats = read_beats(beats_filename)
+    assert num_beats == beats.size
+    assert 76 <= beats.size <= 84
+    answer = analyze(filename)
+    assert len(answer.time_peaks) == beats.size
+    assert np.allclose(answer.time_peaks, beats, atol=2 / 360)
+
+
+def test_write_leads(tmp_path):
+    from ecg_synth import write_csv, write_binary
+    from ecg_analysis import read_leads
+    csv_filename = str(tmp_path / "synthetic.csv")
+    binary_filename = str(tmp_path / "synthetic.ecgb")
+    params = dict(sampling_rate=250, num_leads=3, missing_rate=0.01)
+    write_csv(csv_filename, 20, **params)
+    write_binary(binary_filename, 20, chunk_seconds=3, **params)
+    time, voltage, names = read_leads(csv_filename)
+    answer_time, answer_voltage, answer_names = read_leads(binary_filename)
+    assert names == answer_names == ["lead 1", "lead 2", "lead 3"]
+    assert voltage.shape == answer_voltage.shape
+    assert np.allclose(answer_time, time)
+    assert np.allclose(answer_voltage, voltage, atol=1e-4)
+
+
+def test_binary_writer_layouts(tmp_path):
+    from ecg_binary import BinaryWriter, load
+    filename = str(tmp_path / "strip.ecgb")
+    time = 2 + np.arange(1000) / 100
+    voltage = np.sin(time)
+    for keep, layout in [(np.ones(1000, dtype=bool), "uniform"),
+                         (np.arange(1000) % 9 != 4, "slots")]:
+        with BinaryWriter(filename, 100, start_time=2) as writer:
+            for block in np.array_split(np.flatnonzero(keep), 7):
+                writer.write(time[block], voltage[block])
+        answer_time, answer_voltage, header = load(filename)
+        assert header["layout"] == layout
+        assert np.allclose(answer_time, time[keep])
+        assert np.allclose(answer_voltage[:, 0], voltage[keep], atol=1e-6)